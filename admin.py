@@ -91,3 +91,4 @@ admin.site.register(handball.models.Site)
 admin.site.register(handball.models.Event)
 admin.site.register(handball.models.GamePlayerRelation)
 admin.site.register(handball.models.LeagueLevel)
+admin.site.register(handball.models.Season)
@@ -2,7 +2,7 @@
 """
     Resources for handball models.
 
-    TODO: Use ApiKeyAuthentication for models that need authentication. Implement custom authorization based on handball graph.
+    TODO: Use ApiKeyAuthentication for models that need authentication.
 """
 
 from tastypie.resources import ModelResource, ALL_WITH_RELATIONS, ALL
@@ -10,18 +10,151 @@ from tastypie import fields
 from handball.models import *
 from tastypie.authorization import DjangoAuthorization, Authorization
 from tastypie.authentication import Authentication, ApiKeyAuthentication
-from django.http import HttpResponse, HttpResponseBadRequest
-from tastypie.http import HttpUnauthorized
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotModified
+from tastypie.http import HttpUnauthorized, HttpCreated, HttpMethodNotAllowed
 from tastypie.serializers import Serializer
-from tastypie.utils.mime import determine_format
+from tastypie.exceptions import UnsupportedFormat, NotFound, ImmediateHttpResponse
+from tastypie.utils.mime import determine_format, build_content_type
 from auth.api import UserResource
-from django.core.mail import send_mail
+from handball.caching import CACHE_TIMEOUT, response_cache_key
+from handball.gamesheet import submit_game_sheet
+from handball.roles import RoleAuthorization, get_roles
+from handball.ticker import POLL_INTERVAL, feeds, format_cursor, parse_cursor, stream
+from handball.replicas import primary, primary_reads, read_only
+from handball.pagination import keyset_paginator
+from handball.instrumentation import InstrumentedModelResource, is_enabled, registry
+from handball.fieldsets import SparseModelResource
+from handball.serializers import HandballSerializer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.encoding import smart_str
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+import hashlib
+import json
+import time
+
+# Maximum number of seconds a ticker request waits for new events
+TICKER_MAX_WAIT = 30
+
+# Keys that validate_unique checks, mapped to their model and unique field
+UNIQUE_KEYS = {
+    'pass_number': (Person, 'pass_number'),
+    'game_number': (Game, 'number'),
+    'site_number': (Site, 'number')
+}
+
+# Number of values looked up per query, below SQLite's limit of query parameters
+UNIQUE_CHUNK_SIZE = 900
+
+# Default and maximum number of search results
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+
+class HandballModelResource(InstrumentedModelResource, SparseModelResource):
+    """
+        Base class of all handball resources. Requests are instrumented if enabled and may ask for sparse fieldsets,
+        a nesting depth and the compact formats of HandballSerializer.
+    """
+    def __init__(self, api_name=None):
+        super(HandballModelResource, self).__init__(api_name)
+
+        # Resources without a serializer of their own get the one with the compact formats
+        if type(self._meta.serializer) is Serializer:
+            self._meta.serializer = HandballSerializer()
+
+
+class CachedModelResource(HandballModelResource):
+    """
+        ModelResource that caches its serialized GET responses until an instance of one of the models in
+        'cached_models' is saved or deleted. Only suitable for resources whose responses don't depend on the user.
+    """
+    cached_models = ()
+
+    def cached_response(self, view, request, **kwargs):
+        """
+            Returns the cached response for this request or builds it with the given view
+        """
+        key = response_cache_key(self._meta.resource_name, self.cached_models, request.get_full_path(), self.determine_format(request))
+
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        # A lagging replica would cache stale data under the current versions
+        with primary_reads():
+            response = view(request, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']), CACHE_TIMEOUT)
+
+        return response
+
+    def get_list(self, request, **kwargs):
+        return self.cached_response(super(CachedModelResource, self).get_list, request, **kwargs)
+
+    def get_detail(self, request, **kwargs):
+        return self.cached_response(super(CachedModelResource, self).get_detail, request, **kwargs)
+
 
+def conditional_response(request, state, modified, build):
+    """
+        Returns a 304 response if the client's copy of the requested representation matches the given state, otherwise
+        the response built by the given callable along with ETag and Last-Modified headers
+    """
+    etag = '"{0}"'.format(hashlib.md5(smart_str(u'{0}|{1}'.format(request.get_full_path(), state))).hexdigest())
+    timestamp = int(time.mktime(modified.timetuple())) if modified else None
+
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        etags = [value.strip() for value in request.META['HTTP_IF_NONE_MATCH'].split(',')]
+        if etag in etags or '*' in etags:
+            return HttpResponseNotModified()
+    elif timestamp is not None:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+        if since is not None and timestamp <= since:
+            return HttpResponseNotModified()
+
+    response = build()
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+
+    return response
+
+
+class VersionedResourceMixin(object):
+    """
+        Mixin for resources of models with 'version' and 'modified' fields. Conditional GET requests are answered
+        from the versions alone, without dehydrating anything. Has to precede the ModelResource base class.
+    """
+    def get_list(self, request, **kwargs):
+        objects = self.obj_get_list(request=request, **self.remove_api_resource_names(kwargs))
+        state = objects.aggregate(count=Count('id'), versions=Sum('version'), modified=Max('modified'))
+
+        return conditional_response(request, u'{0}|{count}:{versions}:{modified}'.format(self.determine_format(request), **state),
+            state['modified'], lambda: super(VersionedResourceMixin, self).get_list(request, **kwargs))
+
+    def get_detail(self, request, **kwargs):
+        versions = self._meta.queryset.model.objects.filter(**self.remove_api_resource_names(kwargs)).values_list('version', 'modified')[:1]
+        if not versions:
+            return super(VersionedResourceMixin, self).get_detail(request, **kwargs)
+
+        version, modified = versions[0]
+        return conditional_response(request, u'{0}|{1}:{2}'.format(self.determine_format(request), version, modified),
+            modified, lambda: super(VersionedResourceMixin, self).get_detail(request, **kwargs))
 
-class UnionResource(ModelResource):
+
+class UnionResource(CachedModelResource):
     """
         Resource for Union model
     """
+    cached_models = (Union,)
+
     class Meta:
         queryset = Union.objects.all()
         allowed_methods = ['get']
@@ -32,10 +165,12 @@ class UnionResource(ModelResource):
         }
 
 
-class DistrictResource(ModelResource):
+class DistrictResource(CachedModelResource):
     """
         Resource for District model
     """
+    cached_models = (District, Union)
+
     union = fields.ForeignKey(UnionResource, 'union', full=True)
 
     class Meta:
@@ -55,16 +190,19 @@ class DistrictResource(ModelResource):
         return bundle
 
 
-class GroupResource(ModelResource):
+class GroupResource(VersionedResourceMixin, CachedModelResource):
     """
         Resource for Group model
     """
+    cached_models = (Group, Union, District, LeagueLevel)
+
     union = fields.ForeignKey(UnionResource, 'union', blank=True, null=True, full=True)
     district = fields.ForeignKey(DistrictResource, 'district', blank=True, null=True, full=True)
     level = fields.ForeignKey('handball.api.LeagueLevelResource', 'level', blank=True, null=True, full=True)
 
     class Meta:
         queryset = Group.objects.all()
+        excludes = ['version', 'modified']
         # allowed_methods = ['get', '']
         authentication = Authentication()
         authorization = Authorization()
@@ -77,14 +215,81 @@ class GroupResource(ModelResource):
         }
 
 
-class PersonResource(ModelResource):
+# Lookups needed to dehydrate the 'clubs' field of a person without further queries
+PERSON_CLUBS_PREFETCH = (
+    'clubmemberrelation_set__club__district__union',
+    'clubmemberrelation_set__club__home_site',
+    'clubmemberrelation_set__club__created_by'
+)
+
+
+class RoleModelResource(HandballModelResource):
+    """
+        ModelResource for objects within the handball graph. New objects are attributed to and instantly validated
+        based on the roles of the requesting user, changes and deletions have to pass the resource's authorization
+        for the respective object.
+    """
+    def auto_validate(self, bundle, roles):
+        """
+            Whether or not a new object can be validated right away
+        """
+        return False
+
+    def full_hydrate(self, bundle):
+        """
+            Fill created_by and validated fields of new objects before they are saved
+        """
+        bundle = super(RoleModelResource, self).full_hydrate(bundle)
+
+        if bundle.obj.pk is None and bundle.request is not None:
+            roles = get_roles(bundle.request)
+
+            if roles is not None:
+                if hasattr(bundle.obj, 'created_by_id'):
+                    bundle.obj.created_by_id = roles.person_id
+
+                if self.auto_validate(bundle, roles):
+                    bundle.obj.validated = True
+
+        return bundle
+
+    def obj_update(self, bundle, request=None, **kwargs):
+        if request is not None and not (bundle.obj and bundle.obj.pk):
+            try:
+                bundle.obj = self.obj_get(request, **kwargs)
+            except ObjectDoesNotExist:
+                pass
+
+        if request is not None and bundle.obj and bundle.obj.pk:
+            self.is_authorized(request, bundle.obj)
+
+        return super(RoleModelResource, self).obj_update(bundle, request, **kwargs)
+
+    def obj_delete(self, request=None, **kwargs):
+        obj = kwargs.pop('_obj', None)
+
+        if not hasattr(obj, 'delete'):
+            try:
+                obj = self.obj_get(request, **kwargs)
+            except ObjectDoesNotExist:
+                raise NotFound('A model instance matching the provided arguments could not be found.')
+
+        if request is not None:
+            self.is_authorized(request, obj)
+
+        return super(RoleModelResource, self).obj_delete(request, _obj=obj)
+
+
+class PersonResource(HandballModelResource):
     """
         Resource for Person model
     """
+    embedded_fields = ('clubs',)
+
     user = fields.OneToOneField(UserResource, 'user', blank=True, null=True, related_name='handball_profile')
 
     class Meta:
-        queryset = Person.objects.all()
+        queryset = Person.objects.select_related('user').prefetch_related(*PERSON_CLUBS_PREFETCH)
         authorization = Authorization()
         authentication = Authentication()
         excludes = ['activation_key', 'key_expires']
@@ -104,19 +309,20 @@ class PersonResource(ModelResource):
         """
             Insert 'display_name' field for use in UI.
             'Manually' add clubs since the ManyToMany field is (for various reasons) not specified in the Resource.
+            Memberships are read through the related manager so that clubs prefetched for a whole page are reused.
         """
         bundle.data['display_name'] = str(bundle.obj)
 
-        bundle.data['clubs'] = []
-        resource = ClubResource()
-        for membership in ClubMemberRelation.objects.filter(member=bundle.obj):
-            clubBundle = resource.build_bundle(obj=membership.club, request=bundle.request)
-            bundle.data['clubs'].append(resource.full_dehydrate(clubBundle))
+        if self.includes(bundle, 'clubs'):
+            bundle.data['clubs'] = []
+            resource = ClubResource()
+            for membership in bundle.obj.clubmemberrelation_set.all():
+                bundle.data['clubs'].append(self.dehydrate_nested(bundle, 'clubs', resource, membership.club))
 
         return bundle
 
 
-class ClubResource(ModelResource):
+class ClubResource(VersionedResourceMixin, RoleModelResource):
     """
         Resource for the Club model
     """
@@ -126,93 +332,65 @@ class ClubResource(ModelResource):
 
     class Meta:
         queryset = Club.objects.all()
+        excludes = ['version', 'modified']
         allowed_methods = ['get', 'post', 'put']
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = Authentication()
         filtering = {
             'district': ALL_WITH_RELATIONS,
             'managers': ALL_WITH_RELATIONS
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
-        """
-            Automatically fill created_by field if there is an authenticated user
-        """
-        bundle = super(TeamResource, self).obj_create(bundle, request)
-
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
-
-                # Set created_by field
-                bundle.obj.created_by = profile
-
-                bundle.obj.save()
-            except Person.DoesNotExist:
-                pass
 
-        return bundle
+# Lookups needed to dehydrate the 'players' field of a team, including each player's clubs, without further queries
+TEAM_PLAYERS_PREFETCH = ('teamplayerrelation_set__player__user',) + tuple('teamplayerrelation_set__player__' + lookup for lookup in PERSON_CLUBS_PREFETCH)
 
 
-class TeamResource(ModelResource):
+class TeamResource(VersionedResourceMixin, RoleModelResource):
     """
         Resource for Team model
     """
+    embedded_fields = ('players',)
+
     club = fields.ForeignKey(ClubResource, 'club', full=True)
     created_by = fields.ForeignKey(PersonResource, 'created_by', null=True)
+    display_name = fields.CharField('display_name', readonly=True)
 
     class Meta:
-        queryset = Team.objects.all()
+        queryset = Team.objects.select_related('club__district__union', 'club__home_site', 'club__created_by', 'created_by').prefetch_related(*TEAM_PLAYERS_PREFETCH)
+        excludes = ['version', 'modified']
         allowed_methods = ['get', 'post', 'put']
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = Authentication()
         filtering = {
             'club': ALL_WITH_RELATIONS,
             'managers': ALL_WITH_RELATIONS
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Automatically fill created_by field and instantly validate under certain conditions
+            Instantly validate if user is manager of the respective club
         """
-        bundle = super(TeamResource, self).obj_create(bundle, request)
-
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
-
-                # Set created_by field
-                bundle.obj.created_by = profile
-
-                try:
-                    # Instantly validate if user is manager of the respective club
-                    ClubManagerRelation.objects.get(manager=profile, club=bundle.obj.club, validated=True)
-                    bundle.obj.validated = True
-                except ClubManagerRelation.DoesNotExist:
-                    pass
-
-                bundle.obj.save()
-            except Person.DoesNotExist:
-                pass
-
-        return bundle
+        return roles.manages_club(bundle.obj.club_id)
 
     def dehydrate(self, bundle):
         """
-            Insert 'display_name' field for use in UI.
             'Manually' add players since the ManyToMany field is (for various reasons) not specified in the Resource.
+            Rosters are read through the related manager so that rosters prefetched for a whole page are reused.
         """
-        bundle.data['display_name'] = str(bundle.obj)
-
-        bundle.data['players'] = []
-        resource = PersonResource()
-        for membership in TeamPlayerRelation.objects.filter(player=bundle.obj, validated=True):
-            playerBundle = resource.build_bundle(obj=membership.player, request=bundle.request)
-            bundle.data['players'].append(resource.full_dehydrate(playerBundle))
+        if self.includes(bundle, 'players'):
+            bundle.data['players'] = []
+            resource = PersonResource()
+            for membership in bundle.obj.teamplayerrelation_set.all():
+                # Filter in python since a filtered queryset would bypass the prefetched rosters
+                if not membership.validated:
+                    continue
+
+                bundle.data['players'].append(self.dehydrate_nested(bundle, 'players', resource, membership.player))
         return bundle
 
 
-class SiteResource(ModelResource):
+class SiteResource(HandballModelResource):
     """
         Resource for Site model
     """
@@ -230,7 +408,7 @@ class SiteResource(ModelResource):
         return bundle
 
 
-class GameResource(ModelResource):
+class GameResource(VersionedResourceMixin, HandballModelResource):
     """
         Resource for the Game model
     """
@@ -244,13 +422,29 @@ class GameResource(ModelResource):
     group = fields.ForeignKey(GroupResource, 'group')
     site = fields.ForeignKey(SiteResource, 'site')
     events = fields.ToManyField('handball.api.EventResource', 'events', full=True)
+    display_name = fields.CharField('display_name', readonly=True)
 
     class Meta:
         queryset = Game.objects.all()
+        excludes = ['version', 'modified']
+        paginator_class = keyset_paginator('start', 'id')
         authorization = Authorization()
         authentication = Authentication()
         always_return_data = True
 
+    def full_hydrate(self, bundle):
+        """
+            Reject games whose officials are assigned to another game at the same time
+        """
+        bundle = super(GameResource, self).full_hydrate(bundle)
+
+        try:
+            OfficialAssignment.objects.check_game(bundle.obj)
+        except ValidationError, e:
+            raise ImmediateHttpResponse(response=HttpResponseBadRequest(' '.join(e.messages)))
+
+        return bundle
+
     def hydrate_m2m(self, bundle):
         """
             For some reason tastypie does not correctly create ManyToMany relations. This is a simple fix for that.
@@ -260,7 +454,7 @@ class GameResource(ModelResource):
         return super(GameResource, self).hydrate_m2m(bundle)
 
 
-class EventResource(ModelResource):
+class EventResource(HandballModelResource):
     """
         Resource for the Event model
     """
@@ -270,12 +464,13 @@ class EventResource(ModelResource):
 
     class Meta:
         queryset = Event.objects.all()
+        paginator_class = keyset_paginator('game', 'time', 'id')
         authorization = Authorization()
         authentication = Authentication()
         include_resource_uri = False
 
 
-class ClubMemberRelationResource(ModelResource):
+class ClubMemberRelationResource(RoleModelResource):
     """
         Resource for the ClubMemberRelation model
     """
@@ -284,7 +479,7 @@ class ClubMemberRelationResource(ModelResource):
 
     class Meta:
         queryset = ClubMemberRelation.objects.all()
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = ApiKeyAuthentication()
         always_return_data = True
         filtering = {
@@ -293,30 +488,14 @@ class ClubMemberRelationResource(ModelResource):
             'validated': ALL
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Instantly validate relation under certain condititions
+            Instantly validate if user is a manager or member of the respective club
         """
-        bundle = super(ClubMemberRelationResource, self).obj_create(bundle, request)
+        return roles.manages_club(bundle.obj.club_id) or roles.is_club_member(bundle.obj.club_id)
 
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
-
-                # Instantly validate if user is a manager or member of the respective club
-                managers = ClubManagerRelation.objects.filter(manager=profile, club=bundle.obj.club, validated=True)
-                members = ClubMemberRelation.objects.filter(member=profile, club=bundle.obj.club, validated=True)
 
-                if (len(managers) or len(members)):
-                    bundle.obj.validated = True
-                    bundle.obj.save()
-            except Person.DoesNotExist:
-                pass
-
-        return bundle
-
-
-class GamePlayerRelationResource(ModelResource):
+class GamePlayerRelationResource(HandballModelResource):
     """
         Resource for GamePlayerRelation resource
     """
@@ -326,12 +505,13 @@ class GamePlayerRelationResource(ModelResource):
 
     class Meta:
         queryset = GamePlayerRelation.objects.all()
+        paginator_class = keyset_paginator('game', 'id')
         authorization = Authorization()
         authentication = Authentication()
         always_return_data = True
 
 
-class TeamPlayerRelationResource(ModelResource):
+class TeamPlayerRelationResource(RoleModelResource):
     """
         Resource for TeamPlayerRelation resource
     """
@@ -340,7 +520,7 @@ class TeamPlayerRelationResource(ModelResource):
 
     class Meta:
         queryset = TeamPlayerRelation.objects.all()
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = ApiKeyAuthentication()
         always_return_data = True
         filtering = {
@@ -349,31 +529,15 @@ class TeamPlayerRelationResource(ModelResource):
             'validated': ALL
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Instantly validate relation under certain conditions
+            Instantly validate if user is a manager, player or coach of the respective team
         """
-        bundle = super(TeamPlayerRelationResource, self).obj_create(bundle, request)
-
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
-
-                club_managers = ClubManagerRelation.objects.filter(manager=profile, club=bundle.obj.team.club, validated=True)
-                team_managers = TeamManagerRelation.objects.filter(manager=profile, team=bundle.obj.team, validated=True)
-                players = TeamPlayerRelation.objects.filter(player=profile, team=bundle.obj.team, validated=True)
-                coaches = TeamCoachRelation.objects.filter(coach=profile, team=bundle.obj.team, validated=True)
+        team = bundle.obj.team
+        return roles.manages_team(team) or roles.plays_for(team.id) or roles.coaches(team.id)
 
-                if (len(club_managers) or len(team_managers) or len(players) or len(coaches)):
-                    bundle.obj.validated = True
-                    bundle.obj.save()
-            except Person.DoesNotExist:
-                pass
-
-        return bundle
 
-
-class TeamCoachRelationResource(ModelResource):
+class TeamCoachRelationResource(RoleModelResource):
     """
         Resource for TeamCoachRelation model
     """
@@ -382,7 +546,7 @@ class TeamCoachRelationResource(ModelResource):
 
     class Meta:
         queryset = TeamCoachRelation.objects.all()
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = Authentication()
         always_return_data = True
         filtering = {
@@ -391,30 +555,15 @@ class TeamCoachRelationResource(ModelResource):
             'validated': ALL
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Instantly validate relation under certain conditions
+            Instantly validate if user is a manager or coach of the respective team
         """
-        bundle = super(TeamCoachRelationResource, self).obj_create(bundle, request)
-
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
+        team = bundle.obj.team
+        return roles.manages_team(team) or roles.coaches(team.id)
 
-                club_managers = ClubManagerRelation.objects.filter(manager=profile, club=bundle.obj.team.club, validated=True)
-                managers = TeamManagerRelation.objects.filter(manager=profile, team=bundle.obj.team, validated=True)
-                coaches = TeamCoachRelation.objects.filter(coach=profile, team=bundle.obj.team, validated=True)
 
-                if (len(managers) or len(club_managers) or len(coaches)):
-                    bundle.obj.validated = True
-                    bundle.obj.save()
-            except Person.DoesNotExist:
-                pass
-
-        return bundle
-
-
-class ClubManagerRelationResource(ModelResource):
+class ClubManagerRelationResource(RoleModelResource):
     """
         Resource for ClubManagerRelation model
     """
@@ -423,7 +572,7 @@ class ClubManagerRelationResource(ModelResource):
 
     class Meta:
         queryset = ClubManagerRelation.objects.all()
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = Authentication()
         always_return_data = True
         filtering = {
@@ -432,28 +581,14 @@ class ClubManagerRelationResource(ModelResource):
             'validated': ALL
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Instantly validate under certain conditions
+            Instantly validate if user is a manager of the respective club
         """
-        bundle = super(ClubManagerRelationResource, self).obj_create(bundle, request)
+        return roles.manages_club(bundle.obj.club_id)
 
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
 
-                # Instantly validate if user is a manager of the respective club
-                ClubManagerRelation.objects.get(manager=profile, club=bundle.obj.club, validated=True)
-                bundle.obj.validated = True
-
-                bundle.obj.save()
-            except (Person.DoesNotExist, ClubManagerRelation.DoesNotExist):
-                pass
-
-        return bundle
-
-
-class TeamManagerRelationResource(ModelResource):
+class TeamManagerRelationResource(RoleModelResource):
     """
         Resource for TeamManagerRelation resource
     """
@@ -462,7 +597,7 @@ class TeamManagerRelationResource(ModelResource):
 
     class Meta:
         queryset = TeamManagerRelation.objects.all()
-        authorization = Authorization()
+        authorization = RoleAuthorization()
         authentication = Authentication()
         always_return_data = True
         filtering = {
@@ -471,31 +606,19 @@ class TeamManagerRelationResource(ModelResource):
             'validated': ALL
         }
 
-    def obj_create(self, bundle, request=None, **kwargs):
+    def auto_validate(self, bundle, roles):
         """
-            Instantly validate relation under certain conditions
+            Instantly validate if user is a manager of the respective team
         """
-        bundle = super(TeamManagerRelationResource, self).obj_create(bundle, request)
+        return bundle.obj.team_id in roles.managed_teams
 
-        if request.user:
-            try:
-                profile = Person.objects.get(user=request.user)
-
-                # Instantly validate if user is a manager of the respective team
-                TeamManagerRelation.objects.get(manager=profile, team=bundle.obj.team, validated=True)
-                bundle.obj.validated = True
-
-                bundle.obj.save()
-            except (Person.DoesNotExist, TeamManagerRelation.DoesNotExist):
-                pass
 
-        return bundle
-
-
-class LeagueLevelResource(ModelResource):
+class LeagueLevelResource(CachedModelResource):
     """
         Resource for LeagueLevel model
     """
+    cached_models = (LeagueLevel,)
+
     class Meta:
         queryset = LeagueLevel.objects.all()
         authorization = Authorization()
@@ -504,7 +627,7 @@ class LeagueLevelResource(ModelResource):
         allowed_methods = ['get']
 
 
-class GroupTeamRelationResource(ModelResource):
+class GroupTeamRelationResource(HandballModelResource):
     """
         Resource for GroupTeamRelation resource
     """
@@ -521,6 +644,66 @@ class GroupTeamRelationResource(ModelResource):
             'team': ALL_WITH_RELATIONS,
             'validated': ALL
         }
+        ordering = ['score', 'games', 'wins', 'draws', 'losses', 'goals_for', 'goals_against']
+
+
+class SeasonResource(CachedModelResource):
+    """
+        Resource for Season model
+    """
+    cached_models = (Season,)
+
+    class Meta:
+        queryset = Season.objects.all()
+        allowed_methods = ['get']
+        authorization = Authorization()
+        authentication = Authentication()
+        filtering = {
+            'name': ALL,
+            'archived': ALL
+        }
+
+
+class ArchivedEventResource(HandballModelResource):
+    """
+        Read-only resource for the events of archived games
+    """
+    class Meta:
+        queryset = ArchivedEvent.objects.all()
+        allowed_methods = []
+        include_resource_uri = False
+
+
+class ArchivedGamePlayerRelationResource(HandballModelResource):
+    """
+        Read-only resource for the players of archived games
+    """
+    class Meta:
+        queryset = ArchivedGamePlayerRelation.objects.all()
+        allowed_methods = []
+        include_resource_uri = False
+
+
+class ArchivedGameResource(HandballModelResource):
+    """
+        Read-only resource for the games of archived seasons. Teams, persons, groups and sites are referenced by id.
+    """
+    events = fields.ToManyField(ArchivedEventResource, 'events', full=True)
+    players = fields.ToManyField(ArchivedGamePlayerRelationResource, 'players', full=True)
+
+    class Meta:
+        queryset = ArchivedGame.objects.all()
+        allowed_methods = ['get']
+        paginator_class = keyset_paginator('start', 'id')
+        authorization = Authorization()
+        authentication = Authentication()
+        filtering = {
+            'season_id': ALL,
+            'group_id': ALL,
+            'home_id': ALL,
+            'away_id': ALL,
+            'start': ALL
+        }
 
 
 """
@@ -528,6 +711,19 @@ Non-resource api endpoints
 """
 
 
+def taken_values(model, field, values):
+    """
+        Returns those of the given values of a unique field that are already taken, looked up with chunked IN queries
+    """
+    values = list(values)
+    taken = set()
+    for start in range(0, len(values), UNIQUE_CHUNK_SIZE):
+        lookup = {'{0}__in'.format(field): values[start:start + UNIQUE_CHUNK_SIZE]}
+        taken.update(model.objects.filter(**lookup).values_list(field, flat=True))
+    return taken
+
+
+@read_only
 def is_unique(request):
     """
         Check if pass number already exists
@@ -535,28 +731,337 @@ def is_unique(request):
     data = {}
 
     if 'pass_number' in request.GET:
-        pass_number = request.GET['pass_number']
+        try:
+            pass_number = int(request.GET['pass_number'])
+        except ValueError:
+            return HttpResponseBadRequest('Invalid pass_number provided.')
+
+        data['pass_number'] = not taken_values(Person, 'pass_number', [pass_number])
 
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
+
+
+@csrf_exempt
+@read_only
+def validate_unique(request):
+    """
+        Check many candidate values of the keys in UNIQUE_KEYS at once. Values are passed as comma separated or repeated
+        GET parameters or as a POSTed object of lists, e.g. {"pass_number": [1, 2], "game_number": [3]}. Returns a map
+        of each value to whether or not it is still available per key.
+    """
+    serializer = HandballSerializer()
+
+    if request.method == 'POST':
         try:
-            Person.objects.get(pass_number=pass_number)
-            unique = False
-        except Person.DoesNotExist:
-            unique = True
-        except Person.MultipleObjectsReturned:
-            unique = False
+            candidates = serializer.deserialize(request.body, format=request.META.get('CONTENT_TYPE', 'application/json'))
+            if not isinstance(candidates, dict):
+                raise ValueError('Expected an object of lists.')
+        except (ValueError, UnsupportedFormat), e:
+            return HttpResponseBadRequest('Invalid request body: {0}'.format(e))
+    else:
+        candidates = dict((key, [value for param in request.GET.getlist(key) for value in param.split(',') if value])
+            for key in UNIQUE_KEYS if key in request.GET)
+
+    data = {}
+    for key, values in candidates.items():
+        if key not in UNIQUE_KEYS:
+            return HttpResponseBadRequest('Unknown key {0}, supported are {1}.'.format(key, ', '.join(sorted(UNIQUE_KEYS))))
+
+        try:
+            values = set(int(value) for value in (values if isinstance(values, list) else [values]))
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest('Invalid {0} provided.'.format(key))
+
+        model, field = UNIQUE_KEYS[key]
+        taken = taken_values(model, field, values)
+        data[key] = dict((str(value), value not in taken) for value in values)
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
+
+
+def standings(request):
+    """
+        Get the precomputed standings of a group, ordered by rank
+    """
+    if 'group' not in request.GET:
+        return HttpResponseBadRequest('Mandatory group parameter not provided.')
+
+    try:
+        group_id = int(request.GET['group'])
+    except ValueError:
+        return HttpResponseBadRequest('Invalid group provided. Please provide an integer.')
+
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    # The version of a group is bumped whenever its standings change
+    versions = Group.objects.filter(id=group_id).values_list('version', 'modified')[:1]
+    if not versions:
+        return HttpResponseNotFound('Group not found.')
+
+    def build():
+        rels = GroupTeamRelation.objects.filter(group=group_id).select_related('team')
+        rels = sorted(rels, key=lambda rel: (-rel.score, -rel.goal_difference, -rel.goals_for))
+
+        data = {'objects': []}
+        team_resource = TeamResource()
+        for rank, rel in enumerate(rels, 1):
+            data['objects'].append({
+                'rank': rank,
+                'team': team_resource.get_resource_uri(rel.team),
+                'team_name': rel.team.display_name,
+                'games': rel.games,
+                'wins': rel.wins,
+                'draws': rel.draws,
+                'losses': rel.losses,
+                'goals_for': rel.goals_for,
+                'goals_against': rel.goals_against,
+                'goal_difference': rel.goal_difference,
+                'points': rel.score
+            })
+
+        return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
+
+    version, modified = versions[0]
+    return conditional_response(request, u'{0}|{1}:{2}'.format(format, version, modified), modified, build)
+
+
+def player_stats(request):
+    """
+        Get the event statistics of a person per team and group from the rollups, optionally restricted to a team,
+        group or game
+    """
+    if 'person' not in request.GET:
+        return HttpResponseBadRequest('Mandatory person parameter not provided.')
+
+    try:
+        params = dict((param, int(request.GET[param])) for param in ('person', 'team', 'group', 'game') if param in request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid id provided. Please provide integers.')
+
+    fields = sorted(PlayerStats.objects.EVENT_FIELDS.values())
+    rows = []
+
+    if 'game' in params:
+        # A single game is counted from its events directly
+        counts = dict((PlayerStats.objects.EVENT_FIELDS.get(event_type), count) for event_type, count in
+            Event.objects.filter(game=params['game'], person=params['person']).values_list('event_type')
+            .annotate(count=Count('id')).order_by())
+        rows.append(dict((field, counts.get(field, 0)) for field in fields))
+    else:
+        stats = PlayerStats.objects.filter(person=params['person'])
+        if 'team' in params:
+            stats = stats.filter(team=params['team'])
+        if 'group' in params:
+            stats = stats.filter(group=params['group'])
+
+        team_resource = TeamResource()
+        group_resource = GroupResource()
+        for obj in stats:
+            row = dict((field, getattr(obj, field)) for field in fields)
+            row['team'] = team_resource.get_resource_uri(Team(id=obj.team_id))
+            row['group'] = group_resource.get_resource_uri(Group(id=obj.group_id)) if obj.group_id else None
+            rows.append(row)
+
+    totals = dict((field, sum(row[field] for row in rows)) for field in fields)
+    penalty_shots = totals['penalty_shot_goals'] + totals['penalty_shot_misses']
+    totals['penalty_shot_conversion'] = float(totals['penalty_shot_goals']) / penalty_shots if penalty_shots else None
+
+    data = {
+        'person': PersonResource().get_resource_uri(Person(id=params['person'])),
+        'totals': totals,
+        'objects': rows
+    }
+
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
 
-        data['pass_number'] = unique
+    return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
 
-    serializer = Serializer()
+
+def search(request):
+    """
+        Search persons, clubs and teams by name (and persons and clubs by city), tolerating typos. Returns the best
+        matches first.
+    """
+    if not request.GET.get('q'):
+        return HttpResponseBadRequest('Mandatory q parameter not provided.')
+
+    kinds = request.GET.get('kind', '').split(',') if request.GET.get('kind') else SearchEntry.objects.KINDS
+    if any(kind not in SearchEntry.objects.KINDS for kind in kinds):
+        return HttpResponseBadRequest('Invalid kind provided, supported are {0}.'.format(', '.join(SearchEntry.objects.KINDS)))
+
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid limit provided. Please provide an integer.')
+
+    resources = {'person': (PersonResource(), Person), 'club': (ClubResource(), Club), 'team': (TeamResource(), Team)}
+    objects = []
+    for entry in SearchEntry.objects.search(request.GET['q'], kinds, limit):
+        resource, model = resources[entry.kind]
+        objects.append({
+            'kind': entry.kind,
+            'id': entry.object_id,
+            'name': entry.label,
+            'score': round(entry.score, 2),
+            'resource_uri': resource.get_resource_uri(model(id=entry.object_id))
+        })
+
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpResponse(serializer.serialize({'objects': objects}, format, {}), content_type=build_content_type(format))
+
+
+def free_officials(request):
+    """
+        Get the officials of a district that are not assigned to a game between start and end
+    """
+    for param in ('district', 'start', 'end'):
+        if param not in request.GET:
+            return HttpResponseBadRequest('Mandatory {0} parameter not provided.'.format(param))
+
+    try:
+        district_id = int(request.GET['district'])
+    except ValueError:
+        return HttpResponseBadRequest('Invalid district provided. Please provide an integer.')
+
+    try:
+        start, end = parse_datetime(request.GET['start']), parse_datetime(request.GET['end'])
+    except ValueError:
+        start = end = None
+    if start is None or end is None or start >= end:
+        return HttpResponseBadRequest('Invalid period provided. Please provide start and end as YYYY-MM-DDTHH:MM.')
+
+    person_resource = PersonResource()
+    objects = [{
+        'id': person.id,
+        'name': unicode(person),
+        'resource_uri': person_resource.get_resource_uri(person)
+    } for person in OfficialAssignment.objects.free_officials(district_id, start, end).order_by('last_name', 'first_name')]
+
+    serializer = HandballSerializer()
 
     format = determine_format(request, serializer, default_format='application/json')
 
-    return HttpResponse(serializer.serialize(data, format, {}))
+    return HttpResponse(serializer.serialize({'objects': objects}, format, {}), content_type=build_content_type(format))
+
+
+def ticker_events(events):
+    """
+        Converts events read from a ticker feed into their api representation. Tombstones of deleted events are passed
+        on as they are.
+    """
+    person_resource = PersonResource()
+    team_resource = TeamResource()
+
+    return [event if event.get('deleted') else {
+        'id': event['id'],
+        'time': event['time'],
+        'event_type': event['event_type'],
+        'person': person_resource.get_resource_uri(Person(id=event['person'])),
+        'person_name': u'{0} {1}'.format(event['person__first_name'], event['person__last_name']),
+        'team': team_resource.get_resource_uri(Team(id=event['team']))
+    } for event in events]
+
+
+@primary
+def ticker(request):
+    """
+        Get the events of a game added, changed or deleted after the given cursor, waiting up to the given number of
+        seconds for new ones. Deleted events are returned as {'id': ..., 'deleted': true}. Clients accepting
+        text/event-stream get the new events pushed as server-sent events instead, until the stream is closed after
+        HANDBALL_TICKER_STREAM_DURATION seconds and the client reconnects.
+    """
+    if 'game' not in request.GET:
+        return HttpResponseBadRequest('Mandatory game parameter not provided.')
+
+    try:
+        game_id = int(request.GET['game'])
+        cursor = parse_cursor(request.GET.get('cursor', request.META.get('HTTP_LAST_EVENT_ID')))
+        wait = max(0, min(float(request.GET.get('wait', 0)), TICKER_MAX_WAIT))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid game, cursor or wait parameter.')
+
+    if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+        def server_sent_events():
+            yield 'retry: {0}\n\n'.format(POLL_INTERVAL * 1000)
+            for events, cursor_after in stream(game_id, cursor):
+                for event in ticker_events(events):
+                    yield 'id: {0}\ndata: {1}\n\n'.format(format_cursor(cursor_after), json.dumps(event))
+
+        response = HttpResponse(server_sent_events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    events, cursor = feeds.get(game_id).read(cursor, wait)
+    data = {'cursor': format_cursor(cursor), 'objects': ticker_events(events)}
+
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
+
+
+@csrf_exempt
+def game_sheet(request):
+    """
+        Submit a complete game sheet (game, lineup and events) in a single transaction
+    """
+    if request.method != 'POST':
+        return HttpMethodNotAllowed('Game sheets can only be submitted via POST.')
+
+    serializer = HandballSerializer()
+
+    try:
+        data = serializer.deserialize(request.body, format=request.META.get('CONTENT_TYPE', 'application/json'))
+        game = submit_game_sheet(data)
+    except ValidationError, e:
+        return HttpResponseBadRequest(', '.join(e.messages))
+    except (ValueError, UnsupportedFormat), e:
+        return HttpResponseBadRequest('Invalid game sheet: {0}'.format(e))
+
+    uri = GameResource().get_resource_uri(game)
+    data = {'id': game.id, 'resource_uri': uri}
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpCreated(serializer.serialize(data, format, {}), content_type=build_content_type(format), location=uri)
+
+
+def metrics(request):
+    """
+        Get the instrumentation metrics aggregated by this process. Only available from internal ips.
+    """
+    if request.META.get('REMOTE_ADDR') not in set(settings.INTERNAL_IPS) | set(['127.0.0.1']):
+        return HttpResponseForbidden('Metrics are only available from internal ips.')
+
+    data = {'enabled': is_enabled(), 'endpoints': registry.snapshot()}
+    if request.GET.get('reset'):
+        registry.reset()
+
+    serializer = HandballSerializer()
+
+    format = determine_format(request, serializer, default_format='application/json')
+
+    return HttpResponse(serializer.serialize(data, format, {}), content_type=build_content_type(format))
 
 
 def send_invitation(request):
     """
-        Send an invitation to another person via email. NOT TESTED YET
+        Send an invitation to another person via email. The mail is queued in the outbox and sent by the send_outbox
+        command, so the request doesn't wait for the mail server.
     """
     if request.user.is_authenticated() and request.user.is_active:
         if 'email' in request.POST:
@@ -567,24 +1072,29 @@ def send_invitation(request):
         if 'message' in request.POST:
             message = request.POST['message']
         else:
-            message = 'Tritt score.it bei und sehe deine Handballergebnisse online!'
+            message = u'Tritt score.it bei und sehe deine Handballergebnisse online!'
 
         profile = None
         if 'profile' in request.POST:
-            serializer = Serializer()
-            profile = serializer.deserialize(request.POST['profile'])
+            serializer = HandballSerializer()
+            try:
+                profile = serializer.deserialize(request.POST['profile'])
+                if not isinstance(profile, dict) or 'id' not in profile:
+                    raise ValueError('Expected an object with an id.')
+            except ValueError, e:
+                return HttpResponseBadRequest('Invalid profile provided: {0}'.format(e))
 
-        subject = '{0} {1} lädt dich zu Score.it ein!'.format(request.user.first_name, request.user.last_name)
+        subject = u'{0} {1} lädt dich zu Score.it ein!'.format(request.user.first_name, request.user.last_name)
 
         if profile:
-            profile_link = 'http://score-it.de/?a=invite&p={0}'.format(profile.id)
-            body = '{0} {1} hat ein Spielerprofil bei Score.it für dich erstellt. Melde dich jetzt bei Score.it an, um deine Handballergebnisse online abzurufen! Zum anmelden, klicke einfach folgenden Link: {3}'.format(request.user.first_name, request.user.last_name, profile_link)
+            profile_link = u'http://score-it.de/?a=invite&p={0}'.format(profile['id'])
+            body = u'{0} {1} hat ein Spielerprofil bei Score.it für dich erstellt. Melde dich jetzt bei Score.it an, um deine Handballergebnisse online abzurufen! Zum anmelden, klicke einfach folgenden Link: {2}'.format(request.user.first_name, request.user.last_name, profile_link)
         else:
-            body = '{0} {1} hat dir eine Einladung zu der Sportplatform Score.it geschickt:<br>{2}Um dich anzumelden, besuche einfach http://score-it.de/!'.format(request.user.first_name, request.user.last_name, message)
+            body = u'{0} {1} hat dir eine Einladung zu der Sportplatform Score.it geschickt:<br>{2}Um dich anzumelden, besuche einfach http://score-it.de/!'.format(request.user.first_name, request.user.last_name, message)
 
         sender = 'noreply@score-it.de'
         recipients = [email]
-        send_mail(subject, body, sender, recipients)
+        OutboxMessage.objects.enqueue(subject, body, sender, recipients)
         return HttpResponse('')
     else:
         return HttpUnauthorized('Authentication through active user required.')
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    Archival of the games of closed seasons.
+
+    The games of a season are moved along with their events and players in chunks. A chunk is first copied to the
+    archive tables and then deleted from the live tables, each step in a transaction of its own, so the archive may
+    live in a database of its own (see HANDBALL_ARCHIVE_DATABASE). A chunk that is interrupted between the two steps is
+    copied again by the next run, which replaces the rows copied before.
+
+    The live rows are deleted with plain SQL so no signal handlers run: the standings and player rollups of an
+    archived season stay as they are, and recompute() and rebuild() count the archived games along with the live ones.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from handball.models import *
+
+# Number of games moved per chunk
+CHUNK_SIZE = 500
+
+
+def copies(archive_model, objs, **values):
+    """
+        Returns unsaved archive_model copies of the given live objects with the given additional values
+    """
+    names = [field.attname for field in archive_model._meta.fields if field.attname not in values]
+    return [archive_model(**dict(((name, getattr(obj, name)) for name in names), **values)) for obj in objs]
+
+
+def insert(objs, using):
+    if not objs:
+        return
+
+    # Stay below the maximum number of query parameters of SQLite
+    model = objs[0].__class__
+    chunk_size = 900 // len(model._meta.fields)
+    for i in range(0, len(objs), chunk_size):
+        model.objects.db_manager(using).bulk_create(objs[i:i + chunk_size])
+
+
+def delete_rows(model, column, ids, using):
+    """
+        Deletes the rows of a model whose column has one of the given values, without sending any signals
+    """
+    db = connections[using]
+    db.cursor().execute('DELETE FROM {0} WHERE {1} IN ({2})'.format(db.ops.quote_name(model._meta.db_table),
+        db.ops.quote_name(column), ', '.join(['%s'] * len(ids))), ids)
+
+
+def archive_chunk(season, games):
+    """
+        Moves the given games of a season with their events and players to the archive
+    """
+    ids = [game.id for game in games]
+    events = list(Event.objects.filter(game__in=ids))
+    players = list(GamePlayerRelation.objects.filter(game__in=ids))
+
+    with transaction.commit_on_success(using=ARCHIVE_DATABASE):
+        # Rows of an earlier, interrupted run
+        delete_rows(ArchivedEvent, 'game_id', ids, ARCHIVE_DATABASE)
+        delete_rows(ArchivedGamePlayerRelation, 'game_id', ids, ARCHIVE_DATABASE)
+        delete_rows(ArchivedGame, 'id', ids, ARCHIVE_DATABASE)
+
+        insert(copies(ArchivedGame, games, season_id=season.id), ARCHIVE_DATABASE)
+        insert(copies(ArchivedEvent, events), ARCHIVE_DATABASE)
+        insert(copies(ArchivedGamePlayerRelation, players), ARCHIVE_DATABASE)
+
+    with transaction.commit_on_success():
+        for model in (Event, DeletedEvent, GamePlayerRelation, OfficialAssignment):
+            delete_rows(model, 'game_id', ids, DEFAULT_DB_ALIAS)
+        delete_rows(Game, 'id', ids, DEFAULT_DB_ALIAS)
+
+
+def archive_season(season, chunk_size=CHUNK_SIZE):
+    """
+        Moves the games of a closed season to the archive and returns their number. Raises a ValidationError if the
+        season isn't over yet.
+    """
+    if not season.closed:
+        raise ValidationError(u'Season {0} is not over yet.'.format(season.name))
+
+    count, groups = 0, set()
+    while True:
+        # Archived games are gone from the live table, so every chunk starts from the beginning
+        games = list(season.games().order_by('id')[:chunk_size])
+        if not games:
+            break
+
+        archive_chunk(season, games)
+        count += len(games)
+        groups.update(game.group_id for game in games if game.group_id)
+
+    season.archived = True
+    season.save()
+
+    # The games listed along with the groups are gone
+    bump_versions(Group.objects.filter(id__in=groups))
+
+    return count
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark of the api endpoints through Django's test client.
+
+    Every resource registered in urls.py is requested as list and as detail, as are the non-resource endpoints. For
+    every endpoint the number of queries, the latency percentiles and the response size are recorded in a report that
+    can be compared with the report of an earlier run.
+"""
+
+import datetime
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, connections
+from django.test.client import Client
+from handball.models import GroupTeamRelation, Person, PlayerStats
+from handball.synthetic import MODELS
+from handball.urls import v1_api
+
+
+def percentile(values, percent):
+    """
+        Returns the given percentile of a list of values using the nearest-rank method
+    """
+    values = sorted(values)
+    index = max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def get_endpoints():
+    """
+        Returns (name, uri, params) for all endpoints that can be benchmarked with the current data
+    """
+    endpoints = []
+
+    for name, resource in sorted(v1_api._registry.items()):
+        if 'get' not in resource._meta.list_allowed_methods:
+            continue
+
+        endpoints.append((name + ':list', resource.get_resource_list_uri(), {}))
+
+        obj = resource._meta.queryset.model.objects.order_by('id')[:1]
+        if obj and 'get' in resource._meta.detail_allowed_methods:
+            endpoints.append((name + ':detail', resource.get_resource_uri(obj[0]), {}))
+
+    group_ids = GroupTeamRelation.objects.values_list('group', flat=True)[:1]
+    if group_ids:
+        endpoints.append(('standings', reverse('handball.api.standings'), {'group': group_ids[0]}))
+
+    person_ids = PlayerStats.objects.values_list('person', flat=True)[:1]
+    if person_ids:
+        endpoints.append(('player_stats', reverse('handball.api.player_stats'), {'person': person_ids[0]}))
+
+    names = Person.objects.values_list('last_name', flat=True)[:1]
+    if names:
+        endpoints.append(('search', reverse('handball.api.search'), {'q': names[0][:4]}))
+
+    pass_numbers = list(Person.objects.exclude(pass_number=None).values_list('pass_number', flat=True)[:500])
+    if pass_numbers:
+        endpoints.append(('unique', reverse('handball.api.is_unique'), {'pass_number': pass_numbers[0]}))
+        endpoints.append(('unique:batch', reverse('handball.api.validate_unique'), {'pass_number': ','.join(map(str, pass_numbers))}))
+
+    return endpoints
+
+
+def get_credentials():
+    """
+        Returns GET parameters authenticating a benchmark user for resources with ApiKeyAuthentication
+    """
+    user, created = User.objects.get_or_create(username='benchmark')
+    return {'username': user.username, 'api_key': user.api_key.key}
+
+
+def benchmark_endpoint(client, uri, params, iterations):
+    """
+        Requests an endpoint the given number of times. The first request runs with an empty cache.
+    """
+    cache.clear()
+
+    latencies = []
+    queries = []
+    size = 0
+    for i in range(iterations):
+        for database in connections.all():
+            del database.queries[:]
+
+        started = time.time()
+        response = client.get(uri, params)
+        latencies.append((time.time() - started) * 1000)
+
+        if response.status_code != 200:
+            raise AssertionError('{0} returned status {1}: {2}'.format(uri, response.status_code, response.content[:500]))
+
+        # Reads may go to replicas or the archive
+        queries.append(sum(len(database.queries) for database in connections.all()))
+        size = len(response.content)
+
+    return {
+        'uri': uri,
+        'queries_first': queries[0],
+        'queries': percentile(queries, 50),
+        'bytes': size,
+        'ms_p50': round(percentile(latencies, 50), 2),
+        'ms_p90': round(percentile(latencies, 90), 2),
+        'ms_p99': round(percentile(latencies, 99), 2),
+        'ms_max': round(max(latencies), 2)
+    }
+
+
+def run_benchmark(iterations=20, limit=20):
+    """
+        Benchmarks all endpoints and returns the report
+    """
+    client = Client()
+    params = dict(get_credentials(), format='json', limit=limit)
+
+    databases = connections.all()
+    debug_cursors = [database.use_debug_cursor for database in databases]
+    for database in databases:
+        database.use_debug_cursor = True
+    try:
+        results = {}
+        for name, uri, endpoint_params in get_endpoints():
+            results[name] = benchmark_endpoint(client, uri, dict(params, **endpoint_params), iterations)
+    finally:
+        for database, debug_cursor in zip(databases, debug_cursors):
+            database.use_debug_cursor = debug_cursor
+
+    return {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'limit': limit,
+            'rows': dict((model._meta.object_name, model.objects.count()) for model in MODELS)
+        },
+        'endpoints': results
+    }
+
+
+def compare_reports(old, new, tolerance=0.2):
+    """
+        Returns a list of regressions of a new report against an old one. The query count must not grow at all,
+        latency and response size may grow by the given tolerance.
+    """
+    regressions = []
+
+    for name, result in sorted(new['endpoints'].items()):
+        if name not in old['endpoints']:
+            continue
+        before = old['endpoints'][name]
+
+        for key in ('queries_first', 'queries'):
+            if result[key] > before[key]:
+                regressions.append('{0}: {1} grew from {2} to {3}'.format(name, key, before[key], result[key]))
+
+        for key in ('ms_p50', 'ms_p90', 'bytes'):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append('{0}: {1} grew from {2} to {3}'.format(name, key, before[key], result[key]))
+
+    return regressions
+
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
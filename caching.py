@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    Versioned response cache for api resources.
+
+    Every model has a version number in the cache that is bumped whenever an instance of the model is saved or deleted.
+    Cached responses are keyed on the versions of all models they were built from, so a change makes exactly the
+    responses depending on the changed model unreachable. This only needs get/set/incr and therefore works with every
+    cache backend including local-memory and file caches.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
+# Seconds a cached response is kept at most
+CACHE_TIMEOUT = getattr(settings, 'HANDBALL_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def model_version_key(model):
+    return 'handball:version:{0}.{1}'.format(model._meta.app_label, model._meta.object_name)
+
+
+def model_versions(models):
+    """
+        Returns the current cache versions of the given models
+    """
+    keys = [model_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            # Start at the current time so a version that got evicted never revives stale responses
+            versions[key] = int(time.time() * 1000)
+            cache.add(key, versions[key], CACHE_TIMEOUT)
+
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(sender, **kwargs):
+    """
+        Signal handler that invalidates all cached responses built from instances of the sender model
+    """
+    key = model_version_key(sender)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), CACHE_TIMEOUT)
+
+
+def response_cache_key(name, models, path, format):
+    """
+        Builds the cache key for the response to the given full path in the given format
+    """
+    versions = ':'.join(str(version) for version in model_versions(models))
+    return 'handball:response:{0}:{1}:{2}'.format(name, versions, hashlib.md5(smart_str(path + '|' + format)).hexdigest())
+
+
+def person_cache_key(user_id):
+    return 'handball:person:{0}'.format(user_id)
+
+
+def roles_cache_key(person_id):
+    return 'handball:roles:{0}'.format(person_id)
+
+
+def remember_user(sender, instance, **kwargs):
+    """
+        Signal handler that remembers the stored user of a person before it is saved, so invalidate_person can drop the
+        cached person id of a user the person has been taken from
+    """
+    instance._previous_user_id = None
+    if instance.pk is not None and not kwargs.get('raw'):
+        users = sender.objects.filter(id=instance.pk).values_list('user', flat=True)[:1]
+        if users:
+            instance._previous_user_id = users[0]
+
+
+def invalidate_person(sender, instance, **kwargs):
+    """
+        Signal handler that drops the cached person ids of the old and the new user of a saved or deleted person. Bulk
+        updates of Person.user don't send signals and have to drop them themselves.
+    """
+    user_ids = set([instance.user_id, getattr(instance, '_previous_user_id', None)]) - set([None])
+    if user_ids:
+        cache.delete_many([person_cache_key(user_id) for user_id in user_ids])
+
+
+def invalidate_roles_of(person_ids):
+    """
+        Drops the cached role indexes of the given people, e.g. after relations have been changed in bulk
+    """
+    cache.delete_many([roles_cache_key(person_id) for person_id in person_ids])
+
+
+def invalidate_roles(sender, instance, **kwargs):
+    """
+        Signal handler that drops the cached role index of the person of a saved or deleted relation
+    """
+    for attname in ('manager_id', 'member_id', 'player_id', 'coach_id'):
+        person_id = getattr(instance, attname, None)
+        if person_id:
+            cache.delete(roles_cache_key(person_id))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    Client-controlled sparse fieldsets and nesting depth.
+
+    The 'fields' parameter lists the fields to return, nested fields are addressed with dots, e.g.
+    'fields=id,name,club.name'. The 'depth' parameter limits how deep related resources are embedded, relations
+    below it are returned as uris, e.g. 'depth=0' returns all relations of the requested objects as uris. Fields that
+    are not returned are not dehydrated at all, and relations that are not embedded are not joined or prefetched.
+"""
+
+from django.core.exceptions import ObjectDoesNotExist
+from tastypie.exceptions import BadRequest
+from tastypie.resources import ModelResource
+
+
+class DehydrationOptions(object):
+    """
+        The fields and depth requested by a client along with the path of the resource being dehydrated
+    """
+    def __init__(self, fields=None, depth=None):
+        self.fields = fields
+        self.depth = depth
+        self.path = []  # Names of the fields leading to the related resource that is being dehydrated
+
+    def includes(self, name):
+        """
+            Whether or not the field of the given name is requested at the current path
+        """
+        if self.fields is None:
+            return True
+
+        path = '.'.join(self.path + [name])
+        return any(field == path or field.startswith(path + '.') or path.startswith(field + '.') for field in self.fields)
+
+    def embeds(self, name):
+        """
+            Whether or not the related resource of the given field is requested in full at the current path
+        """
+        return self.includes(name) and (self.depth is None or len(self.path) < self.depth)
+
+
+def get_dehydration_options(request):
+    """
+        Returns the DehydrationOptions of a request or None if it asks for the full representation
+    """
+    if request is None:
+        return None
+
+    if not hasattr(request, '_handball_dehydration'):
+        request._handball_dehydration = None
+
+        fields = request.GET.get('fields')
+        depth = request.GET.get('depth')
+        if fields or depth:
+            try:
+                depth = int(depth) if depth else None
+            except ValueError:
+                depth = -1
+            if depth is not None and depth < 0:
+                raise BadRequest('Invalid depth provided. Please provide an integer >= 0.')
+
+            fields = set(field.strip() for field in fields.split(',') if field.strip()) if fields else None
+            request._handball_dehydration = DehydrationOptions(fields, depth)
+
+    return request._handball_dehydration
+
+
+class SparseModelResource(ModelResource):
+    """
+        ModelResource that dehydrates only the fields and nesting depth a client asks for
+    """
+    # Fields the dehydrate hook fills with related resources
+    embedded_fields = ()
+
+    def includes(self, bundle, name):
+        options = get_dehydration_options(bundle.request)
+        return options is None or options.includes(name)
+
+    def dehydrate_nested(self, bundle, name, resource, obj):
+        """
+            Returns the dehydrated related object of a field filled by a dehydrate hook, or its uri if it is below the requested depth
+        """
+        options = get_dehydration_options(bundle.request)
+        if options is not None and not options.embeds(name):
+            return resource.get_resource_uri(obj)
+
+        if options is not None:
+            options.path.append(name)
+        try:
+            return resource.full_dehydrate(resource.build_bundle(obj=obj, request=bundle.request))
+        finally:
+            if options is not None:
+                options.path.pop()
+
+    def dehydrate_uri(self, field_object, bundle):
+        """
+            Returns the uri(s) of a related field without loading the related objects where possible
+        """
+        resource = field_object.to_class()
+
+        if getattr(field_object, 'is_m2m', False):
+            related = getattr(bundle.obj, field_object.attribute)
+            return [resource.get_resource_uri(obj) for obj in related.all()]
+
+        try:
+            model_field = bundle.obj._meta.get_field(field_object.attribute)
+        except Exception:
+            model_field = None
+
+        if model_field is not None and hasattr(model_field, 'rel') and model_field.rel:
+            pk = getattr(bundle.obj, model_field.attname)
+            return resource.get_resource_uri(model_field.rel.to(pk=pk)) if pk is not None else None
+
+        try:
+            obj = getattr(bundle.obj, field_object.attribute)
+        except ObjectDoesNotExist:
+            obj = None
+        return resource.get_resource_uri(obj) if obj is not None else None
+
+    def full_dehydrate(self, bundle):
+        options = get_dehydration_options(bundle.request)
+        if options is None:
+            return super(SparseModelResource, self).full_dehydrate(bundle)
+
+        for field_name, field_object in self.fields.items():
+            if not options.includes(field_name):
+                continue
+
+            if getattr(field_object, 'dehydrated_type', None) == 'related':
+                # A touch leaky but it makes URI resolution work, like in tastypie's own full_dehydrate
+                field_object.api_name = self._meta.api_name
+                field_object.resource_name = self._meta.resource_name
+
+                if not field_object.full or not options.embeds(field_name):
+                    bundle.data[field_name] = self.dehydrate_uri(field_object, bundle)
+                    continue
+
+                options.path.append(field_name)
+                try:
+                    bundle.data[field_name] = field_object.dehydrate(bundle)
+                finally:
+                    options.path.pop()
+            else:
+                bundle.data[field_name] = field_object.dehydrate(bundle)
+
+            method = getattr(self, 'dehydrate_%s' % field_name, None)
+            if method:
+                bundle.data[field_name] = method(bundle)
+
+        bundle = self.dehydrate(bundle)
+
+        # Drop what the dehydrate hook added without being asked for
+        for name in bundle.data.keys():
+            if not options.includes(name):
+                del bundle.data[name]
+
+        return bundle
+
+    def get_object_list(self, request):
+        objects = super(SparseModelResource, self).get_object_list(request)
+
+        options = get_dehydration_options(request)
+        if options is not None and not options.path:
+            related = [name for name, field in self.fields.items() if getattr(field, 'dehydrated_type', None) == 'related' and field.full]
+            if not any(options.embeds(name) for name in related):
+                # Nothing is embedded, so there is nothing to join
+                objects.query.select_related = False
+            if not any(options.includes(name) for name in self.embedded_fields):
+                objects = objects.prefetch_related(None)
+
+        return objects
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+    Submission of a complete game sheet (game, lineup and events) in a single transaction.
+"""
+
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from handball.models import Game, GamePlayerRelation, Event, Person, Team, Group, Site, PlayerStats
+from handball.memberships import add_team_players
+from handball.ticker import feeds
+
+# Foreign keys of a game and the models they point to
+GAME_RELATIONS = {
+    'home': Team,
+    'away': Team,
+    'winner': Team,
+    'referee': Person,
+    'timer': Person,
+    'secretary': Person,
+    'supervisor': Person,
+    'group': Group,
+    'site': Site
+}
+
+EVENT_TYPES = set(choice for choice, label in Event._meta.get_field('event_type').choices)
+
+
+def parse_pk(value, name):
+    """
+        Accepts either a primary key or a resource uri like '/api/v1/person/3/' and returns the primary key
+    """
+    if value is None or value == '':
+        return None
+
+    match = re.match(r'^(?:.*/)?(\d+)/?$', unicode(value))
+    if not match:
+        raise ValidationError(u'Invalid reference "{0}" for {1}.'.format(value, name))
+    return int(match.group(1))
+
+
+def check_exist(model, ids, existing=None):
+    """
+        Raises a ValidationError if not all of the given primary keys exist. The existing primary keys are looked up
+        unless given.
+    """
+    ids = set(ids) - set([None])
+    if existing is None:
+        existing = model.objects.filter(id__in=ids).values_list('id', flat=True)
+    missing = ids - set(existing)
+    if missing:
+        raise ValidationError(u'{0} {1} does not exist.'.format(model._meta.object_name, ', '.join(str(pk) for pk in sorted(missing))))
+
+
+def submit_game_sheet(data):
+    """
+        Creates a game together with its lineup and events from a deserialized game sheet of the form
+
+            {
+                'game': {'start': ..., 'score_home': ..., 'home': ..., 'referee': ..., ...},
+                'players': [{'player': ..., 'team': ..., 'shirt_number': ...}, ...],
+                'events': [{'time': ..., 'event_type': ..., 'person': ..., 'team': ...}, ...]
+            }
+
+        Related objects can be given as primary keys or resource uris. Lineup and events are inserted in bulk and the
+        memberships derived from the lineup are applied set-based. Raises a ValidationError if the sheet is invalid,
+        in which case nothing is written.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('game'), dict):
+        raise ValidationError(u'Mandatory game data not provided.')
+
+    game_data = data['game']
+    game = Game()
+
+    for name, field in ((f.name, f) for f in Game._meta.fields):
+        if name in GAME_RELATIONS:
+            setattr(game, field.attname, parse_pk(game_data.get(name), name))
+        elif name in game_data and name != 'id':
+            setattr(game, name, game_data[name])
+
+    # Convert and validate plain fields here, relations are checked in bulk below
+    game.clean_fields(exclude=GAME_RELATIONS.keys())
+    game.validate_unique()
+    game.clean()
+
+    for name, field in ((f.name, f) for f in Game._meta.fields if f.name in GAME_RELATIONS):
+        if getattr(game, field.attname) is None and not field.null:
+            raise ValidationError(u'Mandatory game field {0} not provided.'.format(name))
+
+    teams = (game.home_id, game.away_id)
+    if game.winner_id is not None and game.winner_id not in teams:
+        raise ValidationError(u'The winner has to be the home or the away team.')
+
+    for name in ('players', 'events'):
+        items = data.get(name, [])
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValidationError(u'The {0} have to be a list of objects.'.format(name))
+
+    players = []
+    for item in data.get('players', []):
+        player = GamePlayerRelation(player_id=parse_pk(item.get('player'), 'player'), team_id=parse_pk(item.get('team'), 'team'),
+            shirt_number=item.get('shirt_number'))
+        player.clean_fields(exclude=['player', 'game', 'team'])
+        if player.team_id not in teams:
+            raise ValidationError(u'Players have to play for the home or the away team.')
+        players.append(player)
+
+    player_ids = [player.player_id for player in players]
+    if len(set(player_ids)) != len(player_ids):
+        raise ValidationError(u'Players can only be listed once.')
+
+    events = []
+    for item in data.get('events', []):
+        event = Event(time=item.get('time'), event_type=item.get('event_type'), person_id=parse_pk(item.get('person'), 'person'),
+            team_id=parse_pk(item.get('team'), 'team'))
+        event.clean_fields(exclude=['person', 'game', 'team'])
+        if event.team_id not in teams:
+            raise ValidationError(u'Events have to belong to the home or the away team.')
+        events.append(event)
+
+    check_exist(Person, [game.referee_id, game.timer_id, game.secretary_id, game.supervisor_id]
+        + [player.player_id for player in players] + [event.person_id for event in events])
+    home_away = Team.objects.only('display_name').in_bulk(teams)
+    check_exist(Team, teams, home_away)
+    check_exist(Group, [game.group_id])
+    check_exist(Site, [game.site_id])
+
+    # Saving the game takes the display names of its teams from the fetched objects
+    game.home, game.away = home_away[game.home_id], home_away[game.away_id]
+
+    # The events are recorded in the first version of the new game, so the live ticker sends them along with it (see
+    # record_event_changes)
+    game.version = 1
+    for event in events:
+        event.version = 1
+
+    with transaction.commit_on_success():
+        game.save()
+
+        for item in players + events:
+            item.game = game
+        GamePlayerRelation.objects.bulk_create(players)
+        Event.objects.bulk_create(events)
+
+        # Add players to their teams and update the player statistics, which bulk_create does not do through the signal handlers
+        add_team_players([(player.player_id, player.team_id) for player in players])
+        PlayerStats.objects.record_events(events, groups={game.id: game.group_id})
+
+    # Wake up the viewers of the game's live ticker, which bulk_create does not do through the signal handler
+    if events:
+        feeds.notify(game.id)
+
+    return game
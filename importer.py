@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+    Streaming import of season data: clubs, teams, persons, team rosters and group assignments.
+
+    Rows are read one at a time from CSV files (with a header line) or JSON-lines files and inserted in chunks with
+    bulk_create, so memory use only depends on the chunk size and the lookup maps, not on the size of the files.
+    Related objects are referenced by natural keys that are resolved through in-memory maps:
+
+        club:         name, district (name), home_site (site number, optional), validated
+        team:         club (name), name, validated
+        person:       first_name, last_name, pass_number, address, city, zip_code, birthday (YYYY-MM-DD), gender,
+                      mobile_number, validated
+        team_player:  player (pass number), club (name), team (name), validated
+        group_team:   group (id), club (name), team (name), validated
+
+    Rows whose object exists already are skipped, so an import can be repeated. bulk_create bypasses the signal
+    handlers and doesn't set the primary keys, so the ids assigned by the database are read back by natural key and the
+    work of the signal handlers is done per row (display names), per chunk (search index, versions, derived memberships)
+    or once at the end of the import (standings).
+"""
+
+import csv
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from handball.caching import invalidate_roles_of
+from handball.memberships import add_team_members
+from handball.models import *
+
+# Number of rows inserted per chunk
+CHUNK_SIZE = 500
+
+# The kinds of rows in the order they depend on each other
+KINDS = ('club', 'team', 'person', 'team_player', 'group_team')
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+def read_rows(path):
+    """
+        Yields (line number, row dict) of a CSV or JSON-lines (.jsonl) file
+    """
+    with open(path, 'rb') as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        else:
+            for number, row in enumerate(csv.DictReader(f), 2):
+                yield number, dict((key, value.decode('utf-8') if value is not None else None) for key, value in row.items() if key is not None)
+
+
+def to_text(value):
+    return unicode(value).strip() if value is not None else u''
+
+
+def to_int(value):
+    value = to_text(value)
+    return int(value) if value else None
+
+
+def to_bool(value):
+    return value is True or to_text(value).lower() in TRUE_VALUES
+
+
+def to_date(value):
+    value = to_text(value)
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def insert(model, objs):
+    # Stay below the maximum number of query parameters of SQLite
+    chunk_size = max(1, 900 // len(model._meta.fields))
+    for i in range(0, len(objs), chunk_size):
+        model.objects.bulk_create(objs[i:i + chunk_size])
+
+
+class SeasonImporter(object):
+    """
+        Imports rows of the different KINDS. Call finish() after all rows are imported.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.maps = {}
+        self.counts = dict((kind, [0, 0]) for kind in KINDS)  # kind -> [imported, skipped]
+        self.groups = set()  # Ids of the groups teams were added to
+
+    def lookup(self, name):
+        """
+            Returns the map of natural keys to ids of the given name, loaded from the database on first use
+        """
+        if name not in self.maps:
+            if name == 'district':
+                self.maps[name] = dict(District.objects.values_list('name', 'id'))
+            elif name == 'site':
+                self.maps[name] = dict(Site.objects.exclude(number=None).values_list('number', 'id'))
+            elif name == 'club':
+                self.maps[name] = dict(Club.objects.values_list('name', 'id'))
+            elif name == 'team':
+                self.maps[name] = dict(((club_id, name), pk) for pk, club_id, name in Team.objects.values_list('id', 'club', 'name'))
+            elif name == 'person':
+                self.maps[name] = dict(Person.objects.exclude(pass_number=None).values_list('pass_number', 'id'))
+            elif name == 'group':
+                self.maps[name] = dict((pk, pk) for pk in Group.objects.values_list('id', flat=True))
+        return self.maps[name]
+
+    def resolve(self, name, key, number):
+        """
+            Returns the id of the object with the given natural key, raises a ValidationError if there is none
+        """
+        try:
+            return self.lookup(name)[key]
+        except KeyError:
+            raise ValidationError(u'Line {0}: Unknown {1} {2}.'.format(number, name, key))
+
+    def resolve_team(self, row, number):
+        return self.resolve('team', (self.resolve('club', to_text(row.get('club')), number), to_text(row.get('team'))), number)
+
+    def import_rows(self, kind, rows):
+        """
+            Imports the given (line number, row) pairs of a kind
+        """
+        build = getattr(self, 'build_' + kind)
+        chunk, keys = [], set()
+
+        for number, row in rows:
+            try:
+                key, obj = build(row, number)
+            except (KeyError, ValueError), e:
+                raise ValidationError(u'Line {0}: Invalid {1} row: {2}'.format(number, kind, e))
+
+            # Rows that exist already or appeared earlier in the chunk are skipped
+            if obj is None or key in keys:
+                self.counts[kind][1] += 1
+                continue
+
+            chunk.append(obj)
+            keys.add(key)
+            if len(chunk) >= self.chunk_size:
+                self.flush(kind, chunk)
+                chunk, keys = [], set()
+
+        self.flush(kind, chunk)
+
+    def build_club(self, row, number):
+        name = to_text(row['name'])
+        if name in self.lookup('club'):
+            return name, None
+
+        site = to_int(row.get('home_site'))
+        return name, Club(name=name, validated=to_bool(row.get('validated')),
+            district_id=self.resolve('district', to_text(row['district']), number),
+            home_site_id=self.resolve('site', site, number) if site is not None else None)
+
+    def build_team(self, row, number):
+        key = (self.resolve('club', to_text(row['club']), number), to_text(row['name']))
+        if key in self.lookup('team'):
+            return key, None
+
+        return key, Team(club_id=key[0], name=key[1], validated=to_bool(row.get('validated')),
+            display_name=team_display_name(to_text(row['club']), key[1]))
+
+    def build_person(self, row, number):
+        pass_number = to_int(row.get('pass_number'))
+        if pass_number is not None and pass_number in self.lookup('person'):
+            return pass_number, None
+
+        # Persons without a pass number can't be told apart, so every one of them gets a key of its own
+        return pass_number if pass_number is not None else object(), Person(first_name=to_text(row['first_name']), last_name=to_text(row['last_name']),
+            address=to_text(row.get('address')), city=to_text(row.get('city')), zip_code=to_int(row.get('zip_code')),
+            birthday=to_date(row.get('birthday')), pass_number=pass_number, gender=to_text(row.get('gender')) or 'male',
+            mobile_number=to_text(row.get('mobile_number')), validated=to_bool(row.get('validated')))
+
+    def build_team_player(self, row, number):
+        key = (self.resolve('person', to_int(row['player']), number), self.resolve_team(row, number))
+        return key, TeamPlayerRelation(player_id=key[0], team_id=key[1], validated=to_bool(row.get('validated')))
+
+    def build_group_team(self, row, number):
+        key = (self.resolve('group', to_int(row['group']), number), self.resolve_team(row, number))
+        return key, GroupTeamRelation(group_id=key[0], team_id=key[1], validated=to_bool(row.get('validated')))
+
+    def flush(self, kind, objs):
+        """
+            Inserts a chunk of objects of a kind and does the work of the skipped signal handlers
+        """
+        if kind == 'team_player':
+            existing = set(TeamPlayerRelation.objects.filter(player__in=set(obj.player_id for obj in objs),
+                team__in=set(obj.team_id for obj in objs)).values_list('player', 'team'))
+            self.counts[kind][1] += len(objs)
+            objs = [obj for obj in objs if (obj.player_id, obj.team_id) not in existing]
+            self.counts[kind][1] -= len(objs)
+        elif kind == 'group_team':
+            existing = set(GroupTeamRelation.objects.filter(group__in=set(obj.group_id for obj in objs),
+                team__in=set(obj.team_id for obj in objs)).values_list('group', 'team'))
+            self.counts[kind][1] += len(objs)
+            objs = [obj for obj in objs if (obj.group_id, obj.team_id) not in existing]
+            self.counts[kind][1] -= len(objs)
+        elif kind == 'person':
+            # Persons without a pass number can't be read back after a bulk insert, so they are saved one by one and
+            # indexed by the signal handlers
+            for obj in objs:
+                if obj.pass_number is None:
+                    obj.save()
+            self.counts[kind][0] += len([obj for obj in objs if obj.pass_number is None])
+            objs = [obj for obj in objs if obj.pass_number is not None]
+
+        if not objs:
+            return
+
+        model = objs[0].__class__
+        insert(model, objs)
+        self.counts[kind][0] += len(objs)
+
+        # bulk_create doesn't set the primary keys, so the new objects are read back by their natural keys
+        if kind == 'club':
+            self.lookup('club').update(Club.objects.filter(name__in=[obj.name for obj in objs]).values_list('name', 'id'))
+        elif kind == 'team':
+            teams = Team.objects.filter(club__in=set(obj.club_id for obj in objs), name__in=set(obj.name for obj in objs))
+            self.lookup('team').update(((club_id, name), pk) for pk, club_id, name in teams.values_list('id', 'club', 'name'))
+        elif kind == 'person':
+            self.lookup('person').update(Person.objects.filter(pass_number__in=[obj.pass_number for obj in objs]).values_list('pass_number', 'id'))
+        elif kind == 'team_player':
+            for validated in (True, False):
+                add_team_members([(obj.player_id, obj.team_id) for obj in objs if obj.validated == validated], validated)
+            invalidate_roles_of(set(obj.player_id for obj in objs))
+            bump_versions(Team.objects.filter(id__in=set(obj.team_id for obj in objs)))
+        elif kind == 'group_team':
+            self.groups.update(obj.group_id for obj in objs)
+
+        if kind == 'club':
+            SearchEntry.objects.index(kind, [self.lookup('club')[obj.name] for obj in objs])
+        elif kind == 'team':
+            SearchEntry.objects.index(kind, [self.lookup('team')[(obj.club_id, obj.name)] for obj in objs])
+        elif kind == 'person':
+            SearchEntry.objects.index(kind, [self.lookup('person')[obj.pass_number] for obj in objs])
+
+    def finish(self):
+        """
+            Updates the standings of the imported groups
+        """
+        for group_id in self.groups:
+            GroupTeamRelation.objects.recompute(group_id)
+        bump_versions(Group.objects.filter(id__in=self.groups))
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+    Opt-in instrumentation of the api resources.
+
+    With the HANDBALL_INSTRUMENTATION setting enabled every resource request is profiled: the number and duration of
+    its SQL queries, the time spent in full_dehydrate per resource and nesting depth and the time spent serializing.
+    The profile is returned in X-Handball-* response headers and aggregated in an in-process registry that the metrics
+    view reads. When disabled, the resources only check a setting per request and a thread local per dehydrated object.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from tastypie.resources import ModelResource
+
+# Number of resource/depth pairs reported in the X-Handball-Dehydrate header
+DEHYDRATE_HEADER_ENTRIES = 10
+
+_state = threading.local()
+
+
+def is_enabled():
+    return getattr(settings, 'HANDBALL_INSTRUMENTATION', False)
+
+
+def current_profile():
+    """
+        Returns the profile of the request the current thread handles or None if instrumentation is disabled
+    """
+    return getattr(_state, 'profile', None)
+
+
+class Profile(object):
+    """
+        Timings of a single request
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.total_time = 0.0
+        self.query_count = 0
+        self.query_time = 0.0
+        self.serialize_time = 0.0
+        self.dehydrate = {}  # (resource name, depth) -> [calls, total seconds, self seconds]
+        self.nested = []  # Stack of the time spent in nested full_dehydrate calls of the running ones
+
+    def start_dehydrate(self):
+        self.nested.append(0.0)
+        return len(self.nested) - 1
+
+    def end_dehydrate(self, resource_name, depth, elapsed):
+        nested = self.nested.pop()
+        if self.nested:
+            self.nested[-1] += elapsed
+
+        entry = self.dehydrate.setdefault((resource_name, depth), [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += elapsed - nested
+
+    def finish(self, queries):
+        self.total_time = time.time() - self.started
+        self.query_count = len(queries)
+        self.query_time = sum(float(query['time']) for query in queries)
+
+    def headers(self):
+        """
+            Returns the profile as response headers, times are given in milliseconds
+        """
+        dehydrate = sorted(self.dehydrate.items(), key=lambda item: -item[1][2])[:DEHYDRATE_HEADER_ENTRIES]
+
+        return {
+            'X-Handball-Queries': str(self.query_count),
+            'X-Handball-Query-Time': '{0:.2f}'.format(self.query_time * 1000),
+            'X-Handball-Serialize-Time': '{0:.2f}'.format(self.serialize_time * 1000),
+            'X-Handball-Total-Time': '{0:.2f}'.format(self.total_time * 1000),
+            'X-Handball-Dehydrate': ', '.join('{0}@{1}={2:.2f}/{3:.2f}/{4}'.format(name, depth, total * 1000, own * 1000, calls)
+                for (name, depth), (calls, total, own) in dehydrate)
+        }
+
+
+class MetricsRegistry(object):
+    """
+        Aggregates the profiles of all requests per endpoint
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, profile):
+        with self.lock:
+            metrics = self.endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'queries': 0,
+                'query_ms': 0.0,
+                'serialize_ms': 0.0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'dehydrate': {}
+            })
+            metrics['requests'] += 1
+            metrics['queries'] += profile.query_count
+            metrics['query_ms'] += profile.query_time * 1000
+            metrics['serialize_ms'] += profile.serialize_time * 1000
+            metrics['total_ms'] += profile.total_time * 1000
+            metrics['max_ms'] = max(metrics['max_ms'], profile.total_time * 1000)
+
+            for (name, depth), (calls, total, own) in profile.dehydrate.items():
+                entry = metrics['dehydrate'].setdefault('{0}@{1}'.format(name, depth), {'calls': 0, 'ms': 0.0, 'self_ms': 0.0})
+                entry['calls'] += calls
+                entry['ms'] += total * 1000
+                entry['self_ms'] += own * 1000
+
+    def snapshot(self):
+        """
+            Returns a copy of the aggregated metrics
+        """
+        with self.lock:
+            return dict((endpoint, dict(metrics, dehydrate=dict((key, dict(entry)) for key, entry in metrics['dehydrate'].items())))
+                for endpoint, metrics in self.endpoints.items())
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentedModelResource(ModelResource):
+    """
+        ModelResource that profiles its requests if instrumentation is enabled
+    """
+    def dispatch(self, request_type, request, **kwargs):
+        if not is_enabled() or current_profile() is not None:
+            return super(InstrumentedModelResource, self).dispatch(request_type, request, **kwargs)
+
+        _state.profile = profile = Profile()
+        # Reads may go to replicas or the archive, so the queries of all databases are counted
+        databases = connections.all()
+        use_debug_cursors = [database.use_debug_cursor for database in databases]
+        offsets = [len(database.queries) for database in databases]
+        for database in databases:
+            database.use_debug_cursor = True
+        try:
+            response = super(InstrumentedModelResource, self).dispatch(request_type, request, **kwargs)
+            profile.finish([query for database, offset in zip(databases, offsets) for query in database.queries[offset:]])
+        finally:
+            for database, use_debug_cursor in zip(databases, use_debug_cursors):
+                database.use_debug_cursor = use_debug_cursor
+            _state.profile = None
+
+        for header, value in profile.headers().items():
+            response[header] = value
+        registry.record('{0}:{1}'.format(self._meta.resource_name, request_type), profile)
+
+        return response
+
+    def full_dehydrate(self, bundle):
+        profile = current_profile()
+        if profile is None:
+            return super(InstrumentedModelResource, self).full_dehydrate(bundle)
+
+        depth = profile.start_dehydrate()
+        started = time.time()
+        try:
+            return super(InstrumentedModelResource, self).full_dehydrate(bundle)
+        finally:
+            profile.end_dehydrate(self._meta.resource_name, depth, time.time() - started)
+
+    def serialize(self, request, data, format, options=None):
+        profile = current_profile()
+        if profile is None:
+            return super(InstrumentedModelResource, self).serialize(request, data, format, options)
+
+        started = time.time()
+        try:
+            return super(InstrumentedModelResource, self).serialize(request, data, format, options)
+        finally:
+            profile.serialize_time += time.time() - started
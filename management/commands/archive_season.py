@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from handball.archive import CHUNK_SIZE, archive_season
+from handball.models import Season
+
+
+class Command(BaseCommand):
+    """
+        Move the games of a closed season to the archive
+    """
+    args = '<season name>'
+    help = 'Moves the games of a closed season with their events and players from the live tables to the archive tables'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE, help='Number of games moved per transaction'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py archive_season {0}'.format(self.args))
+
+        try:
+            season = Season.objects.get(name=args[0])
+        except Season.DoesNotExist:
+            raise CommandError('Unknown season {0}'.format(args[0]))
+
+        try:
+            count = archive_season(season, chunk_size=options['chunk_size'])
+        except ValidationError, e:
+            raise CommandError(', '.join(e.messages))
+
+        self.stdout.write('Archived {0} games of season {1}\n'.format(count, season.name))
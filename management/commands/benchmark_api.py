@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from handball.benchmark import run_benchmark, write_report, read_report, compare_reports
+
+
+class Command(BaseCommand):
+    """
+        Benchmark all api endpoints against the current database
+    """
+    help = 'Requests every api endpoint and reports queries, latency percentiles and response sizes as JSON'
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', type='int', default=20, help='Requests per endpoint'),
+        make_option('--limit', type='int', default=20, help='Page size of list endpoints'),
+        make_option('--output', default='benchmark.json', help='File to write the report to'),
+        make_option('--compare', default=None, help='Earlier report to check for regressions'),
+        make_option('--tolerance', type='float', default=0.2, help='Allowed relative growth of latency and response size')
+    )
+
+    def handle(self, *args, **options):
+        report = run_benchmark(iterations=options['iterations'], limit=options['limit'])
+        write_report(report, options['output'])
+
+        for name, result in sorted(report['endpoints'].items()):
+            self.stdout.write('{0:40} {1:4} queries {2:9.2f} ms p50 {3:9.2f} ms p90 {4:9} bytes\n'.format(
+                name, result['queries'], result['ms_p50'], result['ms_p90'], result['bytes']))
+
+        if options['compare']:
+            regressions = compare_reports(read_report(options['compare']), report, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions found:\n' + '\n'.join(regressions))
+            self.stdout.write('No regressions against {0}\n'.format(options['compare']))
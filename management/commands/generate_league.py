@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from handball.synthetic import generate_league
+
+
+class Command(BaseCommand):
+    """
+        Fill the database with a synthetic league for benchmarking
+    """
+    help = 'Generates a synthetic league with about the given number of events (1000 up to 1000000)'
+    option_list = BaseCommand.option_list + (
+        make_option('--events', type='int', default=1000, help='Number of events to generate'),
+        make_option('--seed', type='int', default=None, help='Seed for reproducible data')
+    )
+
+    def handle(self, *args, **options):
+        counts = generate_league(events=options['events'], seed=options['seed'])
+
+        for name, count in sorted(counts.items()):
+            self.stdout.write('{0}: {1}\n'.format(name, count))
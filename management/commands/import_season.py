@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from handball.importer import CHUNK_SIZE, KINDS, SeasonImporter, read_rows
+
+
+class Command(BaseCommand):
+    """
+        Import clubs, teams, persons, rosters and group assignments of a season from CSV or JSON-lines files
+    """
+    help = 'Imports season data from CSV or JSON-lines (.jsonl) files in a single transaction, see handball/importer.py for the columns'
+    option_list = BaseCommand.option_list + tuple(
+        make_option('--{0}s'.format(kind.replace('_', '-')), dest=kind, default=None, help='File of {0} rows'.format(kind))
+        for kind in KINDS) + (
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE, help='Rows inserted per query'),
+    )
+
+    def handle(self, *args, **options):
+        if not any(options[kind] for kind in KINDS):
+            raise CommandError('No files given, use --{0}'.format(', --'.join('{0}s'.format(kind.replace('_', '-')) for kind in KINDS)))
+
+        importer = SeasonImporter(chunk_size=options['chunk_size'])
+        try:
+            with transaction.commit_on_success():
+                for kind in KINDS:
+                    if options[kind]:
+                        importer.import_rows(kind, read_rows(options[kind]))
+                importer.finish()
+        except (ValidationError, IOError), e:
+            raise CommandError('Import failed, nothing was imported: {0}'.format(', '.join(getattr(e, 'messages', [str(e)]))))
+
+        for kind in KINDS:
+            if options[kind]:
+                imported, skipped = importer.counts[kind]
+                self.stdout.write('{0}: {1} imported, {2} skipped\n'.format(kind, imported, skipped))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from handball.models import OfficialAssignment
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the assignments of the officials from the games
+    """
+    help = 'Rebuilds the assignments of referees, timers, secretaries and supervisors from the games'
+
+    def handle(self, *args, **options):
+        OfficialAssignment.objects.rebuild()
+
+        self.stdout.write('Rebuilt {0} assignments\n'.format(OfficialAssignment.objects.count()))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from handball.models import Team, update_game_display_names, update_team_display_names
+
+
+class Command(BaseCommand):
+    """
+        Bring the stored display names of all teams and games up to date
+    """
+    help = 'Updates the stored display names of all teams and games, e.g. after adding the display_name columns'
+
+    def handle(self, *args, **options):
+        with transaction.commit_on_success():
+            teams = update_team_display_names(Team.objects.all())
+            games = update_game_display_names(Team.objects.values('id'))
+
+        self.stdout.write('Updated the display names of {0} teams and {1} games\n'.format(len(teams), games))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from handball.models import PlayerStats
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the player statistics of the given teams (or of all teams) from their events
+    """
+    args = '[team_id ...]'
+    help = 'Rebuilds the player statistics of the given teams, or of all teams if none are given, from their events'
+
+    def handle(self, *args, **options):
+        PlayerStats.objects.rebuild(teams=[int(team_id) for team_id in args] or None)
+
+        self.stdout.write('Rebuilt {0} player statistics\n'.format(PlayerStats.objects.count()))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from handball.models import SearchEntry
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the name search index of the given kinds of objects (or of all kinds)
+    """
+    args = '[person|club|team ...]'
+    help = 'Rebuilds the name search index of the given kinds of objects, or of all kinds if none are given'
+
+    def handle(self, *args, **options):
+        for kind in args:
+            if kind not in SearchEntry.objects.KINDS:
+                raise CommandError('Unknown kind {0}, supported are {1}'.format(kind, ', '.join(SearchEntry.objects.KINDS)))
+
+        SearchEntry.objects.rebuild(args or SearchEntry.objects.KINDS)
+
+        self.stdout.write('Indexed {0} objects\n'.format(SearchEntry.objects.count()))
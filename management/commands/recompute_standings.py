@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from handball.models import Group, GroupTeamRelation
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the standings of the given groups (or of all groups) from their games
+    """
+    args = '[group_id ...]'
+    help = 'Rebuilds the standings of the given groups, or of all groups if none are given, from their games'
+
+    def handle(self, *args, **options):
+        group_ids = args or Group.objects.values_list('id', flat=True)
+
+        for group_id in group_ids:
+            GroupTeamRelation.objects.recompute(int(group_id))
+
+        self.stdout.write('Recomputed standings of {0} groups\n'.format(len(group_ids)))
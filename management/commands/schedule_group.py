@@ -0,0 +1,45 @@
+import datetime
+from optparse import make_option
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from handball.models import Group
+from handball.scheduler import schedule_group
+
+
+class Command(BaseCommand):
+    """
+        Schedule the double round robin of a group
+    """
+    args = '<group_id>'
+    help = 'Creates the games of a double round robin of the teams in a group, without double-booking teams, sites or officials'
+    option_list = BaseCommand.option_list + (
+        make_option('--first-day', help='Day of the first round, YYYY-MM-DD'),
+        make_option('--officials', default='', help='Comma separated ids of the persons officiating the games'),
+        make_option('--days-between-rounds', type='int', default=7, help='Days between the first days of two rounds'),
+        make_option('--kickoffs', default='18:00', help='Comma separated kickoff times, HH:MM'),
+        make_option('--duration', type='int', default=60, help='Duration of the games in minutes'),
+        make_option('--dry-run', action='store_true', default=False, help='Print the games without saving them')
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: manage.py schedule_group {0}'.format(self.args))
+
+        try:
+            group = Group.objects.get(id=int(args[0]))
+            first_day = datetime.datetime.strptime(options['first_day'] or '', '%Y-%m-%d').date()
+            officials = [int(official) for official in options['officials'].split(',') if official]
+            kickoffs = [datetime.datetime.strptime(kickoff, '%H:%M').time() for kickoff in options['kickoffs'].split(',')]
+        except (ValueError, Group.DoesNotExist), e:
+            raise CommandError('Invalid arguments: {0}'.format(e))
+
+        try:
+            games = schedule_group(group, first_day, officials, commit=not options['dry_run'], kickoffs=kickoffs,
+                days_between_rounds=options['days_between_rounds'], duration=options['duration'])
+        except ValidationError, e:
+            raise CommandError(', '.join(e.messages))
+
+        for game in games:
+            self.stdout.write('{0:%Y-%m-%d %H:%M} team {1} vs. team {2} at site {3}\n'.format(game.start, game.home_id, game.away_id, game.site_id))
+        self.stdout.write('{0} {1} games\n'.format('Would create' if options['dry_run'] else 'Created', len(games)))
@@ -0,0 +1,33 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from handball.models import OutboxMessage
+
+
+class Command(BaseCommand):
+    """
+        Send the queued mails of the outbox
+    """
+    help = 'Sends the queued mails that are due in batches over a single mail connection, optionally in a loop'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=50, help='Mails sent per connection'),
+        make_option('--loop', action='store_true', default=False, help='Keep sending, waiting --interval seconds whenever the outbox is drained'),
+        make_option('--interval', type='float', default=10, help='Seconds to wait for new mails in a loop'),
+        make_option('--requeue-failed', action='store_true', default=False, help='Queue the dead-lettered mails again first')
+    )
+
+    def handle(self, *args, **options):
+        if options['requeue_failed']:
+            self.stdout.write('Requeued {0} failed mails\n'.format(OutboxMessage.objects.requeue_failed()))
+
+        while True:
+            sent, failed = OutboxMessage.objects.deliver(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Sent {0} mails, {1} failed\n'.format(sent, failed))
+
+            # Full batches are followed by the next one right away
+            if sent + failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
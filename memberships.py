@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+    Set-based versions of the membership side effects the signal handlers in models.py apply to single rows.
+
+    Playing for a team makes a person a member of the team's club, the first player or coach of a team becomes its
+    manager, the first member of a club becomes its manager and a person's first club becomes the primary one.
+
+    The signal handlers queue the affected keys here. Within a reconciliation scope (a request handled by
+    MembershipReconciliationMiddleware or a reconcile_memberships() block) they are collected and applied in bulk when
+    the scope ends, otherwise they are applied right away.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count
+from handball.caching import invalidate_roles_of
+from handball.models import Team, TeamPlayerRelation, TeamManagerRelation, ClubMemberRelation, ClubManagerRelation, bump_versions
+
+
+def add_team_players(pairs, validated=True):
+    """
+        Adds the given (player id, team id) pairs to the respective team rosters if not there already
+        and applies the derived club memberships.
+    """
+    pairs = unique(pairs)
+    if not pairs:
+        return
+
+    existing = set(TeamPlayerRelation.objects.filter(player__in=set(p for p, t in pairs), team__in=set(t for p, t in pairs))
+        .values_list('player', 'team'))
+    created = [TeamPlayerRelation(player_id=player_id, team_id=team_id, validated=validated)
+        for player_id, team_id in pairs if (player_id, team_id) not in existing]
+    TeamPlayerRelation.objects.bulk_create(created)
+    invalidate_roles_of(set(rel.player_id for rel in created))
+    if created:
+        bump_versions(Team.objects.filter(id__in=set(rel.team_id for rel in created)))
+
+    add_team_members(pairs, validated)
+
+
+def add_team_members(pairs, validated=False):
+    """
+        Makes the people in the given (person id, team id) pairs members of the teams' clubs and
+        assigns the first of them as manager of teams that don't have one yet.
+    """
+    pairs = unique(pairs)
+    if not pairs:
+        return
+
+    team_ids = set(t for p, t in pairs)
+    clubs = dict(Team.objects.filter(id__in=team_ids).values_list('id', 'club'))
+    add_club_members([(person_id, clubs[team_id]) for person_id, team_id in pairs], validated)
+
+    # If first team member, assign as manager
+    managed = set(TeamManagerRelation.objects.filter(team__in=team_ids).values_list('team', flat=True))
+    managers = first_per_key((team_id, person_id) for person_id, team_id in pairs if team_id not in managed)
+    TeamManagerRelation.objects.bulk_create([TeamManagerRelation(team_id=team_id, manager_id=person_id)
+        for team_id, person_id in managers])
+
+
+def add_club_members(pairs, validated=False):
+    """
+        Adds the given (person id, club id) pairs as club memberships if not there already, assigns the first member
+        as manager of clubs that don't have one yet and marks the only club of a person as the primary one.
+    """
+    pairs = unique(pairs)
+    if not pairs:
+        return
+
+    person_ids = set(p for p, c in pairs)
+    club_ids = set(c for p, c in pairs)
+
+    existing = set(ClubMemberRelation.objects.filter(member__in=person_ids, club__in=club_ids).values_list('member', 'club'))
+    created = [ClubMemberRelation(member_id=person_id, club_id=club_id, validated=validated)
+        for person_id, club_id in pairs if (person_id, club_id) not in existing]
+    ClubMemberRelation.objects.bulk_create(created)
+    if created:
+        # Team rosters show the clubs of their players
+        bump_versions(Team.objects.filter(players__in=set(rel.member_id for rel in created)))
+
+    # If first member, make manager
+    managed = set(ClubManagerRelation.objects.filter(club__in=club_ids).values_list('club', flat=True))
+    managers = first_per_key((club_id, person_id) for person_id, club_id in pairs if club_id not in managed)
+    ClubManagerRelation.objects.bulk_create([ClubManagerRelation(club_id=club_id, manager_id=person_id, validated=True)
+        for club_id, person_id in managers])
+    invalidate_roles_of(set(rel.member_id for rel in created) | set(person_id for club_id, person_id in managers))
+
+    # If first club, make primary
+    single = (ClubMemberRelation.objects.filter(member__in=person_ids).values('member').annotate(clubs=Count('id'))
+        .filter(clubs=1).values_list('member', flat=True))
+    ClubMemberRelation.objects.filter(member__in=list(single), primary=False).update(primary=True)
+
+
+class Reconciliation(object):
+    """
+        Collects the keys affected by saves within a reconciliation scope
+    """
+    def __init__(self):
+        self.team_players = []  # (player id, team id) of players that played a game for a team
+        self.team_members = []  # ((person id, team id), validated) of players and coaches of a team
+        self.club_members = []  # (person id, club id) of club memberships
+
+    def apply(self):
+        """
+            Applies the derived memberships of all collected keys
+        """
+        with transaction.commit_on_success():
+            add_team_players(self.team_players)
+
+            team_members = first_per_key(self.team_members)
+            add_team_members([key for key, validated in team_members if validated], True)
+            add_team_members([key for key, validated in team_members if not validated], False)
+
+            add_club_members(self.club_members)
+
+
+_state = threading.local()
+
+
+def begin_reconciliation():
+    """
+        Starts collecting affected keys instead of applying their derived memberships right away.
+        Returns False if a reconciliation scope is active already.
+    """
+    if getattr(_state, 'reconciliation', None) is not None:
+        return False
+
+    _state.reconciliation = Reconciliation()
+    return True
+
+
+def end_reconciliation(apply=True):
+    """
+        Ends the active reconciliation scope and applies the derived memberships of all collected keys
+    """
+    reconciliation = getattr(_state, 'reconciliation', None)
+    _state.reconciliation = None
+
+    if reconciliation is not None and apply:
+        reconciliation.apply()
+
+
+@contextmanager
+def reconcile_memberships():
+    """
+        Defers the derived memberships of all saves within the block and applies them in bulk at its end.
+        Blocks can be nested, in which case everything is applied at the end of the outermost one.
+    """
+    started = begin_reconciliation()
+    try:
+        yield
+    except:
+        if started:
+            end_reconciliation(apply=False)
+        raise
+
+    if started:
+        end_reconciliation()
+
+
+def queue_team_player(player_id, team_id):
+    """
+        Queues a player that played a game for a team
+    """
+    reconciliation = getattr(_state, 'reconciliation', None)
+    if reconciliation is None:
+        add_team_players([(player_id, team_id)])
+    else:
+        reconciliation.team_players.append((player_id, team_id))
+
+
+def queue_team_member(person_id, team_id, validated):
+    """
+        Queues a player or coach of a team
+    """
+    reconciliation = getattr(_state, 'reconciliation', None)
+    if reconciliation is None:
+        add_team_members([(person_id, team_id)], validated)
+    else:
+        reconciliation.team_members.append(((person_id, team_id), validated))
+
+
+def queue_club_member(person_id, club_id):
+    """
+        Queues a club membership
+    """
+    reconciliation = getattr(_state, 'reconciliation', None)
+    if reconciliation is None:
+        add_club_members([(person_id, club_id)])
+    else:
+        reconciliation.club_members.append((person_id, club_id))
+
+
+def unique(pairs):
+    """
+        Removes duplicates from a sequence of pairs, preserving their order
+    """
+    seen = set()
+    result = []
+    for pair in pairs:
+        if pair not in seen:
+            seen.add(pair)
+            result.append(pair)
+    return result
+
+
+def first_per_key(pairs):
+    """
+        Returns the first (key, value) pair for every key, preserving their order
+    """
+    seen = set()
+    result = []
+    for key, value in pairs:
+        if key not in seen:
+            seen.add(key)
+            result.append((key, value))
+    return result
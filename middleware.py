@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+    Middleware for handball requests.
+"""
+
+from handball.memberships import begin_reconciliation, end_reconciliation
+from handball.replicas import SAFE_METHODS, begin_replica_reads, end_replica_reads
+
+
+class MembershipReconciliationMiddleware(object):
+    """
+        Collects the memberships derived from all saves during a request and applies them in bulk once the request
+        has been handled. Add 'handball.middleware.MembershipReconciliationMiddleware' to MIDDLEWARE_CLASSES, after
+        TransactionMiddleware if that is used.
+    """
+    def process_request(self, request):
+        begin_reconciliation()
+
+    def process_response(self, request, response):
+        end_reconciliation()
+        return response
+
+    def process_exception(self, request, exception):
+        # Saves of a failed request may have been rolled back, so don't derive anything from them
+        end_reconciliation(apply=False)
+
+
+class ReplicaMiddleware(object):
+    """
+        Lets safe requests and views decorated with replicas.read_only read from a replica, see handball.replicas.
+        Add 'handball.middleware.ReplicaMiddleware' to MIDDLEWARE_CLASSES.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'read_only', request.method in SAFE_METHODS):
+            begin_replica_reads()
+
+    def process_response(self, request, response):
+        end_replica_reads()
+        return response
+
+    def process_exception(self, request, exception):
+        end_replica_reads()
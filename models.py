@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from django.db import models
+import datetime
+
+from django.conf import settings
+from django.db import models, connection, connections, transaction, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import F
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save, m2m_changed
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMessage, get_connection
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
 from django.utils.translation import ugettext as _
 from tastypie.models import create_api_key
+from handball.caching import bump_model_version, invalidate_person, invalidate_roles, invalidate_roles_of, remember_user
+from handball.search import MIN_SIMILARITY, normalize, rank, trigrams
+
+# Alias of the database holding the games of archived seasons
+ARCHIVE_DATABASE = getattr(settings, 'HANDBALL_ARCHIVE_DATABASE', DEFAULT_DB_ALIAS)
 
 
 class Union(models.Model):
@@ -45,6 +56,9 @@ class Club(models.Model):
     managers = models.ManyToManyField('Person', blank=True, related_name='clubs_managed', through='ClubManagerRelation')  # People with administrative rights limited to this club
     created_by = models.ForeignKey('Person', blank=True, null=True, related_name='clubs_created')  # Person this club was created by
 
+    version = models.IntegerField(default=0)  # Bumped whenever the club or data shown along with it changes, see VERSION_DEPENDENCIES
+    modified = models.DateTimeField(auto_now=True)  # Time of the last version bump
+
     def __unicode__(self):
         return self.name
 
@@ -62,8 +76,12 @@ class Team(models.Model):
     managers = models.ManyToManyField('Person', blank=True, related_name='teams_managed', through='TeamManagerRelation')  # People with administrative rights limited to this team
     created_by = models.ForeignKey('Person', blank=True, null=True, related_name='teams_created')  # Person this team was created by
 
+    display_name = models.CharField(max_length=101, editable=False)  # Club and team name, maintained by team_pre_save and club_post_save
+    version = models.IntegerField(default=0)  # Bumped whenever the team or data shown along with it changes, see VERSION_DEPENDENCIES
+    modified = models.DateTimeField(auto_now=True)  # Time of the last version bump
+
     def __unicode__(self):
-        return self.club.name + ' ' + self.name
+        return self.display_name or team_display_name(self.club.name, self.name)
 
 
 class LeagueLevel(models.Model):
@@ -97,20 +115,127 @@ class Group(models.Model):
     teams = models.ManyToManyField('Team', related_name='groups', through='GroupTeamRelation')  # Teams playing in this group
     managers = models.ManyToManyField('Person', blank=True, related_name='groups_managed', through='GroupManagerRelation')  # People with administrative rights for this group
 
+    version = models.IntegerField(default=0)  # Bumped whenever the group or data shown along with it changes, see VERSION_DEPENDENCIES
+    modified = models.DateTimeField(auto_now=True)  # Time of the last version bump
+
     def __unicode__(self):
         return u'{0}: {1} {2} {3}'.format(self.kind, self.name, self.gender, self.age_group)
 
 
+class StandingsManager(models.Manager):
+    """
+        Manager for GroupTeamRelation that maintains the standings of a group
+    """
+    WIN_POINTS = 2
+    DRAW_POINTS = 1
+
+    def outcome(self, game, team_id):
+        """
+            Returns the standings increments (points, wins, draws, losses) of a game for the given team
+        """
+        if not game.winner_id:
+            return (self.DRAW_POINTS, 0, 1, 0)
+        elif game.winner_id == team_id:
+            return (self.WIN_POINTS, 1, 0, 0)
+        else:
+            return (0, 0, 0, 1)
+
+    def record_game(self, game):
+        """
+            Adds the result of a new game to the standings of its group. The increments are applied by the database
+            so concurrently recorded games can not overwrite each other.
+        """
+        if not game.played:
+            return
+
+        sides = ((game.home_id, game.score_home, game.score_away), (game.away_id, game.score_away, game.score_home))
+
+        for team_id, goals_for, goals_against in sides:
+            points, wins, draws, losses = self.outcome(game, team_id)
+
+            increments = dict(score=F('score') + points, games=F('games') + 1, wins=F('wins') + wins, draws=F('draws') + draws,
+                losses=F('losses') + losses, goals_for=F('goals_for') + goals_for, goals_against=F('goals_against') + goals_against)
+
+            if not self.filter(group=game.group_id, team=team_id).update(**increments):
+                # Add team to group if not already in it
+                sid = transaction.savepoint()
+                try:
+                    # Inserted without signals since the game bumps the version of the group already
+                    self.bulk_create([GroupTeamRelation(group_id=game.group_id, team_id=team_id, score=points, games=1, wins=wins,
+                        draws=draws, losses=losses, goals_for=goals_for, goals_against=goals_against)])
+                    transaction.savepoint_commit(sid)
+                except IntegrityError:
+                    # Another game has added the team in the meantime
+                    transaction.savepoint_rollback(sid)
+                    self.filter(group=game.group_id, team=team_id).update(**increments)
+
+    def recompute(self, group):
+        """
+            Rebuilds the standings of a group from its live and archived games with one aggregate query per table
+        """
+        group_id = getattr(group, 'pk', group)
+
+        with transaction.commit_on_success():
+            rels = list(self.select_for_update().filter(group=group_id))
+
+            rows = {}
+            for db, model in ((connection, Game), (connections[ARCHIVE_DATABASE], ArchivedGame)):
+                # Look at every game from the perspective of both the home and the away team
+                cursor = db.cursor()
+                cursor.execute("""
+                    SELECT team_id, COUNT(*),
+                        SUM(CASE WHEN winner_id = team_id THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN winner_id IS NULL THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN winner_id <> team_id THEN 1 ELSE 0 END),
+                        SUM(goals_for), SUM(goals_against)
+                    FROM (
+                        SELECT home_id AS team_id, winner_id, score_home AS goals_for, score_away AS goals_against FROM {0} WHERE group_id = %s AND played = %s
+                        UNION ALL
+                        SELECT away_id AS team_id, winner_id, score_away AS goals_for, score_home AS goals_against FROM {0} WHERE group_id = %s AND played = %s
+                    ) sides
+                    GROUP BY team_id""".format(db.ops.quote_name(model._meta.db_table)), [group_id, True, group_id, True])
+                for row in cursor.fetchall():
+                    totals = rows.get(row[0], (0, 0, 0, 0, 0, 0))
+                    rows[row[0]] = tuple(total + (value or 0) for total, value in zip(totals, row[1:]))
+
+            for rel in rels:
+                games, wins, draws, losses, goals_for, goals_against = rows.pop(rel.team_id, (0, 0, 0, 0, 0, 0))
+                rel.games, rel.wins, rel.draws, rel.losses = games, wins, draws, losses
+                rel.goals_for, rel.goals_against = goals_for, goals_against
+                rel.score = wins * self.WIN_POINTS + draws * self.DRAW_POINTS
+                rel.save()
+
+            # Teams that played in this group without being in it yet
+            for team_id, (games, wins, draws, losses, goals_for, goals_against) in rows.items():
+                self.create(group_id=group_id, team_id=team_id, score=wins * self.WIN_POINTS + draws * self.DRAW_POINTS,
+                    games=games, wins=wins, draws=draws, losses=losses, goals_for=goals_for, goals_against=goals_against)
+
+
 class GroupTeamRelation(models.Model):
     """
-        Intermediate model for the m2m relation between Group and Team
+        Intermediate model for the m2m relation between Group and Team. Also holds the standings of the team in the group.
     """
     group = models.ForeignKey('Group')
     team = models.ForeignKey('Team')
 
     score = models.IntegerField(default=0)  # The teams score in this group. Teams get points by winning games
+    games = models.IntegerField(default=0)  # Number of games the team has played in this group
+    wins = models.IntegerField(default=0)  # Number of games won
+    draws = models.IntegerField(default=0)  # Number of games drawn
+    losses = models.IntegerField(default=0)  # Number of games lost
+    goals_for = models.IntegerField(default=0)  # Goals scored by the team
+    goals_against = models.IntegerField(default=0)  # Goals conceded by the team
     validated = models.BooleanField(default=False)  # Whether or not this teams membership in this group has been validated
 
+    objects = StandingsManager()
+
+    class Meta:
+        unique_together = ('group', 'team')
+
+    @property
+    def goal_difference(self):
+        return self.goals_for - self.goals_against
+
 
 class Person(models.Model):
     """
@@ -118,13 +243,13 @@ class Person(models.Model):
     """
     user = models.OneToOneField(User, blank=True, null=True, related_name='handball_profile')
 
-    first_name = models.CharField(max_length=50)
-    last_name = models.CharField(max_length=50)
+    first_name = models.CharField(max_length=50, db_index=True)
+    last_name = models.CharField(max_length=50, db_index=True)
     address = models.CharField(max_length=50, blank=True)
     city = models.CharField(max_length=50, blank=True)
     zip_code = models.IntegerField(null=True, blank=True)
     birthday = models.DateField(null=True, blank=True)
-    pass_number = models.IntegerField(null=True, blank=True)
+    pass_number = models.IntegerField(unique=True, null=True, blank=True)
     gender = models.CharField(max_length=10, choices=(('male', _('male')), ('female', _('female'))), default='male')
     mobile_number = models.CharField(max_length=20, blank=True)
     validated = models.BooleanField(default=False)  # Wheter or not the authentity of the person has been validated
@@ -138,13 +263,14 @@ class Game(models.Model):
         A handball game.
     """
     number = models.IntegerField(unique=True, blank=True, null=True)  # Official handball game number
-    start = models.DateTimeField()  # Start time
+    start = models.DateTimeField(db_index=True)  # Start time
     score_home = models.IntegerField()  # Score of the home team
     score_away = models.IntegerField()  # Score of the away team
     duration = models.IntegerField(default=60)  # Duration of the game in minutes
     home_validated = models.BooleanField(default=False)  # Wheter or not a representative of the home team has validated the correctness of this game
     away_validated = models.BooleanField(default=False)  # Wheter or not a representative of the away team has validated the correctness of this game
     referee_validated = models.BooleanField(default=False)  # Wheter or not the referee has validated the correctness of this game
+    played = models.BooleanField(default=True)  # Whether or not the game has been played. Scheduled games don't count for the standings.
 
     home = models.ForeignKey('Team', related_name='games_home')  # home team
     away = models.ForeignKey('Team', related_name='games_away')  # away team
@@ -158,8 +284,16 @@ class Game(models.Model):
     site = models.ForeignKey('Site')  # Where this game took place
     players = models.ManyToManyField('Person', through='GamePlayerRelation')  # Players involved in this game
 
+    display_name = models.CharField(max_length=220, editable=False)  # Date and team names, maintained by game_pre_save and team_post_save
+    version = models.IntegerField(default=0)  # Bumped whenever the game or data shown along with it changes, see VERSION_DEPENDENCIES
+    modified = models.DateTimeField(auto_now=True)  # Time of the last version bump
+
     def __unicode__(self):
-        return u'{0}/{1}/{2}: {3} {4} vs. {5} {6}'.format(self.start.year, self.start.month, self.start.day, self.home.club.name, self.home.name, self.away.club.name, self.away.name)
+        return self.display_name or game_display_name(self.start, unicode(self.home), unicode(self.away))
+
+    def clean(self):
+        # No official can be in two places at once
+        OfficialAssignment.objects.check_game(self)
 
 
 class Site(models.Model):
@@ -186,6 +320,38 @@ class GamePlayerRelation(models.Model):
     team = models.ForeignKey('Team')  # The team the player was playing for in this game
     shirt_number = models.IntegerField(blank=True, null=True)  # The shirt number the player was wearing in this game
 
+    class Meta:
+        unique_together = ('game', 'player')
+
+
+class RoleQuerySet(models.query.QuerySet):
+    """
+        Queryset of relations that make up the roles of people. Bulk updates don't send signals, so update() drops the
+        cached role indexes of the people of the updated relations itself. Callers of bulk_create have to do so with
+        invalidate_roles_of.
+    """
+    def update(self, **kwargs):
+        name = [name for name in ('manager', 'member', 'player', 'coach') if name in self.model._meta.get_all_field_names()][0]
+
+        # The role indexes only depend on the people, clubs, teams and validation of the relations
+        if not set(kwargs) & set([name, 'club', 'team', 'validated']):
+            return super(RoleQuerySet, self).update(**kwargs)
+
+        person_ids = set(self.values_list(name, flat=True))
+
+        rows = super(RoleQuerySet, self).update(**kwargs)
+
+        # The relations may have been moved to another person
+        if name in kwargs:
+            person_ids.add(getattr(kwargs[name], 'pk', kwargs[name]))
+        invalidate_roles_of(person_ids)
+        return rows
+
+
+class RoleManager(models.Manager):
+    def get_query_set(self):
+        return RoleQuerySet(self.model, using=self._db)
+
 
 class ClubMemberRelation(models.Model):
     """
@@ -197,6 +363,11 @@ class ClubMemberRelation(models.Model):
     primary = models.BooleanField(default=False)  # Whether or not this club is the primary club of this player
     validated = models.BooleanField(default=False)  # Wheter or not this membership has been validated
 
+    objects = RoleManager()
+
+    class Meta:
+        unique_together = ('member', 'club')
+
 
 class TeamPlayerRelation(models.Model):
     """
@@ -207,6 +378,11 @@ class TeamPlayerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not the membership in this team has been validated
 
+    objects = RoleManager()
+
+    class Meta:
+        unique_together = ('team', 'player')
+
 
 class TeamCoachRelation(models.Model):
     """
@@ -217,6 +393,11 @@ class TeamCoachRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not this person has been validated as a coach for this team
 
+    objects = RoleManager()
+
+    class Meta:
+        unique_together = ('team', 'coach')
+
 
 class ClubManagerRelation(models.Model):
     """
@@ -227,6 +408,11 @@ class ClubManagerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not this person has been validated as a manager for this club
 
+    objects = RoleManager()
+
+    class Meta:
+        unique_together = ('club', 'manager')
+
 
 class TeamManagerRelation(models.Model):
     """
@@ -237,6 +423,11 @@ class TeamManagerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Wheter or not this person has been validated as a manager of this team
 
+    objects = RoleManager()
+
+    class Meta:
+        unique_together = ('team', 'manager')
+
 
 class GroupManagerRelation(models.Model):
     """
@@ -247,6 +438,9 @@ class GroupManagerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not this person has been validated as a manager of this group
 
+    class Meta:
+        unique_together = ('group', 'manager')
+
 
 class DistrictManagerRelation(models.Model):
     """
@@ -257,6 +451,9 @@ class DistrictManagerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not this person has been validated as a manager of this district
 
+    class Meta:
+        unique_together = ('district', 'manager')
+
 
 class UnionManagerRelation(models.Model):
     """
@@ -267,6 +464,9 @@ class UnionManagerRelation(models.Model):
 
     validated = models.BooleanField(default=False)  # Whether or not this person has been validated as a manager of this union
 
+    class Meta:
+        unique_together = ('union', 'manager')
+
 
 class Event(models.Model):
     """
@@ -280,6 +480,686 @@ class Event(models.Model):
     person = models.ForeignKey('Person')  # The person associated with this event
     game = models.ForeignKey('Game', related_name='events')  # The game this events occurred in
     team = models.ForeignKey('Team')  # The team the respective person was playing in when this event occurred
+    version = models.IntegerField(default=0)  # Version of the game the event was last changed in, see record_event_changes
+
+    # An index on (game, time) is created in sql/event.sql since Django 1.4 can't declare composite indexes
+
+
+class DeletedEvent(models.Model):
+    """
+        Tombstone of a deleted event, which tells the viewers of the game's live ticker to remove it
+    """
+    game = models.ForeignKey('Game', related_name='deleted_events')
+    event_id = models.IntegerField()
+    version = models.IntegerField()  # Version of the game the event was deleted in
+
+
+class PlayerStatsManager(models.Manager):
+    """
+        Manager for PlayerStats that keeps the rollups in line with the events
+    """
+    # The counter of every event type
+    EVENT_FIELDS = {
+        'goal': 'goals',
+        'penalty_shot_goal': 'penalty_shot_goals',
+        'penalty_shot_miss': 'penalty_shot_misses',
+        'warning': 'warnings',
+        'time_penalty': 'time_penalties',
+        'team_time_penalty': 'team_time_penalties',
+        'disqualification': 'disqualifications'
+    }
+
+    def record_events(self, events, delta=1, groups=None):
+        """
+            Adds (or with a delta of -1 removes) the given events to the rollups. The increments are applied by the
+            database so concurrently recorded events can not overwrite each other. The group ids of the events' games
+            are looked up unless given as a dict of game id to group id.
+        """
+        if groups is None:
+            groups = dict(Game.objects.filter(id__in=set(event.game_id for event in events)).values_list('id', 'group'))
+
+        counts = {}
+        for event in events:
+            if event.game_id in groups and event.event_type in self.EVENT_FIELDS:
+                key = (event.person_id, event.team_id, groups[event.game_id])
+                increments = counts.setdefault(key, {})
+                field = self.EVENT_FIELDS[event.event_type]
+                increments[field] = increments.get(field, 0) + delta
+
+        if not counts:
+            return
+
+        existing = self.existing_keys(counts)
+
+        created = [PlayerStats(person_id=person_id, team_id=team_id, group_id=group_id, group_key=group_id or 0, **increments)
+            for (person_id, team_id, group_id), increments in counts.items() if (person_id, team_id, group_id) not in existing]
+        if created and delta > 0:
+            sid = transaction.savepoint()
+            try:
+                self.bulk_create(created)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # Another event has added some of the rollups in the meantime
+                transaction.savepoint_rollback(sid)
+                existing = self.existing_keys(counts)
+                self.bulk_create([obj for obj in created if (obj.person_id, obj.team_id, obj.group_id) not in existing])
+
+        for (person_id, team_id, group_id) in existing & set(counts):
+            increments = counts[(person_id, team_id, group_id)]
+            self.filter(person=person_id, team=team_id, group_key=group_id or 0).update(
+                **dict((field, F(field) + count) for field, count in increments.items()))
+
+    def existing_keys(self, keys):
+        """
+            Returns the subset of the given (person id, team id, group id) keys that have a rollup
+        """
+        rollups = self.filter(person__in=set(key[0] for key in keys), team__in=set(key[1] for key in keys))
+        return set(rollups.values_list('person', 'team', 'group')) & set(keys)
+
+    def rebuild(self, teams=None, keys=None):
+        """
+            Rebuilds the rollups of the given teams or (team id, group id) keys, or of all teams, from the live and
+            archived events with one grouped aggregate query per table
+        """
+        if keys is not None and not keys:
+            return
+
+        with transaction.commit_on_success():
+            events = Event.objects.all()
+            archived_events = ArchivedEvent.objects.all()
+            rollups = self.all()
+            if teams is not None:
+                events = events.filter(team__in=teams)
+                archived_events = archived_events.filter(team_id__in=teams)
+                rollups = rollups.filter(team__in=teams)
+            if keys is not None:
+                event_lookup, archived_lookup, rollup_lookup = models.Q(), models.Q(), models.Q()
+                for team_id, group_id in keys:
+                    event_lookup |= models.Q(team=team_id, game__group=group_id)
+                    archived_lookup |= models.Q(team_id=team_id, game__group_id=group_id)
+                    rollup_lookup |= models.Q(team=team_id, group_key=group_id or 0)
+                events = events.filter(event_lookup)
+                archived_events = archived_events.filter(archived_lookup)
+                rollups = rollups.filter(rollup_lookup)
+
+            stats = {}
+            for queryset, names in ((events, ('person', 'team', 'game__group')), (archived_events, ('person_id', 'team_id', 'game__group_id'))):
+                for row in queryset.values('event_type', *names).annotate(count=models.Count('id')).order_by():
+                    if row['event_type'] in self.EVENT_FIELDS:
+                        key = tuple(row[name] for name in names)
+                        obj = stats.setdefault(key, PlayerStats(person_id=key[0], team_id=key[1], group_id=key[2], group_key=key[2] or 0))
+                        field = self.EVENT_FIELDS[row['event_type']]
+                        setattr(obj, field, getattr(obj, field) + row['count'])
+
+            rollups.delete()
+
+            # Stay below the maximum number of query parameters of SQLite
+            stats = stats.values()
+            chunk_size = 900 // len(PlayerStats._meta.fields)
+            for i in range(0, len(stats), chunk_size):
+                self.bulk_create(stats[i:i + chunk_size])
+
+
+class PlayerStats(models.Model):
+    """
+        Rollup of the events of a person playing for a team within a group
+    """
+    person = models.ForeignKey('Person')
+    team = models.ForeignKey('Team')
+    group = models.ForeignKey('Group', blank=True, null=True)  # Empty for games outside of a group, e.g. friendlies
+    group_key = models.IntegerField(default=0, editable=False)  # Id of the group or 0, unlike NULL groups it makes the rollups unique
+
+    goals = models.IntegerField(default=0)
+    penalty_shot_goals = models.IntegerField(default=0)
+    penalty_shot_misses = models.IntegerField(default=0)
+    warnings = models.IntegerField(default=0)
+    time_penalties = models.IntegerField(default=0)
+    team_time_penalties = models.IntegerField(default=0)
+    disqualifications = models.IntegerField(default=0)
+
+    objects = PlayerStatsManager()
+
+    class Meta:
+        unique_together = ('person', 'team', 'group_key')
+
+    def save(self, *args, **kwargs):
+        self.group_key = self.group_id or 0
+        super(PlayerStats, self).save(*args, **kwargs)
+
+
+class AssignmentManager(models.Manager):
+    """
+        Manager for OfficialAssignment that keeps the assignments in line with the officials of the games
+    """
+    POSITIONS = ('referee', 'timer', 'secretary', 'supervisor')
+
+    def assignments(self, games):
+        """
+            Returns the unsaved assignments of the officials of the given games
+        """
+        return [OfficialAssignment(person_id=getattr(game, position + '_id'), game_id=game.id, position=position, start=game.start,
+            end=game.start + datetime.timedelta(minutes=game.duration)) for game in games for position in self.POSITIONS]
+
+    def sync(self, games):
+        """
+            Replaces the assignments of the given saved games
+        """
+        self.filter(game__in=[game.id for game in games]).delete()
+        self.insert(self.assignments(games))
+
+    def insert(self, assignments):
+        # Stay below the maximum number of query parameters of SQLite
+        chunk_size = 900 // len(OfficialAssignment._meta.fields)
+        for i in range(0, len(assignments), chunk_size):
+            self.bulk_create(assignments[i:i + chunk_size])
+
+    def rebuild(self):
+        """
+            Rebuilds all assignments from the games, reading the games in chunks
+        """
+        with transaction.commit_on_success():
+            self.all().delete()
+
+            last_id = 0
+            while True:
+                games = list(Game.objects.filter(id__gt=last_id).order_by('id').only('start', 'duration', *self.POSITIONS)[:1000])
+                if not games:
+                    break
+                self.insert(self.assignments(games))
+                last_id = games[-1].id
+
+    def overlapping(self, start, end):
+        """
+            Returns the assignments overlapping the given period
+        """
+        return self.filter(start__lt=end, end__gt=start)
+
+    def check_game(self, game):
+        """
+            Raises a ValidationError if an official of the given game is assigned to another game at the same time
+        """
+        persons = set(getattr(game, position + '_id') for position in self.POSITIONS) - set([None])
+        if game.start is None or not persons:
+            return
+
+        conflicts = self.overlapping(game.start, game.start + datetime.timedelta(minutes=game.duration or 0)).filter(person__in=persons)
+        if game.pk is not None:
+            conflicts = conflicts.exclude(game=game.pk)
+
+        conflicts = sorted(set(conflicts.values_list('person', 'game')))
+        if conflicts:
+            raise ValidationError([u'Person {0} is already assigned to game {1} at that time.'.format(person, other)
+                for person, other in conflicts])
+
+    def free_officials(self, district, start, end):
+        """
+            Returns the officials of a district without an assignment in the given period. Officials of a district are
+            the members of its clubs that have officiated a game before.
+        """
+        busy = self.overlapping(start, end).values('person')
+        return Person.objects.filter(clubs__district=district, assignments__isnull=False).exclude(id__in=busy).distinct()
+
+
+class OfficialAssignment(models.Model):
+    """
+        A person officiating a game, with the time the game takes. Maintained from the officials of the games.
+    """
+    person = models.ForeignKey('Person', related_name='assignments')
+    game = models.ForeignKey('Game', related_name='assignments')
+    position = models.CharField(max_length=10, choices=(('referee', _('referee')), ('timer', _('timer')), ('secretary', _('secretary')),
+        ('supervisor', _('supervisor'))))
+    start = models.DateTimeField(db_index=True)
+    end = models.DateTimeField(db_index=True)
+
+    objects = AssignmentManager()
+
+    class Meta:
+        unique_together = ('game', 'position')
+
+
+class SearchIndexManager(models.Manager):
+    """
+        Manager for SearchEntry that keeps the name search index in line with persons, clubs and teams
+    """
+    KINDS = ('person', 'club', 'team')
+
+    # Number of candidates per requested result that are read from the index before ranking
+    CANDIDATES = 5
+
+    def documents(self, kind, ids=None):
+        """
+            Returns (object id, label, text) of the objects of a kind, or of those with the given ids
+        """
+        model = {'person': Person, 'club': Club, 'team': Team}[kind]
+        objects = model.objects.filter(id__in=ids) if ids is not None else model.objects.all()
+
+        if kind == 'person':
+            documents = ((pk, u'{0} {1}'.format(first_name, last_name), u'{0} {1} {2}'.format(first_name, last_name, city))
+                for pk, first_name, last_name, city in objects.values_list('id', 'first_name', 'last_name', 'city'))
+        elif kind == 'club':
+            documents = ((pk, name, u'{0} {1}'.format(name, city or u''))
+                for pk, name, city in objects.values_list('id', 'name', 'home_site__city'))
+        else:
+            documents = ((pk, u'{0} {1}'.format(club_name, name), u'{0} {1}'.format(club_name, name))
+                for pk, club_name, name in objects.values_list('id', 'club__name', 'name'))
+
+        return [(pk, label, normalize(text)) for pk, label, text in documents]
+
+    def index(self, kind, ids):
+        """
+            Updates the entries of the objects of a kind with the given ids. Objects whose name hasn't changed are skipped.
+        """
+        ids = list(ids)
+        if not ids:
+            return
+
+        documents = self.documents(kind, ids)
+        indexed = dict((pk, (label, text)) for pk, label, text in self.filter(kind=kind, object_id__in=ids).values_list('object_id', 'label', 'text'))
+        unchanged = set(pk for pk, label, text in documents if indexed.get(pk) == (label, text))
+
+        # Entries of changed and deleted objects are replaced
+        stale = set(indexed) - unchanged
+        if stale:
+            self.remove(kind, stale)
+        self.add(kind, [document for document in documents if document[0] not in unchanged])
+
+    def add(self, kind, documents):
+        """
+            Inserts the entries and trigrams of the given (object id, label, text) documents, in chunks
+        """
+        entries = [SearchEntry(kind=kind, object_id=pk, label=label, text=text) for pk, label, text in documents]
+        terms = [SearchTerm(kind=kind, object_id=pk, trigram=gram) for pk, label, text in documents for gram in trigrams(text)]
+
+        # Stay below the maximum number of query parameters of SQLite
+        for model, objs in ((SearchEntry, entries), (SearchTerm, terms)):
+            chunk_size = 900 // len(model._meta.fields)
+            for i in range(0, len(objs), chunk_size):
+                model.objects.bulk_create(objs[i:i + chunk_size])
+
+    def remove(self, kind, ids):
+        ids = list(ids)
+        SearchTerm.objects.filter(kind=kind, object_id__in=ids).delete()
+        self.filter(kind=kind, object_id__in=ids).delete()
+
+    def rebuild(self, kinds=KINDS):
+        """
+            Rebuilds the index of the given kinds of objects from scratch
+        """
+        with transaction.commit_on_success():
+            for kind in kinds:
+                SearchTerm.objects.filter(kind=kind).delete()
+                self.filter(kind=kind).delete()
+                self.add(kind, self.documents(kind))
+
+    def search(self, query, kinds=KINDS, limit=10):
+        """
+            Returns the entries of the given kinds best matching a query, with their 'score' set to the share of the
+            query's trigrams they contain
+        """
+        query = normalize(query)
+        grams = trigrams(query)
+        if not grams or not limit:
+            return []
+
+        # The number of shared trigrams is counted by the database, only the best candidates are ranked here
+        candidates = SearchTerm.objects.filter(trigram__in=grams, kind__in=kinds).values('kind', 'object_id') \
+            .annotate(hits=models.Count('id')).filter(hits__gte=max(1, int(len(grams) * MIN_SIMILARITY + 0.5))) \
+            .order_by('-hits')[:limit * self.CANDIDATES]
+        hits = dict(((row['kind'], row['object_id']), row['hits']) for row in candidates)
+        if not hits:
+            return []
+
+        lookup = models.Q()
+        for kind in set(kind for kind, pk in hits):
+            lookup |= models.Q(kind=kind, object_id__in=[pk for key, pk in hits if key == kind])
+
+        entries = list(self.filter(lookup))
+        for entry in entries:
+            entry.score = float(hits[(entry.kind, entry.object_id)]) / len(grams)
+        entries.sort(key=lambda entry: rank(query, hits[(entry.kind, entry.object_id)], entry.text))
+        return entries[:limit]
+
+
+class SearchEntry(models.Model):
+    """
+        An object in the name search index along with its normalized text
+    """
+    kind = models.CharField(max_length=10)  # One of SearchIndexManager.KINDS
+    object_id = models.IntegerField()
+    label = models.CharField(max_length=110)  # Name shown in search results
+    text = models.CharField(max_length=160)  # Normalized text the trigrams are taken from
+
+    objects = SearchIndexManager()
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+
+class SearchTerm(models.Model):
+    """
+        A trigram of the text of a SearchEntry
+    """
+    kind = models.CharField(max_length=10)
+    object_id = models.IntegerField(db_index=True)
+    trigram = models.CharField(max_length=3, db_index=True)
+
+
+class OutboxManager(models.Manager):
+    """
+        Manager for OutboxMessage that queues mails and delivers them in batches
+    """
+    # Seconds to wait before the next attempt after each failed one. Messages are dead-lettered once all are used up.
+    RETRY_DELAYS = (60, 300, 1800, 7200)
+
+    # Seconds after which messages claimed by a crashed process are sent again
+    CLAIM_TIMEOUT = 600
+
+    def enqueue(self, subject, body, sender, recipients):
+        """
+            Queues a mail for delivery by the send_outbox command instead of sending it right away
+        """
+        return self.create(subject=subject, body=body, sender=sender, recipients=','.join(recipients))
+
+    def claim(self, now, batch_size):
+        """
+            Marks the messages that are due as being sent by this process and returns them. Messages claimed by a
+            process that didn't finish within CLAIM_TIMEOUT seconds are due again.
+        """
+        due = self.filter(status__in=('queued', 'sending'), next_attempt__lte=now).order_by('next_attempt', 'id')
+        until = now + datetime.timedelta(seconds=self.CLAIM_TIMEOUT)
+
+        # Other processes may claim the same messages meanwhile, only the rows updated here are sent
+        claimed = [message_id for message_id, status, next_attempt in due.values_list('id', 'status', 'next_attempt')[:batch_size]
+            if self.filter(id=message_id, status=status, next_attempt=next_attempt).update(status='sending', next_attempt=until)]
+
+        return sorted(self.filter(id__in=claimed), key=lambda message: claimed.index(message.id))
+
+    def fail(self, message, error, now):
+        """
+            Counts a failed attempt to send a claimed message and queues it again after a delay or dead-letters it
+        """
+        message.attempts += 1
+        message.last_error = u'{0}: {1}'.format(error.__class__.__name__, error)
+        if message.attempts > len(self.RETRY_DELAYS):
+            message.status = 'failed'
+        else:
+            message.status = 'queued'
+            message.next_attempt = now + datetime.timedelta(seconds=self.RETRY_DELAYS[message.attempts - 1])
+        message.save()
+
+    def deliver(self, batch_size=50, connection=None):
+        """
+            Sends the messages that are due, oldest first, over a single mail connection. Returns the number of sent
+            and failed messages.
+        """
+        now = datetime.datetime.now()
+        messages = self.claim(now, batch_size)
+        if not messages:
+            return 0, 0
+
+        connection = connection or get_connection()
+        try:
+            connection.open()
+        except Exception, e:
+            # Nothing can be sent without a connection, so the attempt failed for the whole batch
+            for message in messages:
+                self.fail(message, e, now)
+            return 0, len(messages)
+
+        sent = 0
+        try:
+            for message in messages:
+                try:
+                    connection.send_messages([message.email()])
+                except Exception, e:
+                    self.fail(message, e, now)
+                    # The connection may be broken, the next message reopens it
+                    connection.close()
+                    continue
+
+                # Marked right away, so it isn't sent twice if this process dies before the end of the batch
+                self.filter(id=message.id).update(status='sent', sent=now, attempts=F('attempts') + 1, last_error='')
+                sent += 1
+        finally:
+            connection.close()
+
+        return sent, len(messages) - sent
+
+    def requeue_failed(self):
+        """
+            Queues the dead-lettered messages again, with a fresh set of attempts
+        """
+        return self.filter(status='failed').update(status='queued', attempts=0, next_attempt=datetime.datetime.now())
+
+
+class OutboxMessage(models.Model):
+    """
+        A mail waiting to be sent or already sent by the send_outbox command
+    """
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    sender = models.CharField(max_length=100)
+    recipients = models.TextField()  # Comma separated addresses
+    status = models.CharField(max_length=10, choices=(('queued', _('queued')), ('sending', _('sending')), ('sent', _('sent')), ('failed', _('failed'))), default='queued', db_index=True)
+    attempts = models.IntegerField(default=0)  # Number of attempts to send this message
+    last_error = models.TextField(blank=True)  # Error of the last failed attempt
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now, db_index=True)  # Time this message is due
+    sent = models.DateTimeField(blank=True, null=True)
+
+    objects = OutboxManager()
+
+    def email(self):
+        return EmailMessage(self.subject, self.body, self.sender, self.recipients.split(','))
+
+
+class Season(models.Model):
+    """
+        A handball season. Games belong to the season their start falls into. The games of a closed season can be
+        moved to the archive tables with the archive_season command.
+    """
+    name = models.CharField(max_length=20, unique=True)  # E.g. 2011/12
+    start = models.DateField()  # First day of the season
+    end = models.DateField()  # Last day of the season
+    archived = models.BooleanField(default=False)  # Whether or not the games of this season have been archived
+
+    class Meta:
+        ordering = ('-start',)
+
+    def __unicode__(self):
+        return self.name
+
+    @property
+    def closed(self):
+        return self.end < datetime.date.today()
+
+    def games(self):
+        """
+            Returns the live games of this season
+        """
+        return Game.objects.filter(start__gte=datetime.datetime.combine(self.start, datetime.time()),
+            start__lt=datetime.datetime.combine(self.end + datetime.timedelta(days=1), datetime.time()))
+
+
+class ArchiveManager(models.Manager):
+    """
+        Manager for the archive models that reads from and writes to the archive database
+    """
+    def __init__(self):
+        super(ArchiveManager, self).__init__()
+        self._db = ARCHIVE_DATABASE
+
+
+# The archive models keep the ids of the live rows. They only reference each other with foreign keys, everything else
+# by plain id, so they can live in a database of their own and outlast the teams and persons they refer to.
+
+class ArchivedGame(models.Model):
+    """
+        A game of an archived season, see Game
+    """
+    id = models.IntegerField(primary_key=True)
+    season_id = models.IntegerField(db_index=True)  # The season this game was archived with
+    number = models.IntegerField(blank=True, null=True)
+    start = models.DateTimeField(db_index=True)
+    score_home = models.IntegerField()
+    score_away = models.IntegerField()
+    duration = models.IntegerField()
+    home_validated = models.BooleanField(default=False)
+    away_validated = models.BooleanField(default=False)
+    referee_validated = models.BooleanField(default=False)
+    played = models.BooleanField(default=True)
+
+    home_id = models.IntegerField(db_index=True)
+    away_id = models.IntegerField(db_index=True)
+    referee_id = models.IntegerField()
+    timer_id = models.IntegerField()
+    secretary_id = models.IntegerField()
+    supervisor_id = models.IntegerField()
+    winner_id = models.IntegerField(blank=True, null=True)
+    group_id = models.IntegerField(blank=True, null=True, db_index=True)
+    site_id = models.IntegerField()
+
+    objects = ArchiveManager()
+
+
+class ArchivedEvent(models.Model):
+    """
+        An event of an archived game, see Event
+    """
+    id = models.IntegerField(primary_key=True)
+    time = models.IntegerField()
+    event_type = models.CharField(max_length=20)
+    person_id = models.IntegerField(db_index=True)
+    game = models.ForeignKey('ArchivedGame', related_name='events')
+    team_id = models.IntegerField(db_index=True)
+
+    objects = ArchiveManager()
+
+
+class ArchivedGamePlayerRelation(models.Model):
+    """
+        A player of an archived game, see GamePlayerRelation
+    """
+    id = models.IntegerField(primary_key=True)
+    player_id = models.IntegerField(db_index=True)
+    game = models.ForeignKey('ArchivedGame', related_name='players')
+    team_id = models.IntegerField()
+    shirt_number = models.IntegerField(blank=True, null=True)
+
+    objects = ArchiveManager()
+
+
+def team_display_name(club_name, name):
+    return u'{0} {1}'.format(club_name, name)
+
+
+def game_display_name(start, home, away):
+    return u'{0}/{1}/{2}: {3} vs. {4}'.format(start.year, start.month, start.day, home, away)
+
+
+def update_display_names(model, names, bump=False):
+    """
+        Stores the given display names, a map of primary keys to names, with one UPDATE per chunk of rows and
+        optionally bumps the versions of the rows
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = names.items()
+
+    # Each row takes three query parameters, stay below the maximum number of SQLite
+    for i in range(0, len(names), 300):
+        chunk = names[i:i + 300]
+        sql = 'UPDATE {0} SET display_name = CASE id {1} END'.format(table, ' '.join(['WHEN %s THEN %s'] * len(chunk)))
+        params = [value for pair in chunk for value in pair]
+        if bump:
+            sql += ', version = version + 1, modified = %s'
+            params.append(datetime.datetime.now())
+        sql += ' WHERE id IN ({0})'.format(', '.join(['%s'] * len(chunk)))
+        params.extend(pk for pk, name in chunk)
+        connection.cursor().execute(sql, params)
+
+
+def update_team_display_names(teams):
+    """
+        Updates the display names of the teams in the given queryset that are out of date. Returns the ids of the
+        updated teams.
+    """
+    names = {}
+    for pk, club_name, name, display_name in teams.values_list('id', 'club__name', 'name', 'display_name'):
+        if team_display_name(club_name, name) != display_name:
+            names[pk] = team_display_name(club_name, name)
+    update_display_names(Team, names)
+    return names.keys()
+
+
+def update_game_display_names(teams):
+    """
+        Updates the display names of the games of the given teams that are out of date and bumps their versions.
+        Returns the number of updated games.
+    """
+    names = {}
+    games = Game.objects.filter(models.Q(home__in=teams) | models.Q(away__in=teams))
+    for pk, start, home, away, display_name in games.values_list('id', 'start', 'home__display_name', 'away__display_name', 'display_name'):
+        if game_display_name(start, home, away) != display_name:
+            names[pk] = game_display_name(start, home, away)
+    update_display_names(Game, names, bump=True)
+    return len(names)
+
+
+def team_pre_save(sender, instance, **kwargs):
+    """
+        This function is called before a Team object is saved
+    """
+    # Fixtures may be loaded before the referenced club
+    if not kwargs.get('raw'):
+        instance.display_name = team_display_name(instance.club.name, instance.name)
+
+
+# Fields of a game the standings and the player stats are derived from
+RESULT_FIELDS = ('group', 'home', 'away', 'winner', 'score_home', 'score_away', 'played')
+
+
+def game_result(game):
+    return tuple(getattr(game, Game._meta.get_field(name).attname) for name in RESULT_FIELDS)
+
+
+def game_pre_save(sender, instance, **kwargs):
+    """
+        This function is called before a Game object is saved
+    """
+    # Remember the stored result, so game_post_save only updates what depends on it if it has changed
+    instance._previous_result = None
+    if kwargs.get('raw'):
+        return
+
+    instance.display_name = game_display_name(instance.start, instance.home.display_name, instance.away.display_name)
+    if instance.pk is not None:
+        previous = Game.objects.filter(id=instance.pk).values_list(*RESULT_FIELDS)[:1]
+        if previous:
+            instance._previous_result = tuple(previous[0])
+
+
+def club_post_save(sender, instance, created, **kwargs):
+    """
+        This function is called after a Club object has been saved
+    """
+    if created:
+        return
+
+    # The club may have been renamed
+    with transaction.commit_on_success():
+        renamed = update_team_display_names(Team.objects.filter(club=instance.id))
+        if renamed:
+            update_game_display_names(renamed)
+
+
+def team_post_save(sender, instance, created, **kwargs):
+    """
+        This function is called after a Team object has been saved
+    """
+    if not created:
+        # The team may have been renamed or moved to another club
+        with transaction.commit_on_success():
+            update_game_display_names([instance.id])
 
 
 def group_post_save(sender, instance, **kwargs):
@@ -295,59 +1175,40 @@ def team_player_post_save(sender, instance, created, **kwargs):
     """
         This function is called after a TeamPlayerRelation object has been saved
     """
-    # Add player to club if not member already
-    try:
-        ClubMemberRelation.objects.get(member=instance.player, club=instance.team.club)
-    except ClubMemberRelation.DoesNotExist:
-        ClubMemberRelation.objects.create(member=instance.player, club=instance.team.club, validated=instance.validated)
+    from handball.memberships import queue_team_member
 
-    # If first team member, asign as manager
-    managers = TeamManagerRelation.objects.filter(team=instance.team)
-    if len(managers) == 0:
-        TeamManagerRelation.objects.create(team=instance.team, manager=instance.player)
+    # Add player to club if not member already, if first team member, assign as manager
+    queue_team_member(instance.player_id, instance.team_id, instance.validated)
 
 
 def team_coach_post_save(sender, instance, created, **kwargs):
     """
         This function is called after a TeamCoachRelation object has been saved
     """
-    # Add coach to club if not member already
-    try:
-        ClubMemberRelation.objects.get(member=instance.coach, club=instance.team.club)
-    except ClubMemberRelation.DoesNotExist:
-        ClubMemberRelation.objects.create(member=instance.coach, club=instance.team.club, validated=instance.validated)
+    from handball.memberships import queue_team_member
 
-    # If first team member, asign as manager
-    managers = TeamManagerRelation.objects.filter(team=instance.team)
-    if len(managers) == 0:
-        TeamManagerRelation.objects.create(team=instance.team, manager=instance.coach)
+    # Add coach to club if not member already, if first team member, assign as manager
+    queue_team_member(instance.coach_id, instance.team_id, instance.validated)
 
 
 def game_player_post_save(sender, instance, created, **kwargs):
     """
         This function is called after a GamePlayerRelation object has been saved
     """
+    from handball.memberships import queue_team_player
+
     # Add player to team if he's not a member already
-    try:
-        TeamPlayerRelation.objects.get(team=instance.team, player=instance.player)
-    except TeamPlayerRelation.DoesNotExist:
-        TeamPlayerRelation.objects.create(team=instance.team, player=instance.player, validated=True)
+    queue_team_player(instance.player_id, instance.team_id)
 
 
 def club_member_post_save(sender, instance, created, **kwargs):
     """
         This function is called after a ClubMemberRelation object has been saved
     """
-    # If first member, make manager
-    managers = ClubManagerRelation.objects.filter(club=instance.club)
-    if len(managers) == 0:
-        ClubManagerRelation.objects.create(club=instance.club, manager=instance.member, validated=True)
+    from handball.memberships import queue_club_member
 
-    # If first club, make primary
-    clubs = ClubMemberRelation.objects.filter(member=instance.member)
-    if len(clubs) == 1 and clubs[0].primary == False:
-        instance.primary = True
-        instance.save()
+    # If first member, make manager. If first club, make primary
+    queue_club_member(instance.member_id, instance.club_id)
 
 
 def game_post_save(sender, instance, created, **kwargs):
@@ -355,44 +1216,237 @@ def game_post_save(sender, instance, created, **kwargs):
         This function is called after a Game object has been saved
     """
     if created:
-        if not instance.winner:
-            home_score = 1
-            away_score = 1
-        elif instance.home.id == instance.winner.id:
-            home_score = 2
-            away_score = 0
-        elif instance.away.id == instance.winner.id:
-            home_score = 0
-            away_score = 2
+        OfficialAssignment.objects.insert(OfficialAssignment.objects.assignments([instance]))
+    else:
+        # The officials or the time may have changed
+        OfficialAssignment.objects.sync([instance])
 
+    if created:
         # Set site as default home site if not set yet
-        if not instance.home.club.home_site:
-            instance.home.club.home_site = instance.site
-            instance.home.club.save()
+        for club in Club.objects.filter(teams=instance.home_id, home_site=None):
+            club.home_site_id = instance.site_id
+            club.save()
+
+        # Add teams to group if not already in it and update their standings
+        if instance.group_id:
+            GroupTeamRelation.objects.record_game(instance)
+    else:
+        # Validations and changes of the officials don't affect the standings and stats
+        previous = getattr(instance, '_previous_result', None)
+        if previous == game_result(instance):
+            return
+        previous = dict(zip(RESULT_FIELDS, previous or ()))
+
+        # The result may have changed, so the increments can't be applied. A game moved to another group also changes
+        # the standings of the group it was moved from.
+        for group_id in set([instance.group_id, previous.get('group')]) - set([None]):
+            GroupTeamRelation.objects.recompute(group_id)
+        if previous.get('group') not in (None, instance.group_id):
+            bump_versions(Group.objects.filter(id=previous['group']))
+
+        # The rollups are keyed by the teams of the events, so only a move to another group moves the game's events
+        # to other rollups
+        if previous.get('group') != instance.group_id:
+            teams = set(Event.objects.filter(game=instance.id).values_list('team', flat=True))
+            PlayerStats.objects.rebuild(keys=[(team_id, group_id) for team_id in teams for group_id in (previous.get('group'), instance.group_id)])
+
+
+def game_post_delete(sender, instance, **kwargs):
+    """
+        This function is called after a Game object has been deleted
+    """
+    if instance.group_id:
+        GroupTeamRelation.objects.recompute(instance.group_id)
 
-        # Add teams to group if not already in it,
-        # Add score to winner team
-        try:
-            rel = GroupTeamRelation.objects.get(team=instance.home, group=instance.group)
-            rel.score += home_score
-            rel.save()
-        except GroupTeamRelation.DoesNotExist:
-            GroupTeamRelation.objects.create(team=instance.home, group=instance.group, score=home_score)
+    PlayerStats.objects.rebuild(keys=[(instance.home_id, instance.group_id), (instance.away_id, instance.group_id)])
 
-        try:
-            rel = GroupTeamRelation.objects.get(team=instance.away, group=instance.group)
-            rel.score += away_score
-            rel.save()
-        except GroupTeamRelation.DoesNotExist:
-            GroupTeamRelation.objects.create(team=instance.away, group=instance.group, score=away_score)
+
+def event_post_save(sender, instance, created, **kwargs):
+    """
+        This function is called after an Event object has been saved
+    """
+    from handball.ticker import feeds
+
+    # Let the viewers of the game's live ticker know about the change
+    with transaction.commit_on_success():
+        instance.version = record_event_changes(instance.game_id, changed=[instance.id])
+    feeds.notify(instance.game_id)
+
+    if created:
+        PlayerStats.objects.record_events([instance])
+    else:
+        # The previous values are unknown, so the rollups of both teams within the game's group are rebuilt
+        game = instance.game
+        PlayerStats.objects.rebuild(keys=[(game.home_id, game.group_id), (game.away_id, game.group_id)])
+
+
+def event_post_delete(sender, instance, **kwargs):
+    """
+        This function is called after an Event object has been deleted
+    """
+    from handball.ticker import feeds
+
+    # Nobody watches the events of a deleted game anymore
+    if Game.objects.filter(id=instance.game_id).exists():
+        record_event_changes(instance.game_id, deleted=[instance.id])
+        feeds.notify(instance.game_id)
+
+    # Events deleted along with their game are covered by game_post_delete
+    PlayerStats.objects.record_events([instance], -1)
+
+
+def search_index_post_save(sender, instance, **kwargs):
+    """
+        This function is called after a Person, Club, Team or Site object has been saved
+    """
+    if sender is Site:
+        # The city of a site is part of the text of the clubs that play there
+        SearchEntry.objects.index('club', Club.objects.filter(home_site=instance.id).values_list('id', flat=True))
+    else:
+        SearchEntry.objects.index(sender._meta.module_name, [instance.id])
+
+    if sender is Club:
+        # The club name is part of the text of its teams
+        SearchEntry.objects.index('team', Team.objects.filter(club=instance.id).values_list('id', flat=True))
+
+
+def search_index_post_delete(sender, instance, **kwargs):
+    """
+        This function is called after a Person, Club or Team object has been deleted
+    """
+    SearchEntry.objects.remove(sender._meta.module_name, [instance.id])
+
+
+def bump_versions(queryset):
+    """
+        Bumps the versions of the given objects, which changes the ETags of their api representations
+    """
+    queryset.update(version=F('version') + 1, modified=datetime.datetime.now())
+
+
+def record_event_changes(game_id, changed=(), deleted=()):
+    """
+        Bumps the version of a game and records the new version on the given changed events and on tombstones of the
+        given deleted events, so the live ticker can send the changes after the version a viewer has seen. The bump
+        keeps the game's row locked until the end of the transaction, so the versions are committed in order.
+    """
+    bump_versions(Game.objects.filter(id=game_id))
+    version = Game.objects.filter(id=game_id).values_list('version', flat=True)[0]
+
+    if changed:
+        Event.objects.filter(id__in=list(changed)).update(version=version)
+    if deleted:
+        DeletedEvent.objects.bulk_create([DeletedEvent(game_id=game_id, event_id=event_id, version=version) for event_id in deleted])
+
+    return version
+
+
+def bump_dependent_versions(sender, instance, **kwargs):
+    """
+        This function is called after an object whose changes affect versioned objects has been saved or deleted
+    """
+    for model, lookup, attname in VERSION_DEPENDENCIES[sender]:
+        # Nobody can hold an outdated copy of a new object
+        if model is sender and kwargs.get('created'):
+            continue
+
+        value = getattr(instance, attname)
+        if value is not None:
+            bump_versions(model.objects.filter(**{lookup: value}))
 
 
 # Create API key for a new user
 post_save.connect(create_api_key, sender=User)
 
 pre_save.connect(group_post_save, sender=Group)
+pre_save.connect(team_pre_save, sender=Team)
+pre_save.connect(game_pre_save, sender=Game)
+post_save.connect(club_post_save, sender=Club)
+post_save.connect(team_post_save, sender=Team)
 post_save.connect(team_player_post_save, sender=TeamPlayerRelation)
 post_save.connect(team_coach_post_save, sender=TeamCoachRelation)
 post_save.connect(game_player_post_save, sender=GamePlayerRelation)
 post_save.connect(club_member_post_save, sender=ClubMemberRelation)
 post_save.connect(game_post_save, sender=Game)
+post_delete.connect(game_post_delete, sender=Game)
+post_save.connect(event_post_save, sender=Event)
+post_delete.connect(event_post_delete, sender=Event)
+
+# Invalidate cached responses of reference data resources
+post_save.connect(bump_model_version, sender=Union)
+post_delete.connect(bump_model_version, sender=Union)
+post_save.connect(bump_model_version, sender=District)
+post_delete.connect(bump_model_version, sender=District)
+post_save.connect(bump_model_version, sender=LeagueLevel)
+post_delete.connect(bump_model_version, sender=LeagueLevel)
+post_save.connect(bump_model_version, sender=Group)
+post_delete.connect(bump_model_version, sender=Group)
+post_save.connect(bump_model_version, sender=Season)
+post_delete.connect(bump_model_version, sender=Season)
+
+# Keep the name search index up to date
+post_save.connect(search_index_post_save, sender=Person)
+post_delete.connect(search_index_post_delete, sender=Person)
+post_save.connect(search_index_post_save, sender=Club)
+post_delete.connect(search_index_post_delete, sender=Club)
+post_save.connect(search_index_post_save, sender=Team)
+post_delete.connect(search_index_post_delete, sender=Team)
+post_save.connect(search_index_post_save, sender=Site)
+
+# Invalidate cached role indexes
+pre_save.connect(remember_user, sender=Person)
+post_save.connect(invalidate_person, sender=Person)
+post_delete.connect(invalidate_person, sender=Person)
+post_save.connect(invalidate_roles, sender=ClubManagerRelation)
+post_delete.connect(invalidate_roles, sender=ClubManagerRelation)
+post_save.connect(invalidate_roles, sender=TeamManagerRelation)
+post_delete.connect(invalidate_roles, sender=TeamManagerRelation)
+post_save.connect(invalidate_roles, sender=ClubMemberRelation)
+post_delete.connect(invalidate_roles, sender=ClubMemberRelation)
+post_save.connect(invalidate_roles, sender=TeamPlayerRelation)
+post_delete.connect(invalidate_roles, sender=TeamPlayerRelation)
+post_save.connect(invalidate_roles, sender=TeamCoachRelation)
+post_delete.connect(invalidate_roles, sender=TeamCoachRelation)
+
+# The versioned objects a change of an object of the key model affects, as (versioned model, lookup, attribute of the changed object)
+# Events bump the version of their game in record_event_changes
+VERSION_DEPENDENCIES = {
+    Group: ((Group, 'id', 'id'),),
+    Club: ((Club, 'id', 'id'), (Team, 'club', 'id'), (Team, 'players__clubs', 'id')),
+    Team: ((Team, 'id', 'id'),),
+    Game: ((Game, 'id', 'id'), (Group, 'id', 'group_id')),
+    GroupTeamRelation: ((Group, 'id', 'group_id'),),
+    TeamPlayerRelation: ((Team, 'id', 'team_id'),),
+    ClubMemberRelation: ((Team, 'players', 'member_id'),),
+    Person: ((Team, 'players', 'id'), (Game, 'events__person', 'id'), (Game, 'players', 'id')),
+    Site: ((Club, 'home_site', 'id'), (Team, 'club__home_site', 'id'), (Team, 'players__clubs__home_site', 'id')),
+    District: ((Club, 'district', 'id'), (Team, 'club__district', 'id'), (Team, 'players__clubs__district', 'id'), (Group, 'district', 'id')),
+    Union: ((Club, 'district__union', 'id'), (Team, 'club__district__union', 'id'), (Team, 'players__clubs__district__union', 'id'),
+        (Group, 'union', 'id')),
+    LeagueLevel: ((Group, 'level', 'id'),)
+}
+
+post_save.connect(bump_dependent_versions, sender=Group)
+post_delete.connect(bump_dependent_versions, sender=Group)
+post_save.connect(bump_dependent_versions, sender=Club)
+post_delete.connect(bump_dependent_versions, sender=Club)
+post_save.connect(bump_dependent_versions, sender=Team)
+post_delete.connect(bump_dependent_versions, sender=Team)
+post_save.connect(bump_dependent_versions, sender=Game)
+post_delete.connect(bump_dependent_versions, sender=Game)
+post_save.connect(bump_dependent_versions, sender=GroupTeamRelation)
+post_delete.connect(bump_dependent_versions, sender=GroupTeamRelation)
+post_save.connect(bump_dependent_versions, sender=TeamPlayerRelation)
+post_delete.connect(bump_dependent_versions, sender=TeamPlayerRelation)
+post_save.connect(bump_dependent_versions, sender=ClubMemberRelation)
+post_delete.connect(bump_dependent_versions, sender=ClubMemberRelation)
+post_save.connect(bump_dependent_versions, sender=Person)
+post_delete.connect(bump_dependent_versions, sender=Person)
+post_save.connect(bump_dependent_versions, sender=Site)
+post_delete.connect(bump_dependent_versions, sender=Site)
+post_save.connect(bump_dependent_versions, sender=District)
+post_delete.connect(bump_dependent_versions, sender=District)
+post_save.connect(bump_dependent_versions, sender=Union)
+post_delete.connect(bump_dependent_versions, sender=Union)
+post_save.connect(bump_dependent_versions, sender=LeagueLevel)
+post_delete.connect(bump_dependent_versions, sender=LeagueLevel)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+    Keyset pagination for large, steadily growing listings like games and events.
+
+    Instead of skipping 'offset' rows, a page starts right after the sort keys of the last object of the previous
+    page, so every page costs the same no matter how deep it is. Resources opt in with
+
+        paginator_class = keyset_paginator('start', 'id')
+
+    in their Meta. Requests with a 'cursor' parameter (empty for the first page) are paged by keys, all other requests
+    keep using tastypie's limit/offset pagination.
+"""
+
+import base64
+import datetime
+import json
+from urllib import urlencode
+
+from django.db.models import Q
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+
+class KeysetPaginator(Paginator):
+    """
+        Paginator that pages by the values of 'keys', which have to identify an object uniquely. Keys prefixed with
+        '-' are sorted in descending order.
+    """
+    keys = ('id',)
+
+    def page(self):
+        if 'cursor' not in self.request_data:
+            return super(KeysetPaginator, self).page()
+
+        limit = self.get_limit()
+        backwards, values = self.decode_cursor(self.request_data['cursor'])
+
+        objects = self.objects
+        if values is not None:
+            objects = objects.filter(self.after(values, backwards))
+        objects = objects.order_by(*[self.direction(key, backwards) for key in self.keys])
+
+        if limit:
+            objects = list(objects[:limit + 1])
+            more = len(objects) > limit
+            objects = objects[:limit]
+        else:
+            objects, more = list(objects), False
+
+        if backwards:
+            objects.reverse()
+
+        meta = {'limit': limit, 'next_cursor': None, 'previous_cursor': None}
+        if objects and (more or backwards):
+            meta['next_cursor'] = self.encode_cursor(objects[-1], False)
+        if objects and (more or not backwards) and values is not None:
+            meta['previous_cursor'] = self.encode_cursor(objects[0], True)
+        meta['next'] = self.cursor_uri(meta['next_cursor'])
+        meta['previous'] = self.cursor_uri(meta['previous_cursor'])
+
+        return {
+            'objects': objects,
+            'meta': meta
+        }
+
+    def direction(self, key, backwards):
+        """
+            Returns the order_by() argument of a key, inverted when paging backwards
+        """
+        descending = key.startswith('-')
+        name = key.lstrip('-')
+        return '-' + name if descending != backwards else name
+
+    def after(self, values, backwards):
+        """
+            Returns the filter for the objects following the given key values in sort order
+        """
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            name = key.lstrip('-')
+            lookup = 'lt' if key.startswith('-') != backwards else 'gt'
+
+            # All previous keys are equal and this one comes after
+            step = Q(**{'{0}__{1}'.format(name, lookup): values[i]})
+            for previous, value in zip(self.keys[:i], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+
+        return condition
+
+    def encode_cursor(self, obj, backwards):
+        values = []
+        for key in self.keys:
+            value = getattr(obj, self.objects.model._meta.get_field(key.lstrip('-')).attname)
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.isoformat()
+            values.append(value)
+
+        return base64.urlsafe_b64encode(json.dumps([int(backwards), values]))
+
+    def decode_cursor(self, cursor):
+        """
+            Returns whether the cursor pages backwards and the key values it points at, None for the first page
+        """
+        if not cursor:
+            return False, None
+
+        try:
+            backwards, values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            if len(values) != len(self.keys):
+                raise ValueError()
+
+            fields = [self.objects.model._meta.get_field(key.lstrip('-')) for key in self.keys]
+            return bool(backwards), [field.to_python(value) for field, value in zip(fields, values)]
+        except Exception:
+            raise BadRequest('Invalid cursor provided.')
+
+    def cursor_uri(self, cursor):
+        if cursor is None or self.resource_uri is None:
+            return None
+
+        request_params = dict((k, v.encode('utf-8')) for k, v in self.request_data.items() if k != 'offset')
+        request_params['cursor'] = cursor
+        return '{0}?{1}'.format(self.resource_uri, urlencode(request_params))
+
+
+def keyset_paginator(*keys):
+    """
+        Returns a KeysetPaginator class paging by the given keys
+    """
+    return type('KeysetPaginator', (KeysetPaginator,), {'keys': keys})
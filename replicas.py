@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    Routing of the reads of safe requests to read replicas.
+
+    Add 'handball.replicas.ReplicaRouter' to DATABASE_ROUTERS, the aliases of the replicas to HANDBALL_READ_REPLICAS
+    and 'handball.middleware.ReplicaMiddleware' to MIDDLEWARE_CLASSES. The middleware lets GET, HEAD and OPTIONS
+    requests and views decorated with read_only read from a randomly picked replica, unless their view is decorated
+    with primary. Everything else, and every read of a request after its first write, goes to the primary database,
+    so a request always sees its own writes. Reads whose results are cached across requests go to the primary as
+    well (see primary_reads), since a lagging replica would keep stale data in the cache until the next change.
+    Without replicas or outside of requests the router leaves the reads to Django.
+"""
+
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Request methods that don't change anything
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def get_replicas():
+    return tuple(getattr(settings, 'HANDBALL_READ_REPLICAS', ()))
+
+
+def read_only(view):
+    """
+        Marks a view that doesn't write, so its requests read from a replica whatever their method
+    """
+    view.read_only = True
+    return view
+
+
+def primary(view):
+    """
+        Marks a view that needs the latest data, so its requests read from the primary whatever their method
+    """
+    view.read_only = False
+    return view
+
+
+def begin_replica_reads():
+    """
+        Lets the reads of the current thread go to a replica until its first write or end_replica_reads()
+    """
+    replicas = get_replicas()
+    _state.database = random.choice(replicas) if replicas else None
+    _state.written = False
+
+
+def end_replica_reads():
+    _state.database = None
+
+
+@contextmanager
+def primary_reads():
+    """
+        Lets the reads of the current thread within the block go to the primary, e.g. to fill a cache
+    """
+    database = read_database()
+    if database is not None:
+        _state.database = DEFAULT_DB_ALIAS
+    try:
+        yield
+    finally:
+        # A write within the block keeps the rest of the request on the primary
+        if database is not None and read_database() is not None and not getattr(_state, 'written', False):
+            _state.database = database
+
+
+def read_database():
+    """
+        Returns the alias of the database the current thread reads from, None if the routing is left to Django
+    """
+    return getattr(_state, 'database', None)
+
+
+class ReplicaRouter(object):
+    """
+        Sends the reads of safe requests to a replica and all writes to the primary database
+    """
+    def archive_database(self, model):
+        """
+            Returns the alias of the archive database if the model is archived, None otherwise
+        """
+        # Imported late, the routers are loaded before the models
+        from handball.models import ArchiveManager
+
+        if isinstance(model._default_manager, ArchiveManager):
+            return model._default_manager.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        # The archive isn't replicated, so the reads of archived models, also those of the related managers of archived
+        # objects, go to the archive database
+        return self.archive_database(model) or read_database()
+
+    def db_for_write(self, model, **hints):
+        archive_database = self.archive_database(model)
+        if archive_database is not None:
+            return archive_database
+
+        # Read your writes: the rest of the request reads from the primary, even through objects read from a replica
+        if read_database() is not None:
+            _state.database = DEFAULT_DB_ALIAS
+            _state.written = True
+
+        # Objects read from a replica would otherwise be saved to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = (DEFAULT_DB_ALIAS,) + get_replicas()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # Replicas get their tables through replication
+        if db in get_replicas():
+            return False
+        return None
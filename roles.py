@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    Index of the roles a user has within the handball graph.
+
+    The validated manager, member, player and coach relations of a person are loaded once and kept in the cache until
+    one of them changes, so permission checks don't need to query the database.
+"""
+
+from django.core.cache import cache
+from tastypie.authorization import Authorization
+from handball.caching import CACHE_TIMEOUT, person_cache_key, roles_cache_key
+from handball.replicas import primary_reads
+from handball.models import Person, Club, Team, ClubMemberRelation, TeamPlayerRelation, TeamCoachRelation, ClubManagerRelation, TeamManagerRelation
+
+
+class RoleIndex(object):
+    """
+        The validated relations of a person
+    """
+    def __init__(self, person_id):
+        self.person_id = person_id
+        self.managed_clubs = set(ClubManagerRelation.objects.filter(manager=person_id, validated=True).values_list('club', flat=True))
+        self.managed_teams = set(TeamManagerRelation.objects.filter(manager=person_id, validated=True).values_list('team', flat=True))
+        self.clubs = set(ClubMemberRelation.objects.filter(member=person_id, validated=True).values_list('club', flat=True))
+        self.teams = set(TeamPlayerRelation.objects.filter(player=person_id, validated=True).values_list('team', flat=True))
+        self.coached_teams = set(TeamCoachRelation.objects.filter(coach=person_id, validated=True).values_list('team', flat=True))
+
+    def manages_club(self, club_id):
+        return club_id in self.managed_clubs
+
+    def manages_team(self, team):
+        """
+            Whether or not the person manages the given team, either directly or as a manager of its club
+        """
+        return team.id in self.managed_teams or team.club_id in self.managed_clubs
+
+    def is_club_member(self, club_id):
+        return club_id in self.clubs
+
+    def plays_for(self, team_id):
+        return team_id in self.teams
+
+    def coaches(self, team_id):
+        return team_id in self.coached_teams
+
+    def can_edit(self, obj):
+        """
+            Whether or not the person may change or delete the given object
+        """
+        if isinstance(obj, Club):
+            return self.manages_club(obj.id) or obj.created_by_id == self.person_id
+        elif isinstance(obj, Team):
+            return self.manages_team(obj) or obj.created_by_id == self.person_id
+        elif isinstance(obj, ClubMemberRelation):
+            return self.manages_club(obj.club_id) or obj.member_id == self.person_id
+        elif isinstance(obj, TeamPlayerRelation):
+            return self.manages_team(obj.team) or obj.player_id == self.person_id
+        elif isinstance(obj, TeamCoachRelation):
+            return self.manages_team(obj.team) or obj.coach_id == self.person_id
+        elif isinstance(obj, ClubManagerRelation):
+            return self.manages_club(obj.club_id)
+        elif isinstance(obj, TeamManagerRelation):
+            return self.manages_team(obj.team)
+        return False
+
+
+def get_roles(request):
+    """
+        Returns the RoleIndex of the requesting user or None if the user has no handball profile.
+        The index is loaded at most once per request and cached across requests.
+    """
+    if not hasattr(request, '_handball_roles'):
+        request._handball_roles = None
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated():
+            # The cached person id and roles are read from the primary, a lagging replica would keep them stale
+            person_id = cache.get(person_cache_key(user.id))
+            if person_id is None:
+                with primary_reads():
+                    person_id = Person.objects.filter(user=user).values_list('id', flat=True)[:1]
+                    person_id = person_id[0] if person_id else 0
+                cache.set(person_cache_key(user.id), person_id, CACHE_TIMEOUT)
+
+            if person_id:
+                roles = cache.get(roles_cache_key(person_id))
+                if roles is None:
+                    with primary_reads():
+                        roles = RoleIndex(person_id)
+                    cache.set(roles_cache_key(person_id), roles, CACHE_TIMEOUT)
+                request._handball_roles = roles
+
+    return request._handball_roles
+
+
+class RoleAuthorization(Authorization):
+    """
+        Authorization based on the handball graph. Everybody may read and create objects, but only people with a
+        managing role for an object (or the subject of a relation) may change or delete it.
+    """
+    def is_authorized(self, request, object=None):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') or object is None:
+            return True
+
+        roles = get_roles(request)
+        return roles is not None and roles.can_edit(object)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+    Generation of double round-robin fixtures for a group.
+
+    Every team of the group plays every other team once at home and once away. Games take place at the home site of
+    the home team's club and are placed in the first free slot of their round: on the round's day at the first kickoff
+    time, then at the later ones and then on the following days of the round. A slot is free if neither team, the site
+    nor any of the officials has another game at that time. Busy times are kept in an IntervalIndex that is loaded
+    with the existing games of the season once, so every check is a binary search instead of a database query.
+"""
+
+import bisect
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from handball.models import Club, Game, Group, GroupTeamRelation, OfficialAssignment, Team, bump_versions, game_display_name
+
+# Positions every game needs an official for
+OFFICIAL_POSITIONS = OfficialAssignment.objects.POSITIONS
+
+# Minutes between the end of a game and the start of the next one at the same site or with the same people
+BREAK_MINUTES = 30
+
+
+class IntervalIndex(object):
+    """
+        Busy time intervals per key, e.g. ('site', 3), sorted by start
+    """
+    def __init__(self):
+        self.intervals = {}
+        self.longest = {}  # Length of the longest interval per key, bounds how far back overlaps are searched
+
+    def add(self, key, start, end):
+        bisect.insort(self.intervals.setdefault(key, []), (start, end))
+        self.longest[key] = max(self.longest.get(key, datetime.timedelta(0)), end - start)
+
+    def overlaps(self, key, start, end):
+        """
+            Whether or not the given interval overlaps a busy interval of the key
+        """
+        intervals = self.intervals.get(key)
+        if not intervals:
+            return False
+
+        # Only intervals starting before the end and at most the longest interval before the start can overlap
+        i = bisect.bisect_left(intervals, (end,)) - 1
+        earliest = start - self.longest[key]
+        while i >= 0 and intervals[i][0] >= earliest:
+            if intervals[i][1] > start:
+                return True
+            i -= 1
+        return False
+
+
+def round_robin(teams):
+    """
+        Returns the rounds of a double round robin of the given teams as lists of (home, away) pairs. The second half
+        repeats the first one with home and away swapped. With an odd number of teams one team sits out every round.
+    """
+    teams = list(teams)
+    if len(teams) % 2:
+        teams.append(None)
+
+    rounds = []
+    for r in range(len(teams) - 1):
+        pairs = []
+        for i in range(len(teams) // 2):
+            home, away = teams[i], teams[-1 - i]
+            # Alternate home and away between the rounds
+            if (i + r) % 2:
+                home, away = away, home
+            if home is not None and away is not None:
+                pairs.append((home, away))
+        rounds.append(pairs)
+
+        # Circle method: the first team stays in place, the others rotate
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+
+    return rounds + [[(away, home) for home, away in pairs] for pairs in rounds]
+
+
+def busy_keys(game):
+    """
+        Returns the IntervalIndex keys of the teams, site and officials of a game
+    """
+    return [('team', game.home_id), ('team', game.away_id), ('site', game.site_id)] + \
+        [('person', getattr(game, position + '_id')) for position in OFFICIAL_POSITIONS]
+
+
+class Scheduler(object):
+    """
+        Places the games of a double round robin of a group
+    """
+    def __init__(self, group, first_day, officials, days_between_rounds=7, kickoffs=(datetime.time(18),), duration=60):
+        self.group = group
+        self.first_day = first_day
+        self.officials = list(officials)
+        self.days_between_rounds = days_between_rounds
+        self.kickoffs = sorted(kickoffs)
+        self.duration = duration
+        self.index = IntervalIndex()
+        self.load = dict((official, 0) for official in self.officials)  # Number of games per official
+
+    def interval(self, start, duration):
+        return start, start + datetime.timedelta(minutes=duration + BREAK_MINUTES)
+
+    def load_games(self, start, end):
+        """
+            Adds the existing games overlapping the given period to the index
+        """
+        longest = Game.objects.aggregate(Max('duration'))['duration__max'] or 0
+        games = Game.objects.filter(start__lt=end, start__gte=start - datetime.timedelta(minutes=longest + BREAK_MINUTES))
+        for game in games.only('start', 'duration', 'home', 'away', 'site', *OFFICIAL_POSITIONS):
+            self.add(game)
+
+    def add(self, game):
+        start, end = self.interval(game.start, game.duration)
+        for key in busy_keys(game):
+            self.index.add(key, start, end)
+
+    def free_officials(self, start, end):
+        """
+            Returns the officials without a game at the given time, least busy first
+        """
+        free = [official for official in self.officials if not self.index.overlaps(('person', official), start, end)]
+        return sorted(free, key=lambda official: self.load[official])
+
+    def place(self, game, day):
+        """
+            Sets the start and officials of a game to the first free slot from the given day on. Returns whether or not
+            one was found within the round.
+        """
+        for offset in range(self.days_between_rounds):
+            for kickoff in self.kickoffs:
+                start, end = self.interval(datetime.datetime.combine(day + datetime.timedelta(days=offset), kickoff), self.duration)
+
+                keys = [('team', game.home_id), ('team', game.away_id), ('site', game.site_id)]
+                if any(self.index.overlaps(key, start, end) for key in keys):
+                    continue
+
+                officials = self.free_officials(start, end)
+                if len(officials) < len(OFFICIAL_POSITIONS):
+                    continue
+
+                game.start = start
+                for position, official in zip(OFFICIAL_POSITIONS, officials):
+                    setattr(game, position + '_id', official)
+                    self.load[official] += 1
+                self.add(game)
+                return True
+
+        return False
+
+    def schedule(self):
+        """
+            Returns the unsaved games of the group's round robin. Raises a ValidationError if they can't all be placed.
+        """
+        if len(set(self.officials)) < len(OFFICIAL_POSITIONS):
+            raise ValidationError(u'At least {0} officials are needed.'.format(len(OFFICIAL_POSITIONS)))
+
+        team_ids = list(GroupTeamRelation.objects.filter(group=self.group).order_by('team').values_list('team', flat=True))
+        if len(team_ids) < 2:
+            raise ValidationError(u'The group has less than two teams.')
+
+        rows = list(Team.objects.filter(id__in=team_ids).values_list('id', 'club__home_site', 'display_name'))
+        sites = dict((team_id, site_id) for team_id, site_id, name in rows)
+        names = dict((team_id, name) for team_id, site_id, name in rows)
+        homeless = [team_id for team_id, site_id in sites.items() if site_id is None]
+        if homeless:
+            clubs = Club.objects.filter(teams__in=homeless).distinct().values_list('name', flat=True)
+            raise ValidationError(u'No home site set for {0}.'.format(', '.join(sorted(clubs))))
+
+        rounds = round_robin(team_ids)
+        last_day = self.first_day + datetime.timedelta(days=len(rounds) * self.days_between_rounds)
+        self.load_games(datetime.datetime.combine(self.first_day, datetime.time()), datetime.datetime.combine(last_day, datetime.time()))
+
+        games = []
+        for number, pairs in enumerate(rounds):
+            day = self.first_day + datetime.timedelta(days=number * self.days_between_rounds)
+            for home, away in pairs:
+                game = Game(home_id=home, away_id=away, site_id=sites[home], group_id=self.group.id, duration=self.duration,
+                    score_home=0, score_away=0, played=False)
+                if not self.place(game, day):
+                    raise ValidationError(u'No free slot for team {0} against team {1} in round {2}.'.format(home, away, number + 1))
+                game.display_name = game_display_name(game.start, names[home], names[away])
+                games.append(game)
+
+        return games
+
+
+def schedule_group(group, first_day, officials, commit=True, **options):
+    """
+        Schedules the double round robin of a group and saves its games unless commit is False. Returns the games.
+    """
+    games = Scheduler(group, first_day, officials, **options).schedule()
+
+    if commit:
+        with transaction.commit_on_success():
+            # Stay below the maximum number of query parameters of SQLite
+            chunk_size = 900 // len(Game._meta.fields)
+            for i in range(0, len(games), chunk_size):
+                Game.objects.bulk_create(games[i:i + chunk_size])
+
+            # bulk_create doesn't set the primary keys, which the assignments of the officials need. No other game of
+            # the teams can start at the same time, so the new games are identified by their teams and start.
+            keys = dict(((game.home_id, game.away_id, game.start), game) for game in games)
+            starts = [game.start for game in games]
+            created = Game.objects.filter(group=group.id, start__gte=min(starts), start__lte=max(starts), played=False)
+            for pk, home, away, start in created.values_list('id', 'home', 'away', 'start'):
+                if (home, away, start) in keys:
+                    keys[(home, away, start)].id = pk
+
+            OfficialAssignment.objects.insert(OfficialAssignment.objects.assignments(games))
+
+            # Scheduled games don't change the standings, only the version of the group
+            bump_versions(Group.objects.filter(id=group.id))
+
+    return games
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+    Text normalization and trigrams of the name search index.
+
+    Names are lower cased, stripped of accents and split into words. Every word is padded with two spaces in front
+    and cut into trigrams, e.g. 'max' into '  m', ' ma' and 'max'. A query matches an indexed name by the number of
+    trigrams they share: prefixes share all of their trigrams with the full word and names with a typo still share
+    most of them. The index itself is kept by SearchEntry and SearchTerm in models.py.
+"""
+
+import re
+import unicodedata
+
+# Share of the trigrams of a query an indexed name has to contain to be returned
+MIN_SIMILARITY = 0.5
+
+# Letters that don't decompose into an ascii letter and an accent
+TRANSLITERATIONS = {u'ß': u'ss', u'æ': u'ae', u'ø': u'o', u'ł': u'l'}
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """
+        Returns the lower cased words of a text without accents and punctuation, separated by single spaces
+    """
+    text = unicode(text or u'').lower()
+    for letter, replacement in TRANSLITERATIONS.items():
+        text = text.replace(letter, replacement)
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore')
+    return NON_ALPHANUMERIC.sub(' ', text).strip()
+
+
+def trigrams(text):
+    """
+        Returns the set of trigrams of a normalized text
+    """
+    grams = set()
+    for word in text.split():
+        word = '  ' + word
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def rank(query, hits, text):
+    """
+        Returns the sort key of an indexed text sharing the given number of trigrams with a normalized query. Names
+        that all query words are a prefix of come first, then the most similar and shortest ones.
+    """
+    words = text.split()
+    prefix = all(any(word.startswith(part) for word in words) for part in query.split())
+    return (not prefix, -hits, len(text), text)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    Compact output formats for bulk listings.
+
+    Besides tastypie's formats, responses can be requested as MessagePack ('format=msgpack' or
+    'Accept: application/x-msgpack') and as columnar JSON ('format=columnar' or 'Accept: application/x-columnar+json').
+    The latter returns the 'objects' of list responses as one array per field instead of one object per row, e.g.
+
+        {"meta": {...}, "objects": {"id": ["1", "2"], "name": ["Foo", "Bar"]}}
+
+    so the field names are sent only once. Other responses are returned as plain JSON. MessagePack is only offered if
+    the msgpack package is installed, clients asking for it get the default format otherwise.
+"""
+
+from django.core.serializers import json
+from django.utils import simplejson
+from tastypie.serializers import Serializer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class HandballSerializer(Serializer):
+    """
+        Serializer that adds the MessagePack and columnar JSON formats
+    """
+    formats = Serializer.formats + ['columnar'] + (['msgpack'] if msgpack is not None else [])
+    content_types = dict(Serializer.content_types, **{
+        'columnar': 'application/x-columnar+json',
+        'msgpack': 'application/x-msgpack'
+    })
+
+    def to_columns(self, rows):
+        """
+            Turns a list of rows into a dict of one list per field. Fields missing in a row are filled with None.
+        """
+        names = []
+        for row in rows:
+            for name in row:
+                if name not in names:
+                    names.append(name)
+
+        return dict((name, [row.get(name) for row in rows]) for name in names)
+
+    def to_columnar(self, data, options=None):
+        """
+            Given some Python data, produces JSON output with the objects of list responses in columns
+        """
+        options = options or {}
+        data = self.to_simple(data, options)
+
+        if isinstance(data, dict) and isinstance(data.get('objects'), list) and all(isinstance(row, dict) for row in data['objects']):
+            data['objects'] = self.to_columns(data['objects'])
+
+        return simplejson.dumps(data, cls=json.DjangoJSONEncoder, sort_keys=True)
+
+    def to_msgpack(self, data, options=None):
+        """
+            Given some Python data, produces MessagePack output
+        """
+        options = options or {}
+
+        # Keys are byte strings in Python 2, they have to be packed as strings rather than binary data
+        return msgpack.packb(self.to_simple(data, options), use_bin_type=False)
+
+    def from_msgpack(self, content):
+        """
+            Given some MessagePack data, returns a Python dictionary of the decoded data
+        """
+        return msgpack.unpackb(content, raw=False)
+
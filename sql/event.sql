@@ -0,0 +1,2 @@
+-- Events are looked up and ordered by game and time
+CREATE INDEX handball_event_game_id_time ON handball_event (game_id, time);
@@ -0,0 +1,2 @@
+-- The terms of an object are deleted by kind and id whenever it is saved
+CREATE INDEX handball_searchterm_kind_object_id ON handball_searchterm (kind, object_id);
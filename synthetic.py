@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+    Generator for synthetic handball leagues, used to measure the app at realistic sizes.
+
+    The size of a league is given as the number of events. Everything else is derived with a realistic fan-out:
+    groups of 12 teams play a double round robin, every club has 3 teams, a district 20 clubs and a union 8 districts.
+"""
+
+import datetime
+import random
+
+from django.db import transaction
+from django.db.models import Max
+from handball.models import *
+
+EVENTS_PER_GAME = 50
+TEAMS_PER_GROUP = 12
+TEAMS_PER_CLUB = 3
+CLUBS_PER_DISTRICT = 20
+DISTRICTS_PER_UNION = 8
+PLAYERS_PER_TEAM = 14
+LINEUP_SIZE = 12
+OFFICIALS_PER_GROUP = 8  # Two crews of four, one per game of a group starting at the same time
+
+# Relative frequency of the event types in a game
+EVENT_TYPES = (('goal', 70), ('penalty_shot_goal', 5), ('penalty_shot_miss', 2), ('warning', 8), ('time_penalty', 12),
+    ('team_time_penalty', 2), ('disqualification', 1))
+
+# Event types that count as goals
+GOAL_TYPES = ('goal', 'penalty_shot_goal')
+
+MODELS = (Union, District, Site, Club, Team, Person, LeagueLevel, Group, GroupTeamRelation, ClubMemberRelation, ClubManagerRelation,
+    TeamPlayerRelation, TeamCoachRelation, TeamManagerRelation, Game, GamePlayerRelation, Event, PlayerStats, Season, ArchivedGame,
+    ArchivedGamePlayerRelation, ArchivedEvent)
+
+
+class Inserter(object):
+    """
+        Inserts new objects in chunks with bulk_create and counts them per model
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, model, objs, key=None):
+        """
+            Inserts the objects. bulk_create doesn't set the primary keys, so if the objects are referenced later, their
+            ids are read back by the given natural key fields among the rows added after the insert started. The keys
+            are unique within a generated league, so concurrent writers don't get in the way.
+        """
+        if key:
+            floor = model.objects.aggregate(Max('id'))['id__max'] or 0
+
+        # Stay below the maximum number of query parameters of SQLite
+        chunk_size = max(1, 900 // len(model._meta.fields))
+        for i in range(0, len(objs), chunk_size):
+            model.objects.bulk_create(objs[i:i + chunk_size])
+
+        if key:
+            attnames = [model._meta.get_field(name).attname for name in key]
+            ids = dict((row[1:], row[0]) for row in model.objects.filter(id__gt=floor).values_list('id', *key))
+            for obj in objs:
+                obj.id = ids[tuple(getattr(obj, attname) for attname in attnames)]
+
+        self.counts[model._meta.object_name] = self.counts.get(model._meta.object_name, 0) + len(objs)
+        return objs
+
+
+def generate_league(events=1000, seed=None, start=None):
+    """
+        Generates a league with about the given number of events and returns the number of created objects per model.
+        The games are inserted group by group along with their lineups and events, so memory use doesn't grow with
+        the number of events.
+    """
+    rand = random.Random(seed)
+    insert = Inserter()
+    start = start or datetime.datetime(2012, 9, 1, 18)
+
+    games_count = max(1, events // EVENTS_PER_GAME)
+    games_per_group = TEAMS_PER_GROUP * (TEAMS_PER_GROUP - 1)
+    groups_count = max(1, -(-games_count // games_per_group))
+    teams_count = groups_count * TEAMS_PER_GROUP
+    clubs_count = -(-teams_count // TEAMS_PER_CLUB)
+    districts_count = -(-clubs_count // CLUBS_PER_DISTRICT)
+    unions_count = -(-districts_count // DISTRICTS_PER_UNION)
+
+    with transaction.commit_on_success():
+        unions = insert(Union, [Union(name='Union {0}'.format(i)) for i in range(unions_count)], ('name',))
+        districts = insert(District, [District(name='District {0}'.format(i), union=unions[i // DISTRICTS_PER_UNION])
+            for i in range(districts_count)], ('name',))
+        sites = insert(Site, [Site(address='Hallenweg {0}'.format(i), city='Stadt {0}'.format(i), zip_code=10000 + i)
+            for i in range(clubs_count)], ('address',))
+        clubs = insert(Club, [Club(name='Club {0}'.format(i), validated=True, district=districts[i // CLUBS_PER_DISTRICT], home_site=sites[i])
+            for i in range(clubs_count)], ('name',))
+        teams = [Team(name='{0}'.format(i % TEAMS_PER_CLUB + 1), validated=True, club=clubs[i // TEAMS_PER_CLUB]) for i in range(teams_count)]
+        for team in teams:
+            team.display_name = team_display_name(team.club.name, team.name)
+        insert(Team, teams, ('club', 'name'))
+
+        # Every team has its players, the first of them also coaches and manages the team. Pass numbers continue after
+        # the existing ones.
+        first_pass_number = (Person.objects.aggregate(Max('pass_number'))['pass_number__max'] or 0) + 1
+        players = insert(Person, [Person(first_name=rand.choice(FIRST_NAMES), last_name=rand.choice(LAST_NAMES),
+            gender='male', pass_number=first_pass_number + i, validated=True) for i in range(teams_count * PLAYERS_PER_TEAM)], ('pass_number',))
+        rosters = [players[i * PLAYERS_PER_TEAM:(i + 1) * PLAYERS_PER_TEAM] for i in range(teams_count)]
+
+        insert(TeamPlayerRelation, [TeamPlayerRelation(team=team, player=player, validated=True)
+            for team, roster in zip(teams, rosters) for player in roster])
+        insert(TeamCoachRelation, [TeamCoachRelation(team=team, coach=roster[0], validated=True) for team, roster in zip(teams, rosters)])
+        insert(TeamManagerRelation, [TeamManagerRelation(team=team, manager=roster[0], validated=True) for team, roster in zip(teams, rosters)])
+        insert(ClubMemberRelation, [ClubMemberRelation(club=team.club, member=player, primary=True, validated=True)
+            for team, roster in zip(teams, rosters) for player in roster])
+        insert(ClubManagerRelation, [ClubManagerRelation(club=teams[i * TEAMS_PER_CLUB].club, manager=rosters[i * TEAMS_PER_CLUB][0], validated=True)
+            for i in range(clubs_count)])
+
+        level = insert(LeagueLevel, [LeagueLevel(name='Kreisliga', district_specific=True)], ('name',))[0]
+        groups = insert(Group, [Group(name='Kreisliga {0}'.format(i), kind='league', age_group='adults', validated=True, level=level,
+            district=teams[i * TEAMS_PER_GROUP].club.district, union=teams[i * TEAMS_PER_GROUP].club.district.union)
+            for i in range(groups_count)], ('name',))
+        insert(GroupTeamRelation, [GroupTeamRelation(group=groups[i // TEAMS_PER_GROUP], team=team, validated=True)
+            for i, team in enumerate(teams)])
+
+        # Officials have pass numbers as well, which identify them after the insert
+        first_pass_number += len(players)
+        officials = insert(Person, [Person(first_name=rand.choice(FIRST_NAMES), last_name=rand.choice(LAST_NAMES),
+            pass_number=first_pass_number + i, validated=True) for i in range(groups_count * OFFICIALS_PER_GROUP)], ('pass_number',))
+
+        # Double round robin within every group, six games a week
+        remaining = games_count
+        for g, group in enumerate(groups):
+            group_teams = range(g * TEAMS_PER_GROUP, (g + 1) * TEAMS_PER_GROUP)
+            group_officials = officials[g * OFFICIALS_PER_GROUP:(g + 1) * OFFICIALS_PER_GROUP]
+            pairings = [(home, away) for home in group_teams for away in group_teams if home != away][:remaining]
+            remaining -= len(pairings)
+            crews = {}  # Start -> number of games of the group starting then
+
+            games = []
+            lineups = []
+            game_events = []
+            for day, (home, away) in enumerate(pairings):
+                # Games starting at the same time get different officials, so nobody is booked twice
+                game_start = start + datetime.timedelta(days=7 * (day // (TEAMS_PER_GROUP // 2)), hours=day % 3)
+                crew = group_officials[crews.get(game_start, 0) * 4:][:4]
+                crews[game_start] = crews.get(game_start, 0) + 1
+
+                # The events are recorded in the first version of the game, so the live ticker sends them (see
+                # record_event_changes)
+                game = Game(start=game_start, score_home=0, score_away=0, home=teams[home], away=teams[away], group=group,
+                    site=teams[home].club.home_site, referee=crew[0], timer=crew[1], secretary=crew[2], supervisor=crew[3],
+                    home_validated=True, away_validated=True, referee_validated=True, version=1)
+                game.display_name = game_display_name(game.start, teams[home].display_name, teams[away].display_name)
+                games.append(game)
+
+                lineup = dict((team, rand.sample(rosters[team], LINEUP_SIZE)) for team in (home, away))
+                for team in (home, away):
+                    for number, player in enumerate(lineup[team], 1):
+                        lineups.append(GamePlayerRelation(game=game, player=player, team=teams[team], shirt_number=number))
+
+                for minute in sorted(rand.randint(0, game.duration - 1) for i in range(EVENTS_PER_GAME)):
+                    team = rand.choice((home, away))
+                    event_type = weighted_choice(rand, EVENT_TYPES)
+                    game_events.append(Event(game=game, time=minute, event_type=event_type, person=rand.choice(lineup[team]), team=teams[team],
+                        version=1))
+
+                    if event_type in GOAL_TYPES:
+                        if team == home:
+                            game.score_home += 1
+                        else:
+                            game.score_away += 1
+
+                if game.score_home != game.score_away:
+                    game.winner = game.home if game.score_home > game.score_away else game.away
+
+            # Every pairing plays once at home, which identifies the games of the group
+            insert(Game, games, ('group', 'home', 'away'))
+
+            # Assign the games again now that they have primary keys
+            for obj in lineups + game_events:
+                obj.game = obj.game
+            insert(GamePlayerRelation, lineups)
+            insert(Event, game_events)
+
+    # bulk_create bypasses the signal handlers, so the standings, player statistics, search index and assignments are built in one go
+    for group in groups:
+        GroupTeamRelation.objects.recompute(group.id)
+    PlayerStats.objects.rebuild()
+    SearchEntry.objects.rebuild()
+    OfficialAssignment.objects.rebuild()
+
+    return insert.counts
+
+
+def weighted_choice(rand, choices):
+    """
+        Picks one of the given (choice, weight) pairs according to its weight
+    """
+    value = rand.uniform(0, sum(weight for choice, weight in choices))
+    for choice, weight in choices:
+        value -= weight
+        if value <= 0:
+            return choice
+    return choices[-1][0]
+
+
+FIRST_NAMES = (u'Andreas', u'Christian', u'Daniel', u'Dominik', u'Felix', u'Florian', u'Jan', u'Jonas', u'Julian', u'Kai', u'Lukas', u'Markus', u'Martin',
+    u'Matthias', u'Michael', u'Niklas', u'Patrick', u'Philipp', u'Sebastian', u'Simon', u'Stefan', u'Thomas', u'Tim', u'Tobias', u'Uwe')
+
+LAST_NAMES = (u'Bauer', u'Becker', u'Braun', u'Fischer', u'Hartmann', u'Hoffmann', u'Koch', u'Klein', u'Krüger', u'Lange', u'Meyer', u'Müller', u'Neumann',
+    u'Richter', u'Schäfer', u'Schmidt', u'Schmitz', u'Schneider', u'Schröder', u'Schulz', u'Schwarz', u'Wagner', u'Weber', u'Wolf', u'Zimmermann')
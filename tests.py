@@ -1,4 +1,38 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import tempfile
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, connections, router
+from django.http import HttpRequest
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.unittest import skipIf
 from tastypie.test import ResourceTestCase
+from handball.models import *
+from handball.memberships import reconcile_memberships
+from handball.roles import get_roles
+from handball.instrumentation import registry
+from handball.ticker import feeds
+from handball.synthetic import generate_league
+from handball.benchmark import run_benchmark, compare_reports
+from handball.serializers import HandballSerializer, msgpack
+from handball.scheduler import round_robin, schedule_group
+from handball.archive import archive_season
+from handball.replicas import ReplicaRouter, begin_replica_reads, end_replica_reads, read_database
+from handball.urls import v1_api
 
 
 class UnionResourceTest(ResourceTestCase):
@@ -6,3 +40,1496 @@ class UnionResourceTest(ResourceTestCase):
 
     def test_get_list_unauthorzied(self):
         self.assertHttpUnauthorized(self.api_client.get('/api/v1/unions/', format='json'))
+
+
+def bulk_create(model, objs):
+    """
+        Bulk insert objects and return the primary keys of the inserted rows
+    """
+    start = model.objects.count()
+    model.objects.bulk_create(objs)
+    return list(model.objects.order_by('id').values_list('id', flat=True)[start:])
+
+
+def create_club(name='HSG Test', district=None):
+    """
+        Create a club with its whole district/union hierarchy and a home site
+    """
+    if district is None:
+        union = Union.objects.create(name='Union')
+        district = District.objects.create(name='District', union=union)
+    site = Site.objects.create(address='Hallenweg 1', city='Teststadt', zip_code=12345)
+    return Club.objects.create(name=name, district=district, home_site=site)
+
+
+class PersonResourceTest(ResourceTestCase):
+    def setUp(self):
+        super(PersonResourceTest, self).setUp()
+        self.club = create_club()
+
+    def create_members(self, count):
+        for i in range(count):
+            person = Person.objects.create(first_name='Player', last_name=str(i))
+            ClubMemberRelation.objects.create(member=person, club=self.club)
+            ClubMemberRelation.objects.create(member=person, club=create_club('Club ' + str(i), self.club.district))
+
+    def get_list_num_queries(self):
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.get('/api/v1/person/', format='json', data={'limit': 0})
+        self.assertValidJSONResponse(response)
+        return len(connection.queries)
+
+    def test_get_list_clubs(self):
+        self.create_members(2)
+        objects = self.deserialize(self.api_client.get('/api/v1/person/', format='json'))['objects']
+        self.assertEqual(len(objects), 2)
+        self.assertEqual(len(objects[0]['clubs']), 2)
+        self.assertEqual(objects[0]['clubs'][0]['district']['union']['name'], 'Union')
+
+    def test_get_list_num_queries_constant(self):
+        self.create_members(2)
+        few = self.get_list_num_queries()
+        self.create_members(10)
+        self.assertEqual(few, self.get_list_num_queries())
+
+
+class TeamResourceTest(ResourceTestCase):
+    def setUp(self):
+        super(TeamResourceTest, self).setUp()
+        self.club = create_club()
+
+    def create_teams(self, count):
+        for i in range(count):
+            team = Team.objects.create(name=str(i), club=self.club)
+            for j in range(3):
+                player = Person.objects.create(first_name='Player', last_name=str(j))
+                TeamPlayerRelation.objects.create(team=team, player=player, validated=j > 0)
+
+    def get_list_num_queries(self):
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.get('/api/v1/team/', format='json', data={'limit': 0})
+        self.assertValidJSONResponse(response)
+        return len(connection.queries)
+
+    def test_get_list_players(self):
+        self.create_teams(1)
+        team = self.deserialize(self.api_client.get('/api/v1/team/', format='json'))['objects'][0]
+        self.assertEqual([player['last_name'] for player in team['players']], ['1', '2'])
+        self.assertEqual(team['players'][0]['clubs'][0]['name'], self.club.name)
+
+    def test_get_list_num_queries_constant(self):
+        self.create_teams(2)
+        few = self.get_list_num_queries()
+        self.create_teams(10)
+        self.assertEqual(few, self.get_list_num_queries())
+
+
+def create_game(group, home, away, score_home, score_away, **kwargs):
+    """
+        Create a game between two teams including the required officials and site
+    """
+    official = Person.objects.create(first_name='Official', last_name='Person')
+    site = home.club.home_site or Site.objects.create(address='Hallenweg 1', city='Teststadt', zip_code=12345)
+    if score_home != score_away:
+        kwargs.setdefault('winner', home if score_home > score_away else away)
+    return Game.objects.create(group=group, home=home, away=away, score_home=score_home, score_away=score_away,
+        start=kwargs.pop('start', datetime.datetime(2012, 9, 1, 18)), referee=official, timer=official, secretary=official,
+        supervisor=official, site=site, **kwargs)
+
+
+class StandingsTest(ResourceTestCase):
+    def setUp(self):
+        super(StandingsTest, self).setUp()
+        club = create_club()
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.teams = [Team.objects.create(name=str(i), club=club) for i in range(3)]
+
+    def test_record_game(self):
+        create_game(self.group, self.teams[0], self.teams[1], 30, 25)
+        create_game(self.group, self.teams[1], self.teams[2], 20, 20)
+
+        rel = GroupTeamRelation.objects.get(group=self.group, team=self.teams[1])
+        self.assertEqual((rel.score, rel.games, rel.wins, rel.draws, rel.losses), (1, 2, 0, 1, 1))
+        self.assertEqual((rel.goals_for, rel.goals_against), (45, 50))
+
+    def test_recompute(self):
+        create_game(self.group, self.teams[0], self.teams[1], 30, 25)
+        game = create_game(self.group, self.teams[2], self.teams[0], 22, 21)
+        expected = list(GroupTeamRelation.objects.order_by('team').values())
+
+        GroupTeamRelation.objects.update(score=0, games=0, wins=0, goals_for=0)
+        GroupTeamRelation.objects.recompute(self.group)
+        self.assertEqual(expected, list(GroupTeamRelation.objects.order_by('team').values()))
+
+        game.delete()
+        rel = GroupTeamRelation.objects.get(group=self.group, team=self.teams[2])
+        self.assertEqual((rel.score, rel.games, rel.goals_for), (0, 0, 0))
+
+    def test_move_game(self):
+        game = create_game(self.group, self.teams[0], self.teams[1], 30, 25)
+        group = Group.objects.create(name='Pokal', kind='cup', age_group='adults')
+
+        # The standings of the group the game was moved from are updated as well
+        game.group = group
+        game.save()
+        self.assertEqual(GroupTeamRelation.objects.get(group=self.group, team=self.teams[0]).games, 0)
+        self.assertEqual(GroupTeamRelation.objects.get(group=group, team=self.teams[0]).games, 1)
+
+        game.group = None
+        game.save()
+        self.assertEqual(GroupTeamRelation.objects.get(group=group, team=self.teams[0]).games, 0)
+
+    def test_get_standings(self):
+        create_game(self.group, self.teams[0], self.teams[1], 30, 25)
+        create_game(self.group, self.teams[2], self.teams[1], 30, 20)
+
+        response = self.api_client.get('/api/v1/standings/', format='json', data={'group': self.group.id})
+        objects = self.deserialize(response)['objects']
+        self.assertEqual([row['team_name'] for row in objects], [unicode(self.teams[2]), unicode(self.teams[0]), unicode(self.teams[1])])
+        self.assertEqual(objects[0]['goal_difference'], 10)
+
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/standings/', format='json', data={'group': 'x'}))
+
+
+class DisplayNameTest(ResourceTestCase):
+    def setUp(self):
+        super(DisplayNameTest, self).setUp()
+        self.club = create_club()
+        self.home = Team.objects.create(name='1', club=self.club)
+        self.away = Team.objects.create(name='1', club=create_club('SG Gast', self.club.district))
+        self.game = create_game(Group.objects.create(name='Liga', kind='league', age_group='adults'), self.home, self.away, 20, 20)
+
+    def test_display_names(self):
+        team, game = Team.objects.get(id=self.home.id), Game.objects.get(id=self.game.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(unicode(team), u'HSG Test 1')
+            self.assertEqual(unicode(game), u'2012/9/1: HSG Test 1 vs. SG Gast 1')
+
+    def test_rename(self):
+        version = self.game.version
+
+        self.club.name = u'HSG Umbenannt'
+        self.club.save()
+        self.assertEqual(Team.objects.get(id=self.home.id).display_name, u'HSG Umbenannt 1')
+        game = Game.objects.get(id=self.game.id)
+        self.assertEqual(game.display_name, u'2012/9/1: HSG Umbenannt 1 vs. SG Gast 1')
+        self.assertTrue(game.version > version)
+
+        self.away.name = '2'
+        self.away.save()
+        self.assertEqual(Game.objects.get(id=self.game.id).display_name, u'2012/9/1: HSG Umbenannt 1 vs. SG Gast 2')
+
+    def test_rebuild(self):
+        Team.objects.update(display_name='')
+        Game.objects.update(display_name='')
+
+        out = StringIO()
+        call_command('rebuild_display_names', stdout=out)
+        self.assertIn('2 teams and 1 games', out.getvalue())
+        self.assertEqual(Game.objects.get(id=self.game.id).display_name, u'2012/9/1: HSG Test 1 vs. SG Gast 1')
+
+    def test_get_list(self):
+        data = self.deserialize(self.api_client.get('/api/v1/game/', format='json'))
+        self.assertEqual(data['objects'][0]['display_name'], self.game.display_name)
+        data = self.deserialize(self.api_client.get('/api/v1/team/', format='json', data={'fields': 'display_name'}))
+        self.assertEqual([obj['display_name'] for obj in data['objects']], [u'HSG Test 1', u'SG Gast 1'])
+
+
+class PlayerStatsTest(ResourceTestCase):
+    def setUp(self):
+        super(PlayerStatsTest, self).setUp()
+        club = create_club()
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.home, self.away = Team.objects.create(name='1', club=club), Team.objects.create(name='2', club=club)
+        self.game = create_game(self.group, self.home, self.away, 2, 1)
+        self.player = Person.objects.create(first_name='Player', last_name='1')
+
+    def create_event(self, event_type, game=None):
+        return Event.objects.create(time=1, event_type=event_type, person=self.player, game=game or self.game, team=self.home)
+
+    def get_stats(self):
+        return PlayerStats.objects.values('goals', 'penalty_shot_goals', 'penalty_shot_misses', 'warnings', 'group').get(person=self.player)
+
+    def test_incremental(self):
+        for event_type in ('goal', 'goal', 'penalty_shot_goal', 'penalty_shot_miss'):
+            self.create_event(event_type)
+        warning = self.create_event('warning')
+        self.assertEqual(self.get_stats(), {'goals': 2, 'penalty_shot_goals': 1, 'penalty_shot_misses': 1, 'warnings': 1, 'group': self.group.id})
+
+        warning.delete()
+        self.assertEqual(self.get_stats()['warnings'], 0)
+
+        # Changing an event rebuilds the rollups of the game's teams
+        warning = self.create_event('warning')
+        warning.event_type = 'goal'
+        warning.save()
+        self.assertEqual((self.get_stats()['goals'], self.get_stats()['warnings']), (3, 0))
+
+    def test_no_group(self):
+        friendly = create_game(None, self.home, self.away, 1, 0)
+        self.create_event('goal', friendly)
+        self.create_event('goal', friendly)
+        self.assertEqual(PlayerStats.objects.get(person=self.player).goals, 2)
+        self.assertRaises(IntegrityError, PlayerStats.objects.create, person=self.player, team=self.home, group=None)
+
+    def test_narrow_rebuild(self):
+        self.create_event('goal')
+        friendly = create_game(None, self.home, self.away, 1, 0)
+        event = self.create_event('warning', friendly)
+
+        # Only the rollups of the edited event's group are rebuilt
+        PlayerStats.objects.filter(group=self.group).update(warnings=5)
+        event.event_type = 'goal'
+        event.save()
+        self.assertEqual(PlayerStats.objects.filter(group=None).values_list('goals', 'warnings').get(), (1, 0))
+        self.assertEqual(PlayerStats.objects.filter(group=self.group).values_list('goals', 'warnings').get(), (1, 5))
+
+        # Moving the game to the group moves the rollups of its events
+        friendly.group = self.group
+        friendly.save()
+        self.assertEqual(PlayerStats.objects.filter(group=self.group).values_list('goals', 'warnings').get(), (2, 0))
+        self.assertFalse(PlayerStats.objects.filter(group=None).exists())
+
+    def test_game_delete(self):
+        self.create_event('goal')
+        self.create_event('goal', create_game(self.group, self.home, self.away, 1, 1))
+        self.game.delete()
+        self.assertEqual(self.get_stats()['goals'], 1)
+
+    def test_rebuild(self):
+        for event_type in ('goal', 'warning', 'penalty_shot_goal'):
+            self.create_event(event_type)
+        self.create_event('goal', create_game(None, self.home, self.away, 1, 0))
+        fields = ('person', 'team', 'group', 'goals', 'penalty_shot_goals', 'warnings')
+        expected = list(PlayerStats.objects.order_by('group').values_list(*fields))
+
+        PlayerStats.objects.all().delete()
+        PlayerStats.objects.rebuild()
+        self.assertEqual(expected, list(PlayerStats.objects.order_by('group').values_list(*fields)))
+
+    def test_get_stats(self):
+        for event_type in ('goal', 'penalty_shot_goal', 'penalty_shot_goal', 'penalty_shot_miss'):
+            self.create_event(event_type)
+        self.create_event('goal', create_game(None, self.home, self.away, 1, 0))
+
+        data = self.deserialize(self.api_client.get('/api/v1/player_stats/', format='json', data={'person': self.player.id}))
+        self.assertEqual(len(data['objects']), 2)
+        self.assertEqual(data['totals']['goals'], 2)
+        self.assertAlmostEqual(data['totals']['penalty_shot_conversion'], 2 / 3.0)
+
+        data = self.deserialize(self.api_client.get('/api/v1/player_stats/', format='json',
+            data={'person': self.player.id, 'game': self.game.id}))
+        self.assertEqual(data['totals']['goals'], 1)
+
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/player_stats/', format='json', data={'person': 'x'}))
+
+
+class TickerTest(ResourceTestCase):
+    def setUp(self):
+        super(TickerTest, self).setUp()
+        feeds.feeds.clear()
+        club = create_club()
+        self.home, self.away = Team.objects.create(name='1', club=club), Team.objects.create(name='2', club=club)
+        self.game = create_game(None, self.home, self.away, 0, 0)
+        self.player = Person.objects.create(first_name='Player', last_name='1')
+
+    def create_event(self, minute):
+        return Event.objects.create(time=minute, event_type='goal', person=self.player, game=self.game, team=self.home)
+
+    def get_ticker(self, cursor, **params):
+        return self.deserialize(self.api_client.get('/api/v1/ticker/', format='json', data=dict(params, game=self.game.id, cursor=cursor)))
+
+    def test_cursor(self):
+        events = [self.create_event(i) for i in range(3)]
+
+        data = self.get_ticker(0)
+        self.assertEqual([obj['id'] for obj in data['objects']], [event.id for event in events])
+        self.assertEqual(data['objects'][0]['person_name'], 'Player 1')
+        self.assertEqual(self.get_ticker(data['cursor'])['objects'], [])
+
+        event = self.create_event(3)
+        data = self.get_ticker(data['cursor'])
+        self.assertEqual([obj['id'] for obj in data['objects']], [event.id])
+
+        # Edited events are sent again, deleted events as tombstones
+        event.time = 4
+        event.save()
+        data = self.get_ticker(data['cursor'])
+        self.assertEqual([(obj['id'], obj['time']) for obj in data['objects']], [(event.id, 4)])
+        event_id = event.id
+        event.delete()
+        data = self.get_ticker(data['cursor'])
+        self.assertEqual(data['objects'], [{'id': event_id, 'deleted': True}])
+
+        # Viewers that start now don't get tombstones
+        self.assertEqual([obj['id'] for obj in self.get_ticker(0)['objects']], [obj.id for obj in events])
+
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/ticker/', format='json', data={'game': self.game.id, 'cursor': 'x'}))
+
+    def test_processes(self):
+        self.create_event(1)
+        cursor = self.get_ticker(0)['cursor']
+
+        # The cursor only depends on the database, so a process that hasn't seen the game before continues from it
+        feeds.feeds.clear()
+        event = self.create_event(2)
+        self.assertEqual([obj['id'] for obj in self.get_ticker(cursor)['objects']], [event.id])
+
+    def test_late_commit(self):
+        data = self.get_ticker(0)
+
+        # Events are only sent once the version they were changed in is recorded along with them
+        Event.objects.bulk_create([Event(id=5, time=1, event_type='goal', person=self.player, game=self.game, team=self.home)])
+        feeds.get(self.game.id).refreshed = 0
+        self.assertEqual(self.get_ticker(data['cursor'])['objects'], [])
+
+        record_event_changes(self.game.id, changed=[5])
+        feeds.get(self.game.id).refreshed = 0
+        data = self.get_ticker(data['cursor'])
+        self.assertEqual([obj['id'] for obj in data['objects']], [5])
+        self.assertEqual(self.get_ticker(data['cursor'])['objects'], [])
+
+    def test_wait_timeout(self):
+        started = time.time()
+        self.assertEqual(self.get_ticker(0, wait=0.2)['objects'], [])
+        self.assertTrue(time.time() - started >= 0.2)
+
+    def test_fan_out(self):
+        feed = feeds.get(self.game.id)
+        events, cursor = feed.read()
+        self.assertEqual(events, [])
+        self.create_event(1)
+
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        for viewer in range(100):
+            self.assertEqual(len(feed.read(cursor)[0]), 1)
+
+        # A single read of the version, the events and the tombstones for all viewers
+        self.assertEqual(len(connection.queries), 3)
+
+
+class ConditionalGetTest(ResourceTestCase):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        club = create_club()
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.home, self.away = Team.objects.create(name='1', club=club), Team.objects.create(name='2', club=club)
+        self.game = create_game(self.group, self.home, self.away, 0, 0)
+        self.player = Person.objects.create(first_name='Player', last_name='1')
+
+    def get(self, uri, etag=None, **params):
+        if etag is None:
+            return self.api_client.get(uri, format='json', data=params)
+        return self.api_client.get(uri, format='json', data=params, HTTP_IF_NONE_MATCH=etag)
+
+    def assertNotModified(self, uri, **params):
+        etag = self.get(uri, **params)['ETag']
+
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.get(uri, etag, **params)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(connection.queries), 1)
+        return etag
+
+    def assertModified(self, uri, etag, **params):
+        response = self.get(uri, etag, **params)
+        self.assertValidJSONResponse(response)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_game(self):
+        uri = '/api/v1/game/{0}/'.format(self.game.id)
+        etag = self.assertNotModified(uri)
+        self.assertTrue(self.get(uri).has_header('Last-Modified'))
+
+        Event.objects.create(time=1, event_type='goal', person=self.player, game=self.game, team=self.home)
+        self.assertModified(uri, etag)
+
+        # The events embed their persons
+        etag = self.get(uri)['ETag']
+        self.player.last_name = '2'
+        self.player.save()
+        self.assertModified(uri, etag)
+
+    def test_team(self):
+        uri = '/api/v1/team/{0}/'.format(self.home.id)
+        etag = self.assertNotModified(uri)
+
+        # A new player changes the roster, a renamed player the roster entry
+        rel = TeamPlayerRelation.objects.create(team=self.home, player=self.player, validated=True)
+        self.assertModified(uri, etag)
+        etag = self.get(uri)['ETag']
+        self.player.last_name = '2'
+        self.player.save()
+        self.assertModified(uri, etag)
+
+        # The roster entries embed the clubs of the players along with their district, union and home site
+        club = create_club('Other Club')
+        ClubMemberRelation.objects.create(club=club, member=self.player)
+        for obj in (club, club.district, club.district.union, club.home_site):
+            etag = self.get(uri)['ETag']
+            obj.save()
+            self.assertModified(uri, etag)
+
+        # Other teams are unaffected
+        self.assertNotModified('/api/v1/team/{0}/'.format(self.away.id))
+
+    def test_list(self):
+        etag = self.assertNotModified('/api/v1/club/')
+        Club.objects.all()[0].save()
+        self.assertModified('/api/v1/club/', etag)
+
+    def test_standings(self):
+        etag = self.assertNotModified('/api/v1/standings/', group=self.group.id)
+        create_game(self.group, self.away, self.home, 30, 20)
+        self.assertModified('/api/v1/standings/', etag, group=self.group.id)
+
+    def test_if_modified_since(self):
+        uri = '/api/v1/group/{0}/'.format(self.group.id)
+        modified = self.get(uri)['Last-Modified']
+        self.assertEqual(self.api_client.get(uri, format='json', HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+
+
+class KeysetPaginationTest(ResourceTestCase):
+    def setUp(self):
+        super(KeysetPaginationTest, self).setUp()
+        club = create_club()
+        home, away = Team.objects.create(name='1', club=club), Team.objects.create(name='2', club=club)
+        group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        for i in range(7):
+            create_game(group, home, away, 0, 0, start=datetime.datetime(2012, 9, 1 + i % 3, 18))
+        self.expected = list(Game.objects.order_by('start', 'id').values_list('id', flat=True))
+
+    def get_page(self, uri, **params):
+        response = self.api_client.get(uri, format='json', data=params)
+        self.assertValidJSONResponse(response)
+        return self.deserialize(response)
+
+    def test_walk(self):
+        ids = []
+        page = self.get_page('/api/v1/game/', limit=3, cursor='')
+        self.assertEqual(page['meta']['previous'], None)
+        while True:
+            ids.extend(int(game['id']) for game in page['objects'])
+            if not page['meta']['next']:
+                break
+            page = self.get_page('/api/v1/game/', limit=3, cursor=page['meta']['next_cursor'])
+        self.assertEqual(ids, self.expected)
+
+        # And back again
+        page = self.get_page('/api/v1/game/', limit=3, cursor=page['meta']['previous_cursor'])
+        self.assertEqual([int(game['id']) for game in page['objects']], self.expected[3:6])
+        page = self.get_page('/api/v1/game/', limit=3, cursor=page['meta']['previous_cursor'])
+        self.assertEqual([int(game['id']) for game in page['objects']], self.expected[:3])
+        self.assertEqual(page['meta']['previous'], None)
+
+    def test_offset_mode(self):
+        page = self.get_page('/api/v1/game/', limit=3, offset=3)
+        self.assertEqual(page['meta']['total_count'], 7)
+        self.assertEqual(len(page['objects']), 3)
+
+    def test_invalid_cursor(self):
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/game/', format='json', data={'cursor': 'invalid'}))
+
+
+class SparseFieldsTest(ResourceTestCase):
+    def setUp(self):
+        super(SparseFieldsTest, self).setUp()
+        self.club = create_club()
+        for i in range(3):
+            team = Team.objects.create(name=str(i), club=self.club)
+            for j in range(3):
+                TeamPlayerRelation.objects.create(team=team, player=Person.objects.create(first_name='Player', last_name=str(j)), validated=True)
+
+    def get_teams(self, **params):
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.get('/api/v1/team/', format='json', data=params)
+        self.assertValidJSONResponse(response)
+        return self.deserialize(response)['objects'], len(connection.queries)
+
+    def test_fields(self):
+        teams, queries = self.get_teams(fields='name,club.name')
+        self.assertEqual(teams[0], {'name': '0', 'club': {'name': self.club.name}})
+        # The version aggregate, the count and the page itself, without prefetching the rosters
+        self.assertEqual(queries, 3)
+
+        teams, queries = self.get_teams(fields='name,players.last_name')
+        self.assertEqual(teams[0]['players'], [{'last_name': '0'}, {'last_name': '1'}, {'last_name': '2'}])
+
+    def test_depth(self):
+        teams, queries = self.get_teams(depth=0)
+        self.assertEqual(teams[0]['club'], '/api/v1/club/{0}/'.format(self.club.id))
+        self.assertTrue(teams[0]['players'][0].startswith('/api/v1/person/'))
+
+        teams, queries = self.get_teams(depth=1)
+        self.assertEqual(teams[0]['club']['district'], '/api/v1/district/{0}/'.format(self.club.district_id))
+        self.assertTrue(teams[0]['players'][0]['clubs'][0].startswith('/api/v1/club/'))
+
+        # The full representation is unchanged
+        teams, queries = self.get_teams()
+        self.assertEqual(teams[0]['club']['district']['id'], str(self.club.district_id))
+
+    def test_invalid_depth(self):
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/team/', format='json', data={'depth': -1}))
+
+
+class AvailabilityTest(ResourceTestCase):
+    def setUp(self):
+        super(AvailabilityTest, self).setUp()
+        self.club = create_club()
+        self.home = Team.objects.create(name='1', club=self.club)
+        self.away = Team.objects.create(name='2', club=self.club)
+        self.officials = [Person.objects.create(first_name='Official', last_name=str(i)) for i in range(6)]
+        for official in self.officials:
+            ClubMemberRelation.objects.create(member=official, club=self.club)
+
+        self.game = self.create_game(datetime.datetime(2013, 9, 7, 18), self.officials[:4])
+        # The fifth official has officiated before, the sixth never has
+        self.create_game(datetime.datetime(2013, 8, 31, 18), [self.officials[4]] * 4)
+
+    def create_game(self, start, officials):
+        return Game.objects.create(start=start, score_home=0, score_away=0, home=self.home, away=self.away, site=self.club.home_site,
+            referee=officials[0], timer=officials[1], secretary=officials[2], supervisor=officials[3])
+
+    def free(self, start, end):
+        response = self.api_client.get('/api/v1/officials/free/', format='json', data={'district': self.club.district_id, 'start': start, 'end': end})
+        self.assertValidJSONResponse(response)
+        return [obj['id'] for obj in self.deserialize(response)['objects']]
+
+    def test_free(self):
+        self.assertEqual(self.free('2013-09-07T17:00', '2013-09-07T18:30'), [self.officials[4].id])
+        self.assertEqual(self.free('2013-09-07T19:00', '2013-09-07T20:00'), [official.id for official in self.officials[:5]])
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/officials/free/', format='json',
+            data={'district': self.club.district_id, 'start': '2013-09-07T19:00', 'end': 'tomorrow'}))
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/officials/free/', format='json',
+            data={'district': 'x', 'start': '2013-09-07T19:00', 'end': '2013-09-07T20:00'}))
+
+    def test_moved_game(self):
+        self.game.start = datetime.datetime(2013, 9, 8, 18)
+        self.game.save()
+        self.assertEqual(len(self.free('2013-09-07T17:00', '2013-09-07T18:30')), 5)
+        self.assertEqual(self.free('2013-09-08T18:30', '2013-09-08T18:45'), [self.officials[4].id])
+
+    def test_double_booking(self):
+        game = Game(start=datetime.datetime(2013, 9, 7, 18, 30), score_home=0, score_away=0, home=self.home, away=self.away,
+            site=self.club.home_site, referee=self.officials[4], timer=self.officials[5], secretary=self.officials[5], supervisor=self.officials[0])
+        self.assertRaises(ValidationError, game.clean)
+        game.start = datetime.datetime(2013, 9, 7, 19)
+        game.clean()
+
+        # The game itself doesn't count as a conflict
+        self.game.clean()
+
+        data = {
+            'start': '2013-09-07T18:30:00', 'score_home': 0, 'score_away': 0, 'home': '/api/v1/team/{0}/'.format(self.home.id),
+            'away': '/api/v1/team/{0}/'.format(self.away.id), 'site': '/api/v1/site/{0}/'.format(self.club.home_site_id),
+            'group': '/api/v1/group/{0}/'.format(Group.objects.create(name='Liga', kind='league', age_group='adults').id), 'events': []
+        }
+        for position, official in zip(('referee', 'timer', 'secretary', 'supervisor'), (4, 5, 5, 0)):
+            data[position] = '/api/v1/person/{0}/'.format(self.officials[official].id)
+        response = self.api_client.post('/api/v1/game/', format='json', data=data)
+        self.assertHttpBadRequest(response)
+        self.assertIn('already assigned', response.content)
+        self.assertEqual(Game.objects.count(), 2)
+
+        data['start'] = '2013-09-07T19:00:00'
+        self.assertHttpCreated(self.api_client.post('/api/v1/game/', format='json', data=data))
+
+
+class ArchiveTest(ResourceTestCase):
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        club = create_club()
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.teams = [Team.objects.create(name=str(i), club=club) for i in range(3)]
+        self.player = Person.objects.create(first_name='Player', last_name='1')
+        self.season = Season.objects.create(name='2011/12', start=datetime.date(2011, 8, 1), end=datetime.date(2012, 7, 31))
+
+        self.games = [create_game(self.group, self.teams[0], self.teams[1], 30, 25, start=datetime.datetime(2011, 9, 3, 18)),
+            create_game(self.group, self.teams[1], self.teams[2], 20, 20, start=datetime.datetime(2012, 7, 31, 18))]
+        for game in self.games:
+            GamePlayerRelation.objects.create(game=game, player=self.player, team=self.teams[1], shirt_number=7)
+            Event.objects.create(time=1, event_type='goal', person=self.player, game=game, team=self.teams[1])
+
+        # A game of the next season
+        self.live = create_game(self.group, self.teams[2], self.teams[0], 22, 21, start=datetime.datetime(2012, 9, 1, 18))
+        Event.objects.create(time=1, event_type='goal', person=self.player, game=self.live, team=self.teams[2])
+
+    def test_archive(self):
+        standings = list(GroupTeamRelation.objects.order_by('team').values())
+        stats = list(PlayerStats.objects.order_by('team').values())
+
+        out = StringIO()
+        call_command('archive_season', '2011/12', chunk_size=1, stdout=out)
+        self.assertIn('Archived 2 games', out.getvalue())
+        self.assertTrue(Season.objects.get(id=self.season.id).archived)
+
+        self.assertEqual(list(Game.objects.values_list('id', flat=True)), [self.live.id])
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(GamePlayerRelation.objects.count(), 0)
+        self.assertFalse(OfficialAssignment.objects.exclude(game=self.live).exists())
+
+        self.assertEqual(sorted(ArchivedGame.objects.values_list('id', flat=True)), [game.id for game in self.games])
+        archived = ArchivedGame.objects.get(id=self.games[0].id)
+        self.assertEqual((archived.season_id, archived.home_id, archived.winner_id, archived.score_home), (self.season.id, self.teams[0].id, self.teams[0].id, 30))
+        self.assertEqual(list(archived.events.values_list('person_id', 'team_id')), [(self.player.id, self.teams[1].id)])
+        self.assertEqual(list(archived.players.values_list('player_id', 'shirt_number')), [(self.player.id, 7)])
+
+        # Archiving doesn't change the standings and rollups, rebuilding them counts the archived games
+        self.assertEqual(standings, list(GroupTeamRelation.objects.order_by('team').values()))
+        self.assertEqual(stats, list(PlayerStats.objects.order_by('team').values()))
+        GroupTeamRelation.objects.recompute(self.group)
+        PlayerStats.objects.rebuild()
+        self.assertEqual(standings, list(GroupTeamRelation.objects.order_by('team').values()))
+        self.assertEqual(stats, list(PlayerStats.objects.order_by('team').values()))
+
+    def test_open_season(self):
+        season = Season.objects.create(name='Current', start=datetime.date.today(), end=datetime.date.today() + datetime.timedelta(days=300))
+        self.assertRaises(ValidationError, archive_season, season)
+        self.assertEqual(Game.objects.count(), 3)
+
+    def test_get_archived_games(self):
+        archive_season(self.season)
+
+        response = self.api_client.get('/api/v1/archivedgame/', format='json', data={'season_id': self.season.id})
+        self.assertValidJSONResponse(response)
+        objects = self.deserialize(response)['objects']
+        self.assertEqual([obj['id'] for obj in objects], [game.id for game in self.games])
+        self.assertEqual(objects[0]['events'][0]['person_id'], self.player.id)
+        self.assertEqual(objects[0]['players'][0]['shirt_number'], 7)
+
+        # The archive is read-only
+        self.assertHttpMethodNotAllowed(self.api_client.delete('/api/v1/archivedgame/{0}/'.format(self.games[0].id), format='json'))
+        self.assertEqual(ArchivedGame.objects.count(), 2)
+
+
+class ReplicaTest(ResourceTestCase):
+    """
+        Uses a second SQLite database as replica that only has the person table and a person of its own
+    """
+    def setUp(self):
+        super(ReplicaTest, self).setUp()
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path}
+
+        replica = connections['replica']
+        cursor = replica.cursor()
+        for sql in replica.creation.sql_create_model(Person, no_style())[0]:
+            cursor.execute(sql)
+        Person.objects.db_manager('replica').bulk_create([Person(first_name='Replica', last_name='Person', pass_number=5)])
+
+        router.routers.insert(0, ReplicaRouter())
+
+    def tearDown(self):
+        router.routers.pop(0)
+        end_replica_reads()
+        connections['replica'].close()
+        delattr(connections._connections, 'replica')
+        del connections.databases['replica']
+        os.remove(self.path)
+        super(ReplicaTest, self).tearDown()
+
+    def test_router(self):
+        with self.settings(HANDBALL_READ_REPLICAS=('replica',)):
+            # Outside of requests everything reads from the primary
+            self.assertFalse(Person.objects.filter(pass_number=5).exists())
+
+            begin_replica_reads()
+            person = Person.objects.get(pass_number=5)
+            self.assertEqual(person._state.db, 'replica')
+
+            # Writes go to the primary, even those of objects read from the replica, and so do all reads after them
+            Person.objects.create(first_name='Primary', last_name='Person', pass_number=6)
+            self.assertEqual(list(Person.objects.values_list('pass_number', flat=True)), [6])
+            self.assertEqual(read_database(), 'default')
+
+    def test_archive(self):
+        with self.settings(HANDBALL_READ_REPLICAS=('replica',)):
+            game = ArchivedGame.objects.create(id=1, season_id=1, start=datetime.datetime(2012, 4, 1, 15), score_home=1,
+                score_away=0, duration=60, home_id=1, away_id=2, referee_id=1, timer_id=1, secretary_id=1,
+                supervisor_id=1, site_id=1)
+            ArchivedEvent.objects.create(id=1, game=game, event_type='goal', time=60, person_id=1, team_id=1)
+
+            # The archive isn't replicated, not even for the related managers of archived games
+            begin_replica_reads()
+            game = ArchivedGame.objects.get(id=1)
+            self.assertEqual(game.events.count(), 1)
+            self.assertEqual(read_database(), 'replica')
+
+    def test_lagging_replica(self):
+        # The replica has the union table, but not the latest writes
+        replica = connections['replica']
+        cursor = replica.cursor()
+        for sql in replica.creation.sql_create_model(Union, no_style())[0]:
+            cursor.execute(sql)
+        Union.objects.create(name='New Union')
+        user = User.objects.create_user('user', 'user@example.com', 'secret')
+        person = Person.objects.create(first_name='New', last_name='User', user=user)
+        cache.clear()
+
+        middleware = tuple(settings.MIDDLEWARE_CLASSES) + ('handball.middleware.ReplicaMiddleware',)
+        with self.settings(HANDBALL_READ_REPLICAS=('replica',), MIDDLEWARE_CLASSES=middleware):
+            # Cached responses and roles are built from the primary, the rest of the request still reads from the replica
+            response = self.api_client.get('/api/v1/union/', format='json')
+            self.assertEqual([obj['name'] for obj in self.deserialize(response)['objects']], ['New Union'])
+
+            begin_replica_reads()
+            request = HttpRequest()
+            request.user = user
+            self.assertEqual(get_roles(request).person_id, person.id)
+            self.assertEqual(read_database(), 'replica')
+            self.assertEqual(Union.objects.count(), 0)
+
+    def test_requests(self):
+        middleware = tuple(settings.MIDDLEWARE_CLASSES) + ('handball.middleware.ReplicaMiddleware',)
+        with self.settings(HANDBALL_READ_REPLICAS=('replica',), MIDDLEWARE_CLASSES=middleware):
+            # Safe requests and read-only views read from the replica
+            response = self.api_client.get('/api/v1/unique/', format='json', data={'pass_number': 5})
+            self.assertEqual(self.deserialize(response), {'pass_number': False})
+            response = self.api_client.post('/api/v1/unique/batch/', format='json', data={'pass_number': [5, 6]})
+            self.assertEqual(self.deserialize(response), {'pass_number': {'5': False, '6': True}})
+
+            # Other requests read from and write to the primary
+            self.assertHttpCreated(self.api_client.post('/api/v1/person/', format='json',
+                data={'first_name': 'New', 'last_name': 'Person', 'pass_number': 5}))
+            self.assertEqual(Person.objects.filter(pass_number=5).count(), 1)
+            self.assertEqual(Person.objects.using('replica').filter(pass_number=5).count(), 1)
+            self.assertEqual(read_database(), None)
+
+
+class SchedulerTest(TransactionTestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.clubs = [create_club('Club 0')]
+        self.clubs += [create_club('Club {0}'.format(i), self.clubs[0].district) for i in range(1, 4)]
+        self.teams = [Team.objects.create(name='1', club=club) for club in self.clubs]
+        for team in self.teams:
+            GroupTeamRelation.objects.create(group=self.group, team=team)
+        self.officials = [Person.objects.create(first_name='Official', last_name=str(i)).id for i in range(8)]
+
+    def test_round_robin(self):
+        rounds = round_robin(range(4))
+        self.assertEqual(len(rounds), 6)
+        pairs = [pair for pairs in rounds for pair in pairs]
+        self.assertEqual(sorted(pairs), sorted((home, away) for home in range(4) for away in range(4) if home != away))
+
+        # With an odd number of teams every team sits out once per half
+        rounds = round_robin(range(5))
+        self.assertEqual(len(rounds), 10)
+        self.assertTrue(all(len(pairs) == 2 for pairs in rounds))
+
+    def test_schedule(self):
+        games = schedule_group(self.group, datetime.date(2013, 9, 7), self.officials)
+        self.assertEqual(len(games), 12)
+        self.assertEqual(Game.objects.filter(group=self.group, played=False).count(), 12)
+
+        # The database assigned the ids, which the assignments of the officials refer to
+        self.assertEqual(sorted(game.id for game in games), sorted(Game.objects.values_list('id', flat=True)))
+        self.assertEqual(OfficialAssignment.objects.filter(game__in=[game.id for game in games]).count(), 48)
+
+        # Games are played at the home site on the first day of their round
+        for game in Game.objects.select_related('home__club'):
+            self.assertEqual(game.site_id, game.home.club.home_site_id)
+            self.assertEqual(game.start.weekday(), 5)
+            self.assertEqual(len(set([game.referee_id, game.timer_id, game.secretary_id, game.supervisor_id])), 4)
+
+        # Scheduled games don't count for the standings
+        GroupTeamRelation.objects.recompute(self.group)
+        self.assertEqual(sum(GroupTeamRelation.objects.values_list('games', flat=True)), 0)
+
+    def test_conflicts(self):
+        # The first home team's site and two officials are busy on the first day
+        site = self.clubs[0].home_site
+        other = create_club('Other', self.clubs[0].district)
+        Game.objects.create(start=datetime.datetime(2013, 9, 7, 17, 30), score_home=0, score_away=0, home=Team.objects.create(name='1', club=other),
+            away=self.teams[1], referee_id=self.officials[0], timer_id=self.officials[1], secretary_id=self.officials[2],
+            supervisor_id=self.officials[3], site=site)
+
+        games = schedule_group(self.group, datetime.date(2013, 9, 7), self.officials, kickoffs=(datetime.time(18), datetime.time(20)))
+        first = [game for game in games if game.start.date() == datetime.date(2013, 9, 7)]
+        self.assertEqual(len(first), 2)
+        for game in first:
+            # The busy team and site get the later kickoff, the busy officials officiate it
+            if self.teams[1].id in (game.home_id, game.away_id) or game.site_id == site.id:
+                self.assertEqual(game.start.hour, 20)
+            if game.start.hour == 18:
+                self.assertFalse(set(self.officials[:4]) & set([game.referee_id, game.timer_id, game.secretary_id, game.supervisor_id]))
+
+    def test_no_home_site(self):
+        Club.objects.filter(id=self.clubs[1].id).update(home_site=None)
+        self.assertRaises(ValidationError, schedule_group, self.group, datetime.date(2013, 9, 7), self.officials)
+        self.assertRaises(ValidationError, schedule_group, self.group, datetime.date(2013, 9, 7), self.officials[:3])
+
+    def test_performance(self):
+        district = self.clubs[0].district
+        group = Group.objects.create(name='Große Liga', kind='league', age_group='adults')
+        for i in range(16):
+            GroupTeamRelation.objects.create(group=group, team=Team.objects.create(name='1', club=create_club('Big {0}'.format(i), district)))
+        officials = [Person.objects.create(first_name='Official', last_name=str(i)).id for i in range(32)]
+
+        started = time.time()
+        games = schedule_group(group, datetime.date(2013, 9, 7), officials, commit=False)
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(len(games), 240)
+
+
+class ImportTest(TransactionTestCase):
+    def setUp(self):
+        self.club = create_club(u'HSG Süd')
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.files = []
+
+    def tearDown(self):
+        for path in self.files:
+            os.remove(path)
+
+    def write(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.write(fd, content.encode('utf-8'))
+        os.close(fd)
+        self.files.append(path)
+        return path
+
+    def import_season(self, **files):
+        call_command('import_season', chunk_size=2, stdout=StringIO(), **files)
+
+    def test_import(self):
+        clubs = self.write('.csv', u'name,district,validated\nTV Nord,District,1\nTV Ost,District,0\nTV Nord,District,1\n')
+        teams = self.write('.csv', u'club,name\nTV Nord,Herren 1\nTV Ost,Herren 1\nHSG Süd,Damen 1\n')
+        persons = self.write('.jsonl', u'\n'.join(json.dumps({'first_name': 'Player', 'last_name': str(i), 'pass_number': 100 + i}) for i in range(5)))
+        players = self.write('.csv', u'player,club,team,validated\n' + u''.join(u'{0},TV Nord,Herren 1,1\n'.format(100 + i) for i in range(3)) +
+            u'103,HSG Süd,Damen 1,0\n104,HSG Süd,Damen 1,0\n')
+        groups = self.write('.jsonl', json.dumps({'group': self.group.id, 'club': 'TV Nord', 'team': 'Herren 1'}))
+
+        self.import_season(club=clubs, team=teams, person=persons, team_player=players, group_team=groups)
+
+        self.assertEqual(Club.objects.count(), 3)
+        north = Team.objects.get(club__name='TV Nord')
+        self.assertEqual(north.players.count(), 3)
+        self.assertEqual(list(self.group.teams.all()), [north])
+
+        # The derived memberships were applied
+        self.assertEqual(ClubMemberRelation.objects.filter(club__name='TV Nord').count(), 3)
+        self.assertEqual(ClubMemberRelation.objects.filter(club=self.club).count(), 2)
+        self.assertEqual(TeamManagerRelation.objects.filter(team=north).count(), 1)
+
+        # Imported objects are found by the search
+        self.assertEqual(SearchEntry.objects.search('tv nord herren', kinds=('team',))[0].object_id, north.id)
+
+        # Repeating an import skips the existing rows
+        self.import_season(club=clubs, team_player=players)
+        self.assertEqual(Club.objects.count(), 3)
+        self.assertEqual(TeamPlayerRelation.objects.count(), 5)
+
+    def test_unknown_reference(self):
+        clubs = self.write('.csv', u'name,district\nTV Nord,District\nTV West,Nowhere\n')
+        with self.assertRaises(SystemExit):
+            self.import_season(club=clubs, stderr=StringIO())
+
+        # Nothing is imported
+        self.assertEqual(Club.objects.count(), 1)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """
+        Email backend whose mail server refuses every message
+    """
+    def send_messages(self, email_messages):
+        raise IOError('Connection refused')
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    """
+        Email backend whose mail server can't be connected to
+    """
+    def open(self):
+        raise IOError('Connection timed out')
+
+
+class CrashingEmailBackend(locmem.EmailBackend):
+    """
+        Email backend of a process that dies after sending the first message
+    """
+    def send_messages(self, email_messages):
+        if mail.outbox:
+            raise KeyboardInterrupt
+        return super(CrashingEmailBackend, self).send_messages(email_messages)
+
+
+class OutboxTest(TransactionTestCase):
+    def setUp(self):
+        User.objects.create_user('inviter', 'inviter@example.com', 'secret')
+        self.client.login(username='inviter', password='secret')
+
+    def invite(self, email, **params):
+        response = self.client.post('/api/v1/send_invitation/', dict(params, email=email))
+        self.assertEqual(response.status_code, 200)
+
+    def test_enqueue(self):
+        self.invite('a@example.com')
+        self.invite('b@example.com')
+
+        # Nothing is sent within the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.filter(status='queued').count(), 2)
+
+        self.assertEqual(OutboxMessage.objects.deliver(), (2, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com']])
+        self.assertEqual(OutboxMessage.objects.filter(status='sent').count(), 2)
+
+        # Sent messages are not sent again
+        self.assertEqual(OutboxMessage.objects.deliver(), (0, 0))
+
+    def test_profile(self):
+        self.invite('a@example.com', profile=json.dumps({'id': 3, 'first_name': 'Player'}))
+        self.assertIn('p=3', OutboxMessage.objects.get().body)
+
+        response = self.client.post('/api/v1/send_invitation/', {'email': 'a@example.com', 'profile': '3'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batches(self):
+        for i in range(5):
+            self.invite('{0}@example.com'.format(i))
+
+        call_command('send_outbox', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_retry(self):
+        self.invite('a@example.com')
+
+        with override_settings(EMAIL_BACKEND='handball.tests.FailingEmailBackend'):
+            self.assertEqual(OutboxMessage.objects.deliver(), (0, 1))
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), ('queued', 1))
+        self.assertEqual(message.last_error, 'IOError: Connection refused')
+
+        # The message is due again after a delay
+        self.assertEqual(OutboxMessage.objects.deliver(), (0, 0))
+        OutboxMessage.objects.update(next_attempt=datetime.datetime.now())
+        self.assertEqual(OutboxMessage.objects.deliver(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unreachable(self):
+        self.invite('a@example.com')
+        self.invite('b@example.com')
+
+        # The failed connection counts as a failed attempt for the whole batch
+        with override_settings(EMAIL_BACKEND='handball.tests.UnreachableEmailBackend'):
+            self.assertEqual(OutboxMessage.objects.deliver(), (0, 2))
+
+        for message in OutboxMessage.objects.all():
+            self.assertEqual((message.status, message.attempts), ('queued', 1))
+            self.assertEqual(message.last_error, 'IOError: Connection timed out')
+            self.assertGreater(message.next_attempt, datetime.datetime.now())
+
+    def test_claim(self):
+        self.invite('a@example.com')
+        self.invite('b@example.com')
+
+        # Messages claimed by another process are left to it
+        first = OutboxMessage.objects.order_by('id')[0]
+        OutboxMessage.objects.filter(id=first.id).update(status='sending',
+            next_attempt=datetime.datetime.now() + datetime.timedelta(seconds=OutboxMessage.objects.CLAIM_TIMEOUT))
+        self.assertEqual(OutboxMessage.objects.deliver(), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['b@example.com']])
+
+        # Unless the process didn't finish in time
+        OutboxMessage.objects.filter(id=first.id).update(next_attempt=datetime.datetime.now())
+        self.assertEqual(OutboxMessage.objects.deliver(), (1, 0))
+        self.assertEqual(OutboxMessage.objects.get(id=first.id).status, 'sent')
+
+    def test_crash(self):
+        self.invite('a@example.com')
+        self.invite('b@example.com')
+
+        with override_settings(EMAIL_BACKEND='handball.tests.CrashingEmailBackend'):
+            self.assertRaises(KeyboardInterrupt, OutboxMessage.objects.deliver)
+
+        # The message sent before the crash isn't sent again
+        self.assertEqual(list(OutboxMessage.objects.order_by('id').values_list('status', flat=True)), ['sent', 'sending'])
+
+    def test_dead_letter(self):
+        self.invite('a@example.com')
+
+        with override_settings(EMAIL_BACKEND='handball.tests.FailingEmailBackend'):
+            for i in range(len(OutboxMessage.objects.RETRY_DELAYS) + 1):
+                OutboxMessage.objects.update(next_attempt=datetime.datetime.now())
+                OutboxMessage.objects.deliver()
+
+        self.assertEqual(OutboxMessage.objects.get().status, 'failed')
+
+        call_command('send_outbox', requeue_failed=True, stdout=StringIO())
+        self.assertEqual(OutboxMessage.objects.get().status, 'sent')
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class SearchTest(ResourceTestCase):
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.club = create_club(u'TSV Mühlheim')
+        self.team = Team.objects.create(name='Herren 1', club=self.club)
+        self.max = Person.objects.create(first_name='Maximilian', last_name=u'Müller', city='Berlin')
+        self.other = Person.objects.create(first_name='Markus', last_name='Schmidt', city='Hamburg')
+
+    def search(self, q, **params):
+        response = self.api_client.get('/api/v1/search/', format='json', data=dict(params, q=q))
+        self.assertValidJSONResponse(response)
+        return [(obj['kind'], obj['id']) for obj in self.deserialize(response)['objects']]
+
+    def test_prefix(self):
+        self.assertEqual(self.search('max')[0], ('person', self.max.id))
+        self.assertEqual(self.search('MULL', kind='person'), [('person', self.max.id)])
+        self.assertEqual(self.search('schm', kind='club'), [])
+        self.assertEqual(self.search('berl'), [('person', self.max.id)])
+
+    def test_typo(self):
+        self.assertEqual(self.search('maximillian mueller')[0], ('person', self.max.id))
+        self.assertEqual(self.search('muhlhiem', kind='club'), [('club', self.club.id)])
+
+    def test_kinds(self):
+        self.assertEqual(self.search(u'mühlheim herren'), [('team', self.team.id), ('club', self.club.id)])
+        self.assertEqual(self.search(u'mühlheim', kind='team'), [('team', self.team.id)])
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/search/', format='json', data={'q': 'x', 'kind': 'game'}))
+
+    def test_maintenance(self):
+        self.max.last_name = 'Meier'
+        self.max.save()
+        self.assertEqual(self.search('meier'), [('person', self.max.id)])
+        self.assertEqual(self.search('mull', kind='person'), [])
+
+        # Renaming a club renames its teams
+        self.club.name = 'HSG Nord'
+        self.club.save()
+        self.assertEqual(self.search('nord herren'), [('team', self.team.id), ('club', self.club.id)])
+
+        self.other.delete()
+        self.assertEqual(self.search('schmidt'), [])
+
+        SearchEntry.objects.all().delete()
+        SearchTerm.objects.all().delete()
+        SearchEntry.objects.rebuild()
+        self.assertEqual(self.search('meier'), [('person', self.max.id)])
+
+
+class UniqueTest(ResourceTestCase):
+    def setUp(self):
+        super(UniqueTest, self).setUp()
+        for number in (1, 2, 3):
+            Person.objects.create(first_name='Player', last_name=str(number), pass_number=number)
+        Site.objects.create(address='Hallenweg 1', city='Teststadt', zip_code=12345, number=7)
+
+    def test_is_unique(self):
+        self.assertEqual(self.deserialize(self.api_client.get('/api/v1/unique/', format='json', data={'pass_number': 1})), {'pass_number': False})
+        self.assertEqual(self.deserialize(self.api_client.get('/api/v1/unique/', format='json', data={'pass_number': 4})), {'pass_number': True})
+
+    def test_batch(self):
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.get('/api/v1/unique/batch/', format='json', data={'pass_number': '1,2,99', 'site_number': '7,8'})
+        self.assertValidJSONResponse(response)
+        self.assertEqual(self.deserialize(response), {
+            'pass_number': {'1': False, '2': False, '99': True},
+            'site_number': {'7': False, '8': True}
+        })
+        # One query per key
+        self.assertEqual(len(connection.queries), 2)
+
+    def test_batch_post(self):
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.post('/api/v1/unique/batch/', format='json', data={'pass_number': range(500)})
+        self.assertValidJSONResponse(response)
+        data = self.deserialize(response)['pass_number']
+        self.assertEqual(len(data), 500)
+        self.assertEqual(sorted(value for value, unique in data.items() if not unique), ['1', '2', '3'])
+        self.assertEqual(len(connection.queries), 1)
+
+    def test_batch_invalid(self):
+        self.assertHttpBadRequest(self.api_client.get('/api/v1/unique/batch/', format='json', data={'pass_number': '1,x'}))
+        self.assertHttpBadRequest(self.api_client.post('/api/v1/unique/batch/', format='json', data={'number': [1]}))
+
+
+class SerializerTest(ResourceTestCase):
+    def setUp(self):
+        super(SerializerTest, self).setUp()
+        self.club = create_club()
+        for i in range(3):
+            Team.objects.create(name=str(i), club=self.club)
+
+    def test_columnar(self):
+        response = self.api_client.client.get('/api/v1/team/', {'format': 'columnar', 'fields': 'id,name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('application/x-columnar+json'))
+
+        data = json.loads(response.content)
+        self.assertEqual(data['meta']['total_count'], 3)
+        self.assertEqual(data['objects'], {'id': [str(team.id) for team in Team.objects.order_by('id')], 'name': ['0', '1', '2']})
+
+        # Negotiated through the Accept header as well, detail responses stay plain objects
+        response = self.api_client.client.get('/api/v1/club/{0}/'.format(self.club.id), HTTP_ACCEPT='application/x-columnar+json')
+        self.assertEqual(json.loads(response.content)['name'], self.club.name)
+
+    def test_columns(self):
+        columns = HandballSerializer().to_columns([{'a': 1, 'b': 2}, {'a': 3}])
+        self.assertEqual(columns, {'a': [1, 3], 'b': [2, None]})
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.api_client.client.get('/api/v1/team/', {'fields': 'name'}, HTTP_ACCEPT='application/x-msgpack')
+        self.assertTrue(response['Content-Type'].startswith('application/x-msgpack'))
+        self.assertEqual([team['name'] for team in msgpack.unpackb(response.content, raw=False)['objects']], ['0', '1', '2'])
+
+
+class ResponseCacheTest(ResourceTestCase):
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        cache.clear()
+        self.union = Union.objects.create(name='Union')
+        self.district = District.objects.create(name='District', union=self.union)
+
+    def get_districts(self):
+        response = self.api_client.get('/api/v1/district/', format='json')
+        self.assertValidJSONResponse(response)
+        return self.deserialize(response)['objects']
+
+    def test_cached_until_change(self):
+        self.get_districts()
+        self.assertNumQueries(0, self.get_districts)
+
+        self.union.name = 'Renamed'
+        self.union.save()
+        self.assertEqual(self.get_districts()[0]['union']['name'], 'Renamed')
+
+        District.objects.create(name='Other', union=self.union)
+        self.assertEqual(len(self.get_districts()), 2)
+
+    def test_unrelated_change(self):
+        self.get_districts()
+        LeagueLevel.objects.create(name='Kreisklasse')
+        self.assertNumQueries(0, self.get_districts)
+
+
+class GameSheetTest(ResourceTestCase):
+    def setUp(self):
+        super(GameSheetTest, self).setUp()
+        self.group = Group.objects.create(name='Liga', kind='league', age_group='adults')
+        self.home = Team.objects.create(name='1', club=create_club('Home'))
+        self.away = Team.objects.create(name='1', club=create_club('Away'))
+        self.official = Person.objects.create(first_name='Official', last_name='Person')
+
+    def build_sheet(self, player_count, event_count):
+        players = [Person.objects.create(first_name='Player', last_name=str(i)) for i in range(player_count)]
+        teams = [self.home, self.away]
+        return {
+            'game': {
+                'start': '2012-09-01T18:00:00', 'score_home': 25, 'score_away': 20, 'home': self.home.id, 'away': self.away.id,
+                'winner': '/api/v1/team/{0}/'.format(self.home.id), 'referee': self.official.id, 'timer': self.official.id,
+                'secretary': self.official.id, 'supervisor': self.official.id, 'group': self.group.id, 'site': self.home.club.home_site.id
+            },
+            'players': [{'player': player.id, 'team': teams[i % 2].id, 'shirt_number': i} for i, player in enumerate(players)],
+            'events': [{'time': i, 'event_type': 'goal', 'person': players[i % player_count].id, 'team': teams[i % player_count % 2].id}
+                for i in range(event_count)]
+        }
+
+    def test_post(self):
+        sheet = self.build_sheet(30, 80)
+
+        connection.use_debug_cursor = True
+        del connection.queries[:]
+        response = self.api_client.post('/api/v1/game_sheet/', format='json', data=sheet)
+        self.assertHttpCreated(response)
+        # Including the double-booking check and the assignments of the officials
+        self.assertTrue(len(connection.queries) < 31)
+
+        game = Game.objects.get()
+        self.assertEqual(game.events.count(), 80)
+        self.assertEqual(GamePlayerRelation.objects.filter(game=game).count(), 30)
+        self.assertEqual(TeamPlayerRelation.objects.filter(validated=True).count(), 30)
+        self.assertEqual(ClubMemberRelation.objects.filter(primary=True).count(), 30)
+        self.assertEqual(ClubManagerRelation.objects.filter(club=self.home.club).count(), 1)
+        self.assertEqual(GroupTeamRelation.objects.get(team=self.home).score, 2)
+        self.assertEqual(len(feeds.get(game.id).read()[0]), 80)
+
+    def test_post_invalid(self):
+        sheet = self.build_sheet(2, 2)
+        sheet['events'][1]['person'] = 9999
+
+        self.assertHttpBadRequest(self.api_client.post('/api/v1/game_sheet/', format='json', data=sheet))
+        self.assertEqual(Game.objects.count(), 0)
+
+        # Players listed twice and malformed items are rejected before anything is written
+        sheet = self.build_sheet(2, 2)
+        sheet['players'].append(sheet['players'][0])
+        self.assertHttpBadRequest(self.api_client.post('/api/v1/game_sheet/', format='json', data=sheet))
+        sheet = self.build_sheet(2, 2)
+        sheet['events'].append(3)
+        self.assertHttpBadRequest(self.api_client.post('/api/v1/game_sheet/', format='json', data=sheet))
+        self.assertEqual(Game.objects.count(), 0)
+
+
+class MembershipReconciliationTest(ResourceTestCase):
+    def setUp(self):
+        super(MembershipReconciliationTest, self).setUp()
+        self.club = create_club()
+        self.team = Team.objects.create(name='1', club=self.club)
+        self.players = [Person.objects.create(first_name='Player', last_name=str(i)) for i in range(10)]
+
+    def test_immediate(self):
+        TeamPlayerRelation.objects.create(team=self.team, player=self.players[0], validated=True)
+
+        membership = ClubMemberRelation.objects.get(member=self.players[0], club=self.club)
+        self.assertTrue(membership.primary and membership.validated)
+        self.assertEqual(TeamManagerRelation.objects.get(team=self.team).manager, self.players[0])
+        self.assertEqual(ClubManagerRelation.objects.get(club=self.club).manager, self.players[0])
+
+    def test_deferred(self):
+        with reconcile_memberships():
+            for player in self.players:
+                TeamPlayerRelation.objects.create(team=self.team, player=player)
+            TeamCoachRelation.objects.create(team=self.team, coach=self.players[0], validated=True)
+            self.assertEqual(ClubMemberRelation.objects.count(), 0)
+
+        self.assertEqual(ClubMemberRelation.objects.filter(club=self.club, primary=True).count(), 10)
+        self.assertEqual(TeamManagerRelation.objects.filter(team=self.team).count(), 1)
+        self.assertEqual(ClubManagerRelation.objects.filter(club=self.club).count(), 1)
+
+    def test_deferred_discarded_on_error(self):
+        try:
+            with reconcile_memberships():
+                TeamPlayerRelation.objects.create(team=self.team, player=self.players[0])
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(ClubMemberRelation.objects.count(), 0)
+
+
+class RoleTest(ResourceTestCase):
+    def setUp(self):
+        super(RoleTest, self).setUp()
+        cache.clear()
+        self.club = create_club()
+        self.team = Team.objects.create(name='1', club=self.club)
+        self.user = User.objects.create_user('manager', 'manager@example.com', 'secret')
+        self.manager = Person.objects.create(first_name='Club', last_name='Manager', user=self.user)
+        ClubManagerRelation.objects.create(club=self.club, manager=self.manager, validated=True)
+        self.player = Person.objects.create(first_name='New', last_name='Player')
+
+    def post_player(self, user):
+        uri = '/api/v1/teamplayerrelation/?username={0}&api_key={1}'.format(user.username, user.api_key.key)
+        data = {'team': '/api/v1/team/{0}/'.format(self.team.id), 'player': '/api/v1/person/{0}/'.format(self.player.id)}
+        response = self.api_client.post(uri, format='json', data=data)
+        self.assertHttpCreated(response)
+        return TeamPlayerRelation.objects.get(id=self.deserialize(response)['id'])
+
+    def test_auto_validate(self):
+        self.assertTrue(self.post_player(self.user).validated)
+
+        other = User.objects.create_user('other', 'other@example.com', 'secret')
+        Person.objects.create(first_name='Other', last_name='Person', user=other)
+        TeamPlayerRelation.objects.all().delete()
+        self.assertFalse(self.post_player(other).validated)
+
+    def test_roles_cached(self):
+        request = HttpRequest()
+        request.user = self.user
+        self.assertTrue(get_roles(request).manages_club(self.club.id))
+
+        request = HttpRequest()
+        request.user = self.user
+        self.assertNumQueries(0, get_roles, request)
+
+        ClubManagerRelation.objects.all().delete()
+        request = HttpRequest()
+        request.user = self.user
+        self.assertFalse(get_roles(request).manages_club(self.club.id))
+
+    def test_bulk_update(self):
+        request = HttpRequest()
+        request.user = self.user
+        self.assertTrue(get_roles(request).manages_club(self.club.id))
+
+        ClubManagerRelation.objects.filter(club=self.club).update(validated=False)
+        request = HttpRequest()
+        request.user = self.user
+        self.assertFalse(get_roles(request).manages_club(self.club.id))
+
+    def test_user_changed(self):
+        other = User.objects.create_user('other', 'other@example.com', 'secret')
+
+        def manages(user):
+            request = HttpRequest()
+            request.user = user
+            roles = get_roles(request)
+            return roles is not None and roles.manages_club(self.club.id)
+
+        self.assertEqual((manages(self.user), manages(other)), (True, False))
+
+        # The old user loses the roles of the person, the new one gains them
+        self.manager.user = other
+        self.manager.save()
+        self.assertEqual((manages(self.user), manages(other)), (False, True))
+
+    def test_update_authorization(self):
+        other = User.objects.create_user('other', 'other@example.com', 'secret')
+        Person.objects.create(first_name='Other', last_name='Person', user=other)
+        uri = '/api/v1/team/{0}/'.format(self.team.id)
+        data = {'name': '2', 'club': '/api/v1/club/{0}/'.format(self.club.id)}
+
+        self.api_client.client.login(username='other', password='secret')
+        self.assertHttpUnauthorized(self.api_client.put(uri, format='json', data=data))
+
+        self.api_client.client.login(username='manager', password='secret')
+        self.assertHttpAccepted(self.api_client.put(uri, format='json', data=data))
+        self.assertEqual(Team.objects.get(id=self.team.id).name, '2')
+
+
+@skipIf(connection.vendor != 'sqlite', 'Query plans are checked with SQLite only')
+class InstrumentationTest(ResourceTestCase):
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        registry.reset()
+        club = create_club()
+        team = Team.objects.create(name='1', club=club)
+        TeamPlayerRelation.objects.create(team=team, player=Person.objects.create(first_name='Player', last_name='1'), validated=True)
+
+    def test_disabled(self):
+        response = self.api_client.get('/api/v1/team/', format='json')
+        self.assertFalse(response.has_header('X-Handball-Queries'))
+        self.assertEqual(registry.snapshot(), {})
+
+    @override_settings(HANDBALL_INSTRUMENTATION=True)
+    def test_headers_and_metrics(self):
+        response = self.api_client.get('/api/v1/team/', format='json')
+        self.assertValidJSONResponse(response)
+        self.assertTrue(int(response['X-Handball-Queries']) > 0)
+        self.assertTrue(float(response['X-Handball-Serialize-Time']) >= 0)
+        self.assertTrue('team@0=' in response['X-Handball-Dehydrate'])
+        self.assertTrue('@1=' in response['X-Handball-Dehydrate'])
+
+        self.api_client.get('/api/v1/team/', format='json')
+        metrics = self.deserialize(self.api_client.get('/api/v1/metrics/', format='json'))
+        self.assertTrue(metrics['enabled'])
+        self.assertEqual(metrics['endpoints']['team:list']['requests'], 2)
+        self.assertEqual(metrics['endpoints']['team:list']['dehydrate']['team@0']['calls'], 2)
+
+    def test_metrics_internal_only(self):
+        response = self.client.get('/api/v1/metrics/', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 403)
+
+
+class BenchmarkTest(ResourceTestCase):
+    def test_generate_league(self):
+        counts = generate_league(events=1000, seed=1)
+
+        self.assertEqual(counts['Game'], 20)
+        self.assertEqual(counts['Event'], 1000)
+        self.assertEqual(Event.objects.count(), 1000)
+        self.assertEqual(GroupTeamRelation.objects.filter(games__gt=0).count(), 12)
+
+        # Scores are derived from the events
+        game = Game.objects.all()[0]
+        goals = Event.objects.filter(game=game, event_type__in=('goal', 'penalty_shot_goal'))
+        self.assertEqual(game.score_home, goals.filter(team=game.home).count())
+
+        # Sequences continue after the generated keys
+        self.assertTrue(Union.objects.create(name='After').id > Union.objects.order_by('-id')[1].id)
+
+        # No official is booked for overlapping games
+        for game in Game.objects.all():
+            OfficialAssignment.objects.check_game(game)
+
+        # Pass numbers continue after the existing ones and the objects of both leagues are told apart, even though
+        # their names are the same
+        generate_league(events=100, seed=2)
+        self.assertEqual(Club.objects.filter(name='Club 0').count(), 2)
+        for game in Game.objects.all():
+            self.assertEqual((game.events.count(), game.players.count()), (50, 24))
+            self.assertEqual(game.home.club.district.union_id, game.group.union_id)
+        self.assertEqual(Person.objects.exclude(pass_number=None).values('pass_number').distinct().count(),
+            Person.objects.exclude(pass_number=None).count())
+
+    def test_run_benchmark(self):
+        generate_league(events=500, seed=1)
+        # Archive the first week so the archive resources have something to serve as well
+        archive_season(Season.objects.create(name='2012', start=datetime.date(2012, 9, 1), end=datetime.date(2012, 9, 7)))
+        report = run_benchmark(iterations=2, limit=5)
+
+        for name in v1_api._registry:
+            self.assertTrue(name + ':list' in report['endpoints'])
+            self.assertTrue(name + ':detail' in report['endpoints'])
+        self.assertTrue('standings' in report['endpoints'])
+        self.assertEqual(report['meta']['rows']['Event'] + report['meta']['rows']['ArchivedEvent'], 500)
+
+        result = report['endpoints']['game:list']
+        for key in ('queries_first', 'queries', 'bytes', 'ms_p50', 'ms_p90', 'ms_p99', 'ms_max'):
+            self.assertTrue(key in result)
+
+        self.assertEqual(compare_reports(report, report), [])
+        slower = {'endpoints': {'game:list': dict(result, queries=result['queries'] + 1)}}
+        self.assertEqual(len(compare_reports(report, slower)), 1)
+
+
+class QueryPlanTest(TransactionTestCase):
+    """
+        Makes sure the hot queries are answered through indexes on a realistically sized database.
+        ANALYZE commits the test data, so this can't run inside a test transaction.
+    """
+    def setUp(self):
+        unions = bulk_create(Union, [Union(name='Union ' + str(i)) for i in range(5)])
+        districts = bulk_create(District, [District(name='District ' + str(i), union_id=unions[i % 5]) for i in range(50)])
+        sites = bulk_create(Site, [Site(address='Hallenweg ' + str(i), city='Stadt', zip_code=10000 + i, number=i) for i in range(500)])
+        clubs = bulk_create(Club, [Club(name='Club ' + str(i), district_id=districts[i % 50], home_site_id=sites[i]) for i in range(500)])
+        teams = bulk_create(Team, [Team(name=str(i), club_id=clubs[i % 500]) for i in range(1500)])
+        persons = bulk_create(Person, [Person(first_name='First ' + str(i), last_name='Last ' + str(i), pass_number=i) for i in range(5000)])
+        groups = bulk_create(Group, [Group(name='Group ' + str(i), kind='league', age_group='adults', district_id=districts[i % 50]) for i in range(100)])
+
+        bulk_create(ClubMemberRelation, [ClubMemberRelation(member_id=persons[i], club_id=clubs[i % 500]) for i in range(5000)])
+        bulk_create(TeamPlayerRelation, [TeamPlayerRelation(player_id=persons[i], team_id=teams[i % 1500]) for i in range(5000)])
+        bulk_create(TeamManagerRelation, [TeamManagerRelation(manager_id=persons[i], team_id=teams[i]) for i in range(1500)])
+        bulk_create(ClubManagerRelation, [ClubManagerRelation(manager_id=persons[i], club_id=clubs[i]) for i in range(500)])
+        bulk_create(GroupTeamRelation, [GroupTeamRelation(group_id=groups[i % 100], team_id=teams[i]) for i in range(1500)])
+
+        start = datetime.datetime(2012, 9, 1, 18)
+        games = bulk_create(Game, [Game(start=start + datetime.timedelta(hours=i), score_home=20, score_away=20, home_id=teams[i % 1500],
+            away_id=teams[(i + 1) % 1500], referee_id=persons[i], timer_id=persons[i], secretary_id=persons[i], supervisor_id=persons[i],
+            group_id=groups[i % 100], site_id=sites[i % 500]) for i in range(2000)])
+        bulk_create(Event, [Event(time=i % 60, event_type='goal', person_id=persons[i % 5000], game_id=games[i % 2000],
+            team_id=teams[i % 1500]) for i in range(20000)])
+        SearchTerm.objects.bulk_create([SearchTerm(kind=SearchEntry.objects.KINDS[i % 3], object_id=i // 3, trigram='abc')
+            for i in range(20000)])
+
+        connection.cursor().execute('ANALYZE')
+
+        self.person, self.club, self.team, self.group, self.game = persons[100], clubs[100], teams[100], groups[10], games[10]
+
+    def assertIndexed(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        scans = [row[-1] for row in cursor.fetchall() if row[-1].startswith('SCAN')]
+        self.assertFalse(scans, 'Full scan in {0}: {1}'.format(sql, scans))
+
+    def test_query_plans(self):
+        self.assertIndexed(ClubMemberRelation.objects.filter(member=self.person, club=self.club))
+        self.assertIndexed(ClubMemberRelation.objects.filter(member__in=[self.person, self.person + 1]))
+        self.assertIndexed(TeamPlayerRelation.objects.filter(team=self.team, player=self.person))
+        self.assertIndexed(TeamPlayerRelation.objects.filter(team__in=[self.team, self.team + 1]))
+        self.assertIndexed(TeamPlayerRelation.objects.filter(player=self.person, validated=True))
+        self.assertIndexed(GroupTeamRelation.objects.filter(team=self.team, group=self.group))
+        self.assertIndexed(GroupTeamRelation.objects.filter(group=self.group))
+        self.assertIndexed(TeamManagerRelation.objects.filter(team__in=[self.team]))
+        self.assertIndexed(ClubManagerRelation.objects.filter(club__in=[self.club]))
+        self.assertIndexed(ClubManagerRelation.objects.filter(manager=self.person, validated=True))
+        self.assertIndexed(Person.objects.filter(pass_number=100))
+        self.assertIndexed(Person.objects.filter(first_name='First 100', last_name='Last 100'))
+        self.assertIndexed(Event.objects.filter(game=self.game).order_by('time'))
+        self.assertIndexed(Game.objects.filter(group=self.group))
+        # SearchEntry.objects.remove deletes the terms of saved objects this way
+        self.assertIndexed(SearchTerm.objects.filter(kind='person', object_id__in=[self.person, self.person + 1]))
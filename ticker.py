@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+    Live feeds of the events of running games.
+
+    Every change of an event bumps the version of its game and records the new version on the event, or on a tombstone
+    if the event was deleted (see record_event_changes). The bump locks the game's row until the change is committed,
+    so once a version of a game can be read, all changes up to it can be read as well. Viewers pass the version they
+    have seen last as cursor and get the events added, changed or deleted after it. The cursor only depends on the
+    database, so it is valid for every process. An edited event is sent again with the same id, a deleted one as
+    {'id': ..., 'deleted': True}.
+
+    Every process keeps a feed per watched game with the changes it has read. The feed only reads the changes after
+    the last version it has seen when the version has changed or when a save in this process wakes it up, once per
+    feed for all of its viewers. Changes made by other processes are picked up by polling the version every
+    POLL_INTERVAL seconds while viewers are waiting.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from handball.models import DeletedEvent, Event, Game
+
+# Seconds between database reads while viewers are waiting for new events
+POLL_INTERVAL = 2
+
+# Seconds a server-sent event stream is kept open, clients reconnect with their last cursor afterwards
+STREAM_DURATION = getattr(settings, 'HANDBALL_TICKER_STREAM_DURATION', 30)
+
+# Number of feeds kept in memory, the least recently read ones are dropped first
+MAX_FEEDS = 200
+
+# Event fields returned by feeds
+EVENT_FIELDS = ('id', 'time', 'event_type', 'person', 'person__first_name', 'person__last_name', 'team')
+
+# Cursor of viewers that haven't seen any events yet
+START = 0
+
+
+def parse_cursor(value):
+    """
+        Converts a cursor into a game version, raises a ValueError if it is invalid
+    """
+    if value in (None, ''):
+        return START
+    return max(START, int(value))
+
+
+def format_cursor(version):
+    return str(version)
+
+
+def game_version(game_id):
+    versions = Game.objects.filter(id=game_id).values_list('version', flat=True)[:1]
+    return versions[0] if versions else 0
+
+
+class GameFeed(object):
+    """
+        The events of a single game, shared between all its viewers
+    """
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.condition = threading.Condition()
+        self.changes = {}  # Event id -> (version, event or tombstone)
+        self.version = START
+        self.stale = True
+        self.refreshed = 0
+
+    def refresh(self):
+        """
+            Reads the changes after the last version read. Must be called with the condition acquired.
+        """
+        self.refreshed = time.time()
+        version = game_version(self.game_id)
+        if version == self.version:
+            self.stale = False
+            return
+
+        # Changes committed after the version was read are left to the next refresh
+        versions = {'version__gt': self.version, 'version__lte': version}
+        for row in Event.objects.filter(game=self.game_id, **versions).values('version', *EVENT_FIELDS):
+            self.changes[row['id']] = (row.pop('version'), row)
+        for event_id, deleted in DeletedEvent.objects.filter(game=self.game_id, **versions).values_list('event_id', 'version'):
+            self.changes[event_id] = (deleted, {'id': event_id, 'deleted': True})
+
+        self.version = version
+        self.stale = False
+
+    def after(self, cursor):
+        """
+            Returns the events added, changed or deleted after the given cursor in the order of their changes. Viewers
+            that haven't seen any events yet don't get tombstones.
+        """
+        changes = sorted((version, event_id) for event_id, (version, event) in self.changes.items() if version > cursor)
+        events = [self.changes[event_id][1] for version, event_id in changes]
+        return [event for event in events if cursor != START or not event.get('deleted')]
+
+    def read(self, cursor=START, wait=0):
+        """
+            Returns the events after the given cursor and the new cursor. If there are none, waits up to the given number
+            of seconds for new ones.
+        """
+        deadline = time.time() + wait
+
+        with self.condition:
+            while True:
+                if self.stale or time.time() - self.refreshed >= POLL_INTERVAL:
+                    self.refresh()
+
+                events = self.after(cursor)
+                remaining = deadline - time.time()
+                if events or remaining <= 0:
+                    return events, max(cursor, self.version)
+
+                self.condition.wait(min(remaining, POLL_INTERVAL))
+
+    def notify(self):
+        """
+            Wakes up the viewers waiting for new events
+        """
+        with self.condition:
+            self.stale = True
+            self.condition.notify_all()
+
+
+class FeedRegistry(object):
+    """
+        The feeds of the watched games of this process
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.feeds = OrderedDict()
+
+    def get(self, game_id):
+        with self.lock:
+            feed = self.feeds.pop(game_id, None) or GameFeed(game_id)
+            self.feeds[game_id] = feed
+
+            while len(self.feeds) > MAX_FEEDS:
+                self.feeds.popitem(last=False)
+
+            return feed
+
+    def notify(self, game_id):
+        """
+            Wakes up the feed of a game if anybody watches it
+        """
+        with self.lock:
+            feed = self.feeds.get(game_id)
+
+        if feed is not None:
+            feed.notify()
+
+
+feeds = FeedRegistry()
+
+
+def stream(game_id, cursor=START, duration=STREAM_DURATION):
+    """
+        Yields batches of new events of a game with the cursor after them as they come in, until the given number of
+        seconds has passed
+    """
+    deadline = time.time() + duration
+    feed = feeds.get(game_id)
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+
+        events, cursor = feed.read(cursor, remaining)
+        if events:
+            yield events, cursor
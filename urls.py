@@ -21,11 +21,21 @@ v1_api.register(ClubManagerRelationResource())
 v1_api.register(TeamManagerRelationResource())
 v1_api.register(LeagueLevelResource())
 v1_api.register(GroupTeamRelationResource())
+v1_api.register(SeasonResource())
+v1_api.register(ArchivedGameResource())
 
 urlpatterns = patterns('', (r'^', include(v1_api.urls)))
 
 # Non-resource api endpoints
 urlpatterns += patterns('handball.api',
     (r'^v1/unique/$', 'is_unique'),
+    (r'^v1/unique/batch/$', 'validate_unique'),
+    (r'^v1/standings/$', 'standings'),
+    (r'^v1/player_stats/$', 'player_stats'),
+    (r'^v1/search/$', 'search'),
+    (r'^v1/officials/free/$', 'free_officials'),
+    (r'^v1/ticker/$', 'ticker'),
+    (r'^v1/game_sheet/$', 'game_sheet'),
+    (r'^v1/metrics/$', 'metrics'),
     (r'^v1/send_invitation/$', 'send_invitation')
 )